@@ -24,47 +24,85 @@
 @copyright :Copyright (c) 2022
 """
 import gc
-import pm
-import net
 import sif
 import usys
 import utime
 import modem
 import _thread
-import dataCall
 import checkNet
 from misc import Power
 from usr.logging import Logger
+from usr.modules import NetManage, EventLoop, Scheduler, PowerManage, AlarmEngine, option_lock
 from usr.quecthing import QuecObjectModel, QuecThing, QuecOTA
 from usr.xingheng_sif_protocol import XinghengSifProtocol
 from usr.xingheng_rs485_protocol import XinghengRs485Protocol
-from usr.location import NMEAParse, GPS
-from usr.settings import Settings, PROJECT_NAME, PROJECT_VERSION, DEVICE_FIRMWARE_NAME, DEVICE_FIRMWARE_VERSION
+from usr.location import NMEAParse, GPS, GNSSDutyCycle, TrackBuffer, CellLocation, WifiLocation, NetLocation
+from usr.geofence import Geofence
+from usr.settings import Settings, PROJECT_NAME, PROJECT_DELTA_NAME, PROJECT_VERSION, DEVICE_FIRMWARE_NAME, DEVICE_FIRMWARE_VERSION
 
 log = Logger(__name__)
 
-LOWENERGYMAP = {
-    "PM": ["EC200U", "EC600N", "EC800G", "EC800M"],
-    "POWERDOWN": ["EC200U"],
-}
+_downlink_lock = _thread.allocate_lock()
+_alarm_change_lock = _thread.allocate_lock()
 
 
 class BmsBox:
 
+    class _event:
+        bms_frame = 1
+        schedule = 2
+        idle = 3
+        cloud = 4
+        net = 5
+        geofence = 6
+        cloud_state = 7
+        alarm = 8
+        cloud_set = 9
+        cloud_query = 10
+        ota = 11
+        wake = 12
+
     def __init__(self):
         self.__settings = None
         self.__gps = None
+        self.__track = None
+        self.__geofence = None
+        self.__net_loc = None
         self.__nmea_parse = None
         self.__quec_ota = None
         self.__quec_cloud = None
         self.__quec_objmodel = None
         self.__bms_protocol = None
-        self.__lpm_fd = None
-        self.__pm_lock_name = "low_energy_pm_lock"
-        self.__enter_low_power = False
-        self.__last_fault_state = False
+        self.__net_manage = None
+        self.__net_ready = False
+        self.__alarm = None
+        self.__alarm_pending = None
+        self.__alarm_changes = []
+        self.__telemetry = None
+        self.__pending_set = {}
+        self.__pending_query = []
+        self.__pending_ota = []
+        self.__downlink_stats = {"set": 0, "query": 0, "coalesced": 0, "ota": 0}
         self.__data_report_start_timestamp = utime.time()
         self.__report_period_time = 60
+        self.__bms_fresh_timestamp = 0
+        self.__ota_status = {}
+        self.__idle_timeout = 30
+        self.__sleep_timeout = 60
+        self.__wake_timeout = 60
+        self.__power = PowerManage()
+        self.__loop = EventLoop()
+        # Downlink commands must not be lost to a burst of frames or timers.
+        for event in (self._event.ota, self._event.cloud_set, self._event.cloud_query, self._event.alarm):
+            self.__loop.reserve(event)
+        self.__scheduler = Scheduler(self.__loop, self._event.schedule)
+        # Scheduled task name -> user_cfg period key, changed at runtime through the object model.
+        self.__task_periods = {
+            "telemetry": "reportTimes",
+            "cellVolt": "cellVoltTimes",
+            "deviceInfo": "deviceInfoTimes",
+            "otaSearch": "otaSearchTimes",
+        }
         
 
     def __format_loc_method(self, data):
@@ -80,56 +118,91 @@ class BmsBox:
         return str(utime.mktime(utime.localtime()) * 1000)
 
     def __get_net_status(self):
-        checknet_timeout = self.__settings.get()["user_cfg"]["checknet_timeout"]
+        checknet_timeout = self.__settings.snapshot().user_cfg.checknet_timeout
         checknet = checkNet.CheckNetwork(PROJECT_NAME, PROJECT_VERSION)
         check_res = checknet.wait_network_connected(checknet_timeout)
         log.debug("DeviceCheck.net res: %s" % str(check_res))
         return check_res
 
-    def __net_datacall(self):
-        data_call_info = dataCall.getInfo(1, 0)
-        return True if isinstance(data_call_info, tuple) and data_call_info[2][0] == 1 else False
-
-    def __net_connect(self):
-        if not self.__net_datacall():
-            net.setModemFun(4)
-            utime.sleep_ms(200)
-            net.setModemFun(1)
-            count = 0
-            while True:
-                if self.__net_datacall():
-                    break
-                count += 1
-                if count > 10:
-                    break
-                utime.sleep(count)
+    def __net_callback(self, ready):
+        """NetManage readiness event, runs on the network supervisor thread."""
+        self.__net_ready = ready
+        self.__loop.post(self._event.net, ready)
+
+    def __on_net(self, ready):
+        if ready and self.__power.state != PowerManage._state.sleep and not self.__quec_cloud.is_online():
+            self.__quec_cloud.reconnect()
 
     def __get_location(self):
         res = {}
-        loc_method = self.__settings.get()["loc_cfg"]["loc_method"]
-        if loc_method & self.__gps._loc_method.gps:
-            gps_res = self.__gps.read(retry=30)
-            if gps_res[0] == 0:
-                self.__nmea_parse.set_gps_data(gps_res[1])
-                res['gps'] = [self.__nmea_parse.GxRMC, self.__nmea_parse.GxGGA, self.__nmea_parse.GxVTG]
+        loc_cfg = self.__settings.snapshot().loc_cfg
+        if loc_cfg.loc_method & self.__gps._loc_method.gps:
+            # Served from the background acquisition, never waits for the receiver.
+            fix = self.__gps.get_fix(loc_cfg.get("fix_max_age", 120))
+            if fix:
+                res["gps"] = [i for i in fix["nmea"] if i]
+                res["gpsFixTime"] = fix["timestamp"]
                 return res
+        if self.__net_loc is not None and loc_cfg.loc_method & (GPS._loc_method.cell | GPS._loc_method.wifi):
+            # Result of the lookup started with the last report, one period plus the fix age old at most.
+            loc = self.__net_loc.get(loc_cfg.get("fix_max_age", 120) + self.__report_period_time)
+            if loc:
+                res["lbsLocation"] = self.__format_lbs_location(loc)
         return res
 
-    def __init_alarm_data(self):
-        return self.__bms_protocol.get_alarm_data()
+    def __format_lbs_location(self, loc):
+        return {
+            "lon": int(loc["lon"] * 1000000),
+            "lat": int(loc["lat"] * 1000000),
+            "accuracy": int(loc["accuracy"]),
+            "source": getattr(GPS._loc_method, loc["source"]),
+            "time": loc["timestamp"],
+        }
+
+    def __format_gps_location(self, fix):
+        return {
+            "lon": int(fix["lon"] * 1000000),
+            "lat": int(fix["lat"] * 1000000),
+            "time": fix["timestamp"],
+        }
+
+    def __telemetry_snapshot(self):
+        """BMS report data cached until the next frame plus the last known position, nothing is acquired."""
+        if self.__telemetry is None:
+            self.__telemetry = self.__bms_protocol.get_report_data()
+        snapshot = dict(self.__telemetry)
+        user_cfg = self.__settings.snapshot().user_cfg
+        for key in self.__task_periods.values():
+            if key in user_cfg:
+                snapshot[key] = user_cfg[key]
+        fix = self.__gps.get_fix()
+        if fix:
+            snapshot["gpsFixTime"] = fix["timestamp"]
+            snapshot["gpsLocation"] = self.__format_gps_location(fix)
+        loc = self.__net_loc.get() if self.__net_loc is not None else None
+        if loc:
+            snapshot["lbsLocation"] = self.__format_lbs_location(loc)
+        return snapshot
+
+    def __net_loc_request(self):
+        """Start a cell/Wi-Fi lookup next to the GNSS acquisition while there is no fresh GPS fix."""
+        if self.__net_loc is None:
+            return False
+        loc_cfg = self.__settings.snapshot().loc_cfg
+        method = loc_cfg.loc_method & (GPS._loc_method.cell | GPS._loc_method.wifi)
+        if not method:
+            return False
+        if loc_cfg.loc_method & GPS._loc_method.gps and self.__gps.get_fix(loc_cfg.get("fix_max_age", 120)):
+            return False
+        return self.__net_loc.request(method)
 
     def __report_cell_volt_data(self):
         res = False
-        data = []
-        i = 0
-        print("battery_serial_num:",self.__bms_protocol.__battery_serial_num)
-        print("cell_volt len:", len(self.__bms_protocol.__cell_volt))
-        if self.__bms_protocol.__battery_serial_num == 0:
+        cell_volt = self.__bms_protocol.get_cell_volt()
+        if not cell_volt:
             return False
         try:
-            while i < self.__bms_protocol.__battery_serial_num:
-                data.append({1: i+1, 2: self.__bms_protocol.__cell_volt[i]})
-                i += 1
+            data = [{1: i + 1, 2: cell_volt[i]} for i in range(len(cell_volt))]
             _data = {27: data}
             res = self.__quec_cloud.objmodel_report(_data)
             log.debug("cell volt report %s." % ("success" if res else "falied"))
@@ -137,11 +210,39 @@ class BmsBox:
             usys.print_exception(e)
         return res
 
+    def __report_track(self):
+        """Upload the simplified track recorded since the last successful upload."""
+        if self.__track is None or not self.__cloud_conn_status():
+            return False
+        batch = self.__track.batch()
+        if not batch["points"]:
+            return False
+        res = self.__quec_cloud.objmodel_report({88: batch["points"]})
+        log.debug("track report %s points %s." % (len(batch["points"]), "success" if res else "falied"))
+        if res:
+            self.__track.commit(batch)
+        return res
+
+    def __report_geofence_events(self):
+        """Send queued fenceIn/fenceOut events, they stay queued while the cloud is unreachable."""
+        if self.__geofence is None:
+            return
+        events = self.__geofence.events()
+        if not events or not self.__cloud_conn_status():
+            return
+        sent = None
+        for seq, event in events:
+            if not self.__data_report(event):
+                break
+            sent = seq
+        if sent is not None:
+            self.__geofence.ack(sent)
+
     def __init_report_data(self):
         _data = {}
         _data.update(self.__get_location())
         _data.update(self.__bms_protocol.get_report_data())
-        _data.update({"reportTimes": self.__settings.get()["user_cfg"]["reportTimes"]})
+        _data.update({"reportTimes": self.__settings.snapshot().user_cfg.reportTimes})
         return _data
 
     def __data_report(self, data):
@@ -181,16 +282,62 @@ class BmsBox:
                 log.debug("Settings set %s %s to %s %s" % (mode, k, v, "success" if res else "falied"))
         self.__settings.save()
 
+    def __set_task_period(self, key, period):
+        for name, _key in self.__task_periods.items():
+            if _key == key:
+                if name == "telemetry":
+                    self.__report_period_time = period
+                self.__scheduler.set_period(name, period)
+
+    def __settings_changed(self, snapshot, changed):
+        """Settings subscriber, runs on the thread that set them."""
+        for mode, key in changed:
+            if mode == "user_cfg":
+                self.__set_task_period(key, snapshot.user_cfg[key])
+
     def __set_objmodel(self, data):
         data = self.__quec_objmodel.convert_to_client(data)
         log.debug("set_objmodel data: %s" % str(data))
-        self.__set_config(data)
+        if "geofence" in data:
+            fences = data.pop("geofence")
+            if self.__geofence is not None:
+                log.debug("Geofence set %s fences." % self.__geofence.save_text(fences))
+        if data:
+            self.__set_config(data)
 
     def __query_objmodel(self, data):
+        """Answer a property query with the requested ids only, from the telemetry snapshot."""
         objmodel_codes = [self.__quec_objmodel.id_code.get(i) for i in data if self.__quec_objmodel.id_code.get(i)]
-        log.debug("query_objmodel ids: %s, codes: %s" % (str(data, str(objmodel_codes))))
-        report_data = self.__init_report_data()
-        self.__data_report(report_data)
+        log.debug("query_objmodel ids: %s, codes: %s" % (str(data), str(objmodel_codes)))
+        snapshot = self.__telemetry_snapshot()
+        report_data = {}
+        for code in objmodel_codes:
+            if code in snapshot:
+                report_data[code] = snapshot[code]
+        if report_data:
+            self.__data_report(report_data)
+
+    def __set_ota_status(self, target_module, target_version, status):
+        if target_module is not None:
+            self.__ota_status["component"] = target_module
+        if target_version is not None:
+            self.__ota_status["target_version"] = target_version
+        self.__ota_status["status"] = status
+        log.debug("OTA status: %s" % str(self.__ota_status))
+
+    def __sota_delta_enabled(self, _settings):
+        user_cfg = _settings["user_cfg"]
+        return user_cfg["sota"] == True and user_cfg.get("sota_delta", True) == True and \
+            user_cfg.get("sota_delta_failed", "") != PROJECT_VERSION
+
+    def __ota_result(self, result):
+        if result == QuecOTA.result.delta_failed:
+            # Stop taking delta plans for this version and ask for the full package instead.
+            log.warn("Delta SOTA failed on %s, fall back to the full package." % PROJECT_VERSION)
+            self.__settings.set("user_cfg", "sota_delta_failed", PROJECT_VERSION)
+            self.__settings.save()
+            self.__set_ota_status(None, None, 4)
+            self.__quec_cloud.ota_search()
 
     def __ota_plain_check(self, target_module, target_version, battery_limit, min_signal_intensity, use_space):
         _settings = self.__settings.get()
@@ -198,6 +345,8 @@ class BmsBox:
             source_version = DEVICE_FIRMWARE_VERSION
         elif target_module == PROJECT_NAME and _settings["user_cfg"]["sota"] == True:
             source_version = PROJECT_VERSION
+        elif target_module == PROJECT_DELTA_NAME and self.__sota_delta_enabled(_settings):
+            source_version = PROJECT_VERSION
         else:
             return
         if target_version != source_version:
@@ -238,28 +387,33 @@ class BmsBox:
             self.__set_ota_status(None, None, 4)
 
     def __cloud_conn_status(self):
-        if not self.__quec_cloud.status:
-            self.__net_connect()
-        if not self.__quec_cloud.status:
-            disconn_res = self.__quec_cloud.disconnect()
-            conn_res = self.__quec_cloud.connect()
-            log.debug("Quec cloud reconnect. disconnect: %s connect: %s" % (disconn_res, conn_res))
-        return self.__quec_cloud.status
-
-    def __pm_init(self):
-        """Enable power management(低功耗)
-        """
-        pm.autosleep(1)
-        if not self.__lpm_fd:
-            self.__lpm_fd = pm.create_wakelock(self.__pm_lock_name, len(self.__pm_lock_name))
+        if not self.__net_ready:
+            return False
+        if not self.__quec_cloud.is_online():
+            self.__quec_cloud.reconnect()
+            return False
+        return True
 
     def add_module(self, module):
         if isinstance(module, Settings):
             self.__settings = module
+            module.subscribe(self.__settings_changed)
             return True
         elif isinstance(module, GPS):
             self.__gps = module
             return True
+        elif isinstance(module, TrackBuffer):
+            self.__track = module
+            self.__gps.set_track(module)
+            return True
+        elif isinstance(module, Geofence):
+            self.__geofence = module
+            self.__gps.set_geofence(module)
+            module.set_callback(self.__geofence_callback)
+            return True
+        elif isinstance(module, NetLocation):
+            self.__net_loc = module
+            return True
         elif isinstance(module, XinghengSifProtocol) or isinstance(module, XinghengRs485Protocol):
             self.__bms_protocol = module
             return True
@@ -268,33 +422,287 @@ class BmsBox:
             return True
         elif isinstance(module, QuecThing):
             self.__quec_cloud = module
+            module.on_state_change(self.__cloud_state_callback)
             return True
         elif isinstance(module, QuecOTA):
             self.__quec_ota = module
+            module.set_callback(self.__ota_result)
             return True
         elif isinstance(module, NMEAParse):
             self.__nmea_parse = module
             return True
+        elif isinstance(module, AlarmEngine):
+            self.__alarm = module
+            module.set_callback(self.__alarm_callback)
+            return True
+        elif isinstance(module, NetManage):
+            self.__net_manage = module
+            self.__net_ready = module.is_ready()
+            module.add_callback(self.__net_callback)
+            return True
 
         return False
 
-    def __report_alarm_data(self):
-        """Check the battery fault state, send data to the cloud
+    def __gps_activity(self):
+        """Hand new battery current readings to the GNSS duty cycle as a motion hint."""
+        fresh_timestamp = self.__bms_protocol.get_data_fresh_timestamp()
+        if fresh_timestamp != self.__bms_fresh_timestamp:
+            self.__bms_fresh_timestamp = fresh_timestamp
+            self.__gps.set_activity(self.__bms_protocol.get_report_data().get("current"))
+
+    @option_lock(_alarm_change_lock)
+    def __queue_alarm(self, change):
+        self.__alarm_changes.append(change)
+
+    @option_lock(_alarm_change_lock)
+    def __take_alarms(self):
+        changes = self.__alarm_changes
+        self.__alarm_changes = []
+        return changes
+
+    def __alarm_callback(self, raised, cleared, ticks):
+        """AlarmEngine change, runs in the protocol decode.
+
+        The change is queued here, AlarmEngine has already committed it,
+        and the loop keeps a slot for the data-less alarm event.
         """
-        if self.__bms_protocol.get_battery_fault_state() and self.__last_fault_state == False:
-            report_data = self.__init_alarm_data()
-            self.__data_report(report_data)
-            self.__report_cell_volt_data()
-        elif self.__bms_protocol.get_battery_fault_state() == False and self.__last_fault_state == True:
-                report_data = self.__init_alarm_data()
-                self.__data_report(report_data)
+        self.__queue_alarm((raised, cleared, ticks))
+        self.__loop.post(self._event.alarm)
+
+    def __on_alarm(self, data):
+        """Report confirmed fault changes: an event per raised fault, the fault code when one clears.
+
+        Every change queued since the last run goes out in one report, a
+        fault raised and cleared meanwhile is reported both ways.
+        """
+        changes = self.__take_alarms()
+        if self.__alarm_pending:
+            # Changes the cloud missed go out with these, latency counts from the oldest.
+            changes.insert(0, self.__alarm_pending)
+            self.__alarm_pending = None
+        if not changes:
+            return
+        raised, cleared, ticks = [], [], changes[0][2]
+        for _raised, _cleared, _ticks in changes:
+            raised.extend([i for i in _raised if i not in raised])
+            cleared.extend([i for i in _cleared if i not in cleared])
+        if not raised and not cleared:
+            return
+        report_data = self.__bms_protocol.get_alarm_data(raised)
+        if not report_data:
+            return
+        if self.__data_report(report_data):
+            latency = self.__alarm.reported(ticks)
+            log.debug("Alarm raised %s cleared %s reported %s ms after the frame." % (raised, cleared, latency))
+            if raised:
                 self.__report_cell_volt_data()
-        self.__last_fault_state = self.__bms_protocol.get_battery_fault_state()
+        else:
+            self.__alarm_pending = (raised, cleared, ticks)
+
+    def __bms_frame_callback(self):
+        self.__loop.post(self._event.bms_frame)
+
+    def __geofence_callback(self, fence_id, entered, fix):
+        self.__loop.post(self._event.geofence)
+
+    def __cloud_state_callback(self, state):
+        self.__loop.post(self._event.cloud_state, state)
+
+    def __on_cloud_state(self, state):
+        # Back online after a wake up, the first report ends the wake state.
+        if state == QuecThing._conn_state.online and self.__power.state == PowerManage._state.wake:
+            self.__scheduler.trigger("telemetry")
+        if state == QuecThing._conn_state.online and self.__alarm_pending:
+            self.__loop.post(self._event.alarm)
+
+    def __on_bms_frame(self, data):
+        self.__telemetry = None
+        state = self.__power.state
+        if state == PowerManage._state.sleep:
+            self.__power.set_state(PowerManage._state.wake)
+        elif state == PowerManage._state.idle:
+            self.__power.set_state(PowerManage._state.active)
+        self.__gps_activity()
+
+    def __report_telemetry(self):
+        report_data = self.__init_report_data()
+        if self.__data_report(report_data):
+            latency = self.__power.woke()
+            if latency is not None:
+                log.debug("First report %s ms after wake up." % latency)
+        self.__report_track()
+        log.debug("report data to quecthing")
+        self.__data_report_start_timestamp = utime.time()
+        next_report = self.__scheduler.next_deadline("telemetry")
+        if next_report is not None:
+            self.__gps.set_next_report(self.__data_report_start_timestamp + next_report // 1000)
+        self.__net_loc_request()
+        # Fence events left over while the cloud was unreachable.
+        self.__report_geofence_events()
+
+    def __report_device_info(self):
+        if self.__cloud_conn_status():
+            _res = self.__quec_cloud.device_report()
+            log.debug("Quec device report %s" % ("success" if _res else "falied"))
+
+    def __ota_search(self):
+        if self.__cloud_conn_status():
+            _res = self.__quec_cloud.ota_search()
+            log.debug("Quec ota search %s" % ("success" if _res else "falied"))
+
+    def __schedule_tasks(self, user_cfg):
+        """Register the periodic cloud tasks, ordered by priority when due together."""
+        scheduler = self.__scheduler
+        scheduler.add("telemetry", self.__report_telemetry, period=user_cfg["reportTimes"], priority=0)
+        scheduler.add("cellVolt", self.__report_cell_volt_data, period=user_cfg.get("cellVoltTimes", 300),
+                      jitter=5, priority=1)
+        # Device info and OTA search go out shortly after boot, then spread over the fleet by jitter.
+        scheduler.add("deviceInfo", self.__report_device_info, period=user_cfg.get("deviceInfoTimes", 86400),
+                      delay=10, jitter=60, priority=2)
+        scheduler.add("otaSearch", self.__ota_search, period=user_cfg.get("otaSearchTimes", 3600),
+                      delay=15, jitter=60, priority=3)
+
+    def __on_idle(self, data):
+        """Step down active -> idle -> sleep while no BMS data arrives, waiting out the rest of each timeout.
+
+        A wake up whose BMS goes quiet again before a report gets out goes
+        back to sleep after idle_timeout, see __on_wake for a busy BMS.
+        """
+        state = self.__power.state
+        if state == PowerManage._state.sleep:
+            return
+        timeout = self.__idle_timeout
+        if state == PowerManage._state.idle:
+            timeout += self.__sleep_timeout
+        quiet = utime.time() - self.__bms_protocol.get_data_fresh_timestamp()
+        if quiet < timeout:
+            self.__loop.start_timer(self._event.idle, (timeout - quiet) * 1000)
+        elif state == PowerManage._state.active:
+            self.__power.set_state(PowerManage._state.idle)
+        else:
+            self.__power.set_state(PowerManage._state.sleep)
+
+    def __on_wake(self, data):
+        """wake_timeout after waking up without a report, whatever the BMS does.
+
+        With BMS frames still coming in the box is in use: go active, which
+        drops the wakelock held for the wake state, the scheduled reports
+        retry while the cloud is unreachable. A quiet BMS goes back to sleep.
+        """
+        if self.__power.state != PowerManage._state.wake:
+            return
+        quiet = utime.time() - self.__bms_protocol.get_data_fresh_timestamp()
+        log.warn("No report %s s after waking up, BMS quiet for %s s." % (self.__wake_timeout, quiet))
+        if quiet < self.__idle_timeout:
+            self.__power.set_state(PowerManage._state.active)
+        else:
+            self.__power.set_state(PowerManage._state.sleep)
+
+    def __power_active(self, previous):
+        if previous == PowerManage._state.idle:
+            self.__gps.open()
+            self.__gps.start()
+        self.__loop.start_timer(self._event.idle, self.__idle_timeout * 1000)
+        log.debug("power active")
+
+    def __power_idle(self, previous):
+        """The pack went quiet: the receiver goes off, the cloud stays up for a quick resume."""
+        self.__gps.close()
+        self.__loop.start_timer(self._event.idle, self.__sleep_timeout * 1000)
+        log.debug("power idle")
+
+    def __power_sleep(self, previous):
+        self.__scheduler.suspend()
+        # Disconnect QuecIot
+        self.__quec_cloud.disconnect()
+        if previous == PowerManage._state.wake:
+            self.__gps.close()
+        if isinstance(self.__bms_protocol, XinghengSifProtocol):
+            # Stop acctimer,reduce power consumption
+            sif.acctimer_stop()
+        # No data received, the system sleeps until the next BMS frame.
+        log.debug("enter low power")
+
+    def __power_wake(self, previous):
+        """First BMS frame in sleep, nothing here blocks: the telemetry report goes out
+        as soon as the cloud is back (see __on_cloud_state) and ends the wake state.
+        """
+        self.__gps.open()
+        self.__gps.start()
+        self.__scheduler.resume()
+        # Reconnects in the background when offline.
+        self.__scheduler.trigger("telemetry")
+        self.__loop.start_timer(self._event.idle, self.__idle_timeout * 1000)
+        self.__loop.start_timer(self._event.wake, self.__wake_timeout * 1000)
+        log.debug("exit low power")
+
+    @option_lock(_downlink_lock)
+    def __queue_downlink(self, errcode, data):
+        if errcode == 10210:
+            waiting = bool(self.__pending_set)
+            self.__pending_set.update(data)
+            self.__downlink_stats["set"] += 1
+        else:
+            waiting = bool(self.__pending_query)
+            for i in data:
+                if i not in self.__pending_query:
+                    self.__pending_query.append(i)
+            self.__downlink_stats["query"] += 1
+        if waiting:
+            self.__downlink_stats["coalesced"] += 1
+
+    @option_lock(_downlink_lock)
+    def __queue_ota(self, args):
+        self.__pending_ota.append(args)
+        self.__downlink_stats["ota"] += 1
+
+    @option_lock(_downlink_lock)
+    def __take_ota(self):
+        pending = self.__pending_ota
+        self.__pending_ota = []
+        return pending
+
+    @option_lock(_downlink_lock)
+    def __take_downlink(self, errcode):
+        if errcode == 10210:
+            data = self.__pending_set
+            self.__pending_set = {}
+        else:
+            data = self.__pending_query
+            self.__pending_query = []
+        return data
+
+    def __on_cloud_set(self, data):
+        data = self.__take_downlink(10210)
+        if data:
+            self.__set_objmodel(data)
+
+    def __on_cloud_query(self, data):
+        data = self.__take_downlink(10220)
+        if data:
+            self.__query_objmodel(data)
+
+    def __on_ota(self, data):
+        for args in self.__take_ota():
+            log.debug("QuecIot OTA errcode[%s] data[%s]" % tuple(args))
+            try:
+                self.__ota(*args)
+            except Exception as e:
+                usys.print_exception(e)
+
+    def __on_cloud(self, args):
+        if args[0] == 5 and args[1] == 10200:
+            log.debug("transparent data: %s" % args[1])
+        else:
+            log.error("Mode %s is not support. data: %s" % (str(args[0]), str(args[1])))
 
     def running(self):
         """BMS box main routine
+
+        Everything after the start up runs on the event loop: BMS frames,
+        scheduled reports, the idle timeout, cloud downlinks, network
+        readiness and geofence transitions are events, nothing polls.
         """
-        self.__net_connect()
         _settings = self.__settings.get()
         # QuecIot connect and save device secret.
         if _settings["quec_cloud_cfg"]["dk"] and not _settings["quec_cloud_cfg"]["ds"] and self.__quec_cloud.device_secret:
@@ -302,53 +710,81 @@ class BmsBox:
         self.__report_period_time = _settings["user_cfg"]["reportTimes"]
         # Open gps
         self.__gps.open()
-        self.__pm_init()
-        while True:
-            if self.__enter_low_power == True:
-                # Disconnect QuecIot
-                self.__quec_cloud.disconnect()
-                self.__gps.close()
-                if isinstance(self.__bms_protocol, XinghengSifProtocol):
-                    # Stop acctimer,reduce power consumption
-                    sif.acctimer_stop()
-                # No data received, the system enters low power mode
-                log.debug("enter low power")
-                if self.__bms_protocol.received_data():
-                    self.__quec_cloud.connect()
-                    self.__gps.open()
-                    log.debug("exit low power")
-                    self.__enter_low_power = False
-            else: 
-                if utime.time() - self.__data_report_start_timestamp >= self.__report_period_time:
-                    report_data = self.__init_report_data()
-                    self.__data_report(report_data)
-                    self.__report_cell_volt_data()
-                    log.debug("report data to quecthing")
-                    # Device version report and OTA plain search
-                    if self.__cloud_conn_status():
-                        _res = self.__quec_cloud.device_report()
-                        log.debug("Quec device report %s" % "success" if _res else "falied")
-                        _res = self.__quec_cloud.ota_search()
-                        log.debug("Quec ota search %s" % "success" if _res else "falied")
-                    self.__data_report_start_timestamp = utime.time()
-                # Report battery alarm infomation
-                self.__report_alarm_data()
-                if utime.time() - self.__bms_protocol.get_data_fresh_timestamp() >= 30:
-                    self.__enter_low_power = True
-            utime.sleep_ms(50)
+        self.__gps.start()
+        self.__gps.set_next_report(self.__data_report_start_timestamp + self.__report_period_time)
+        self.__net_loc_request()
+
+        power = self.__power
+        power.init()
+        power.add_handler(PowerManage._state.active, self.__power_active)
+        power.add_handler(PowerManage._state.idle, self.__power_idle)
+        power.add_handler(PowerManage._state.sleep, self.__power_sleep)
+        power.add_handler(PowerManage._state.wake, self.__power_wake)
+
+        loop = self.__loop
+        loop.set_wakelock(power)
+        loop.add_handler(self._event.bms_frame, self.__on_bms_frame)
+        loop.add_handler(self._event.idle, self.__on_idle)
+        loop.add_handler(self._event.wake, self.__on_wake)
+        loop.add_handler(self._event.cloud, self.__on_cloud)
+        loop.add_handler(self._event.cloud_set, self.__on_cloud_set)
+        loop.add_handler(self._event.cloud_query, self.__on_cloud_query)
+        loop.add_handler(self._event.ota, self.__on_ota)
+        loop.add_handler(self._event.net, self.__on_net)
+        loop.add_handler(self._event.cloud_state, self.__on_cloud_state)
+        loop.add_handler(self._event.geofence, lambda data: self.__report_geofence_events())
+        self.__bms_protocol.set_callback(self.__bms_frame_callback)
+        if self.__alarm is not None:
+            loop.add_handler(self._event.alarm, self.__on_alarm)
+            self.__bms_protocol.set_alarm(self.__alarm)
+        self.__schedule_tasks(_settings["user_cfg"])
+        loop.start_timer(self._event.idle, self.__idle_timeout * 1000)
+        loop.run()
+
+    @property
+    def loop_stats(self):
+        """EventLoop wakeups and per event counts."""
+        return self.__loop.stats
+
+    @property
+    def task_stats(self):
+        """Scheduler runs and worst lateness per task."""
+        return self.__scheduler.stats
+
+    @property
+    def alarm_stats(self):
+        """AlarmEngine debounce counts and frame to cloud latency, report ack latency of the cloud."""
+        stats = self.__alarm.stats if self.__alarm is not None else {}
+        stats["ack"] = self.__quec_cloud.ack_stats
+        return stats
+
+    @property
+    def power_stats(self):
+        """Power state, time per state, wakelock held time and wake latency in ms."""
+        return self.__power.stats
+
+    @property
+    def downlink_stats(self):
+        """Set and query commands received and the ones merged into a waiting one."""
+        return dict(self.__downlink_stats)
 
     def execute(self, args):
-        if args[0] == 5 and args[1] == 10200:
-            log.debug("transparent data: %s" % args[1])
-        elif args[0] == 5 and args[1] == 10210:
-            self.__set_objmodel(args[2])
-        elif args[0] == 5 and args[1] == 10220:
-            self.__query_objmodel(args[2])
+        """QuecThing downlink callback on the SDK thread: queue the command and return.
+
+        Set and query commands still waiting for the loop are merged, later
+        values win and query ids are joined, so a burst costs one settings
+        save and one answer. OTA events are queued in order and handled
+        together. The loop keeps a slot for these events, so they are never
+        dropped when it is full.
+        """
+        if args[0] == 5 and args[1] in (10210, 10220) and len(args) > 2 and args[2]:
+            self.__queue_downlink(args[1], args[2])
+            self.__loop.post(self._event.cloud_set if args[1] == 10210 else self._event.cloud_query)
         elif args[0] == 7:
-            log.debug("QuecIot OTA errcode[%s] data[%s]" % tuple(args[1:]))
-            self.__ota(*args[1:])
+            self.__queue_ota(args[1:])
+            self.__loop.post(self._event.ota)
         else:
-            log.error("Mode %s is not support. data: %s" % (str(args[0]), str(args[1])))
+            self.__loop.post(self._event.cloud, args)
 
 
 def main():
@@ -362,12 +798,25 @@ def main():
     settings = Settings()
     _settings = settings.get()
 
-    quec_ota = QuecOTA()
+    net_manage = NetManage()
+
+    quec_ota = QuecOTA(version=PROJECT_VERSION)
     quec_objmodel = QuecObjectModel()
     quec_cloud = QuecThing(**_settings["quec_cloud_cfg"])
 
     nema_parse = NMEAParse()
     gps = GPS(**_settings["loc_cfg"]["gps_cfg"])
+    duty_cfg = dict(_settings["loc_cfg"].get("duty_cfg", {}))
+    if duty_cfg.pop("enable", False):
+        gps.set_duty_cycle(GNSSDutyCycle(**duty_cfg))
+    track_cfg = dict(_settings["loc_cfg"].get("track_cfg", {}))
+    track = TrackBuffer(**track_cfg) if track_cfg.pop("enable", False) else None
+    geofence_cfg = dict(_settings["loc_cfg"].get("geofence_cfg", {}))
+    geofence = Geofence(**geofence_cfg) if geofence_cfg.pop("enable", False) else None
+    net_loc = NetLocation(
+        cell=CellLocation(**_settings["loc_cfg"]["cell_cfg"]) if "cell_cfg" in _settings["loc_cfg"] else None,
+        wifi=WifiLocation(**_settings["loc_cfg"]["wifi_cfg"]) if "wifi_cfg" in _settings["loc_cfg"] else None,
+    )
     if _settings["user_cfg"]["bms_protocol"] == _bms_protocol.sif:
         bms_protocol = XinghengSifProtocol(gpio = _settings["user_cfg"]["sif_gpio_pin"])
     elif _settings["user_cfg"]["bms_protocol"] == _bms_protocol.rs485:
@@ -389,8 +838,16 @@ def main():
     bms_box.add_module(quec_ota)
     bms_box.add_module(nema_parse)
     bms_box.add_module(gps)
+    if track is not None:
+        bms_box.add_module(track)
+    if geofence is not None:
+        bms_box.add_module(geofence)
+    bms_box.add_module(net_loc)
     bms_box.add_module(bms_protocol)
+    bms_box.add_module(AlarmEngine(**_settings["user_cfg"].get("alarm_cfg", {})))
+    bms_box.add_module(net_manage)
 
+    net_manage.start()
     quec_cloud.set_callback(bms_box.execute)
     quec_cloud.connect()
     _thread.start_new_thread(bms_box.running, ())
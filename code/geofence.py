@@ -0,0 +1,258 @@
+# Copyright (c) Quectel Wireless Solution, Co., Ltd.All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+@file      :geofence.py
+@brief     :Circle and polygon geofences with a grid index and enter/exit events.
+
+Fence text, one fence per line (or separated by ";"):
+
+    C,<id>,<lon>,<lat>,<radius m>
+    P,<id>,<lon1>,<lat1>,<lon2>,<lat2>,<lon3>,<lat3>[,...]
+"""
+
+import math
+import ql_fs
+import _thread
+
+from usr.logging import Logger
+from usr.modules import option_lock
+from usr.location import GCJ02Grid
+
+log = Logger(__name__)
+
+_geofence_lock = _thread.allocate_lock()
+
+
+class Geofence:
+    """Fence set evaluated against every new fix.
+
+    Each fence is registered in the cells of a uniform `cell` degree grid
+    its bounding box (plus `margin`) overlaps, so a fix only tests the
+    fences of its own cell and the ones it is currently in or changing
+    state for; the cost per fix does not grow with the fence count.
+
+    Hysteresis: a fence is entered once the fix is inside it and left once
+    the fix is more than `margin` metres outside, in both cases for
+    `confirm` consecutive fixes. Transitions queue fenceIn/fenceOut events
+    in object model form, at most `max_events` of them.
+
+    `coord` is the datum of the fence coordinates: "wgs84", or "gcj02" to
+    shift each fix with GCJ02Grid first.
+    """
+
+    class _shape:
+        circle = "C"
+        polygon = "P"
+
+    def __init__(self, file="/usr/geofence.txt", cell=0.01, margin=10, confirm=2, coord="wgs84", max_events=32):
+        self.__file = file
+        self.__cell = cell
+        self.__margin = margin
+        self.__confirm = confirm
+        self.__grid = GCJ02Grid() if coord == "gcj02" else None
+        self.__max_events = max_events
+        self.__fences = []
+        self.__index = {}
+        self.__inside = {}
+        self.__pending = {}
+        self.__events = []
+        self.__seq = 0
+        self.__callback = None
+        self.__stats = {"fixes": 0, "tests": 0, "events": 0, "dropped": 0}
+        if ql_fs.path_exists(file):
+            with open(file, "r") as f:
+                self.load_text(f.read())
+
+    def __parse(self, text):
+        fences = []
+        for line in text.replace(";", "\n").split("\n"):
+            line = line.strip()
+            if not line or line[0] == "#":
+                continue
+            items = line.split(",")
+            shape = items[0].upper()
+            fence_id = int(items[1])
+            values = [float(i) for i in items[2:]]
+            if shape == self._shape.circle and len(values) == 3:
+                lon, lat, radius = values
+                dlon = (radius + self.__margin) / (111320.0 * math.cos(math.radians(lat)))
+                dlat = (radius + self.__margin) / 110540.0
+                bbox = (lon - dlon, lat - dlat, lon + dlon, lat + dlat)
+            elif shape == self._shape.polygon and len(values) >= 6 and len(values) % 2 == 0:
+                lons = values[0::2]
+                lats = values[1::2]
+                dlon = self.__margin / (111320.0 * math.cos(math.radians(lats[0])))
+                dlat = self.__margin / 110540.0
+                bbox = (min(lons) - dlon, min(lats) - dlat, max(lons) + dlon, max(lats) + dlat)
+            else:
+                raise ValueError("Bad fence: %s" % line)
+            fences.append((fence_id, shape, values, bbox))
+        return fences
+
+    def __build_index(self, fences):
+        index = {}
+        for n in range(len(fences)):
+            bbox = fences[n][3]
+            for i in range(math.floor(bbox[0] / self.__cell), math.floor(bbox[2] / self.__cell) + 1):
+                for j in range(math.floor(bbox[1] / self.__cell), math.floor(bbox[3] / self.__cell) + 1):
+                    cell = index.get((i, j))
+                    if cell is None:
+                        index[(i, j)] = [n]
+                    else:
+                        cell.append(n)
+        return index
+
+    def __distance(self, fence, lon, lat):
+        """Signed distance in metres from the fence border, positive inside."""
+        shape, values = fence[1], fence[2]
+        kx = 111320.0 * math.cos(math.radians(lat))
+        ky = 110540.0
+        if shape == self._shape.circle:
+            x = (values[0] - lon) * kx
+            y = (values[1] - lat) * ky
+            return values[2] - math.sqrt(x * x + y * y)
+
+        inside = False
+        nearest = None
+        count = len(values) // 2
+        bx = (values[2 * count - 2] - lon) * kx
+        by = (values[2 * count - 1] - lat) * ky
+        for k in range(count):
+            ax = bx
+            ay = by
+            bx = (values[2 * k] - lon) * kx
+            by = (values[2 * k + 1] - lat) * ky
+            # Ray cast along +x from the fix at the origin.
+            if (ay > 0) != (by > 0) and 0 < ax + (0 - ay) * (bx - ax) / (by - ay):
+                inside = not inside
+            dx = bx - ax
+            dy = by - ay
+            length2 = dx * dx + dy * dy
+            t = -(ax * dx + ay * dy) / length2 if length2 else 0.0
+            t = 0.0 if t < 0 else (1.0 if t > 1 else t)
+            ex = ax + t * dx
+            ey = ay + t * dy
+            d = ex * ex + ey * ey
+            if nearest is None or d < nearest:
+                nearest = d
+        return math.sqrt(nearest) if inside else -math.sqrt(nearest)
+
+    def __queue_event(self, fence_id, entered, fix):
+        if len(self.__events) >= self.__max_events:
+            self.__events.pop(0)
+            self.__stats["dropped"] += 1
+        self.__seq += 1
+        self.__events.append((self.__seq, {"fenceIn" if entered else "fenceOut": {"fenceId": fence_id, "gpsFixTime": fix.get("timestamp", 0)}}))
+        self.__stats["events"] += 1
+
+    @option_lock(_geofence_lock)
+    def load_text(self, text):
+        """Replace the fences, returns the fence count or False if the text does not parse."""
+        try:
+            fences = self.__parse(text)
+        except (ValueError, IndexError) as e:
+            log.error("Geofence load failed: %s" % str(e))
+            return False
+        self.__fences = fences
+        self.__index = self.__build_index(fences)
+        self.__inside = {}
+        self.__pending = {}
+        log.debug("Geofence loaded %s fences in %s cells." % (len(fences), len(self.__index)))
+        return len(fences)
+
+    def save_text(self, text):
+        """Load and persist fence text, e.g. from the geofence object model property."""
+        count = self.load_text(text)
+        if count is not False:
+            with open(self.__file, "w") as f:
+                f.write(text)
+        return count
+
+    def set_callback(self, callback):
+        """callback(fence_id, entered, fix) on every confirmed transition."""
+        if callable(callback):
+            self.__callback = callback
+            return True
+        return False
+
+    @option_lock(_geofence_lock)
+    def __check(self, fix):
+        lon = fix["lon"]
+        lat = fix["lat"]
+        if self.__grid is not None:
+            dlon, dlat = self.__grid.offset(lon, lat)
+            lon += dlon
+            lat += dlat
+        self.__stats["fixes"] += 1
+        candidates = set(self.__index.get((math.floor(lon / self.__cell), math.floor(lat / self.__cell)), ()))
+        candidates.update(self.__inside)
+        candidates.update(self.__pending)
+
+        transitions = []
+        for n in candidates:
+            fence = self.__fences[n]
+            self.__stats["tests"] += 1
+            distance = self.__distance(fence, lon, lat)
+            inside = n in self.__inside
+            if (not inside and distance >= 0) or (inside and distance < -self.__margin):
+                count = self.__pending.get(n, 0) + 1
+                if count < self.__confirm:
+                    self.__pending[n] = count
+                    continue
+                self.__pending.pop(n, None)
+                if inside:
+                    self.__inside.pop(n)
+                else:
+                    self.__inside[n] = True
+                transitions.append((fence[0], not inside))
+                self.__queue_event(fence[0], not inside, fix)
+            else:
+                self.__pending.pop(n, None)
+        return transitions
+
+    def check(self, fix):
+        """Evaluate a GPS.get_fix() dict, returns the transitions as [(fence_id, entered), ...]."""
+        transitions = self.__check(fix)
+        for fence_id, entered in transitions:
+            log.debug("Geofence %s %s." % ("enter" if entered else "exit", fence_id))
+            if self.__callback:
+                self.__callback(fence_id, entered, fix)
+        return transitions
+
+    @option_lock(_geofence_lock)
+    def events(self):
+        """Queued fenceIn/fenceOut events as [(seq, event), ...], oldest first; ack(seq) them once reported."""
+        return list(self.__events)
+
+    @option_lock(_geofence_lock)
+    def ack(self, seq):
+        """Drop the queued events up to and including sequence number seq."""
+        while self.__events and self.__events[0][0] <= seq:
+            self.__events.pop(0)
+
+    @option_lock(_geofence_lock)
+    def inside(self):
+        """Ids of the fences the last fixes are in."""
+        return [self.__fences[n][0] for n in self.__inside]
+
+    def __len__(self):
+        return len(self.__fences)
+
+    @property
+    def stats(self):
+        return self.__stats
@@ -25,7 +25,6 @@
 """
 
 import net
-import ure
 import math
 import utime
 import _thread
@@ -33,6 +32,7 @@ import osTimer
 import wifiScan
 import cellLocator
 
+from array import array
 from queue import Queue
 from machine import Pin, UART
 
@@ -44,6 +44,11 @@ try:
 except ImportError:
     quecgnss = None
 
+try:
+    from wifilocator import wifilocator
+except ImportError:
+    wifilocator = None
+
 log = Logger(__name__)
 
 EE = 0.00669342162296594323
@@ -51,6 +56,9 @@ EARTH_RADIUS = 6378.137
 M_PI = math.pi
 
 _gps_data_set_lock = _thread.allocate_lock()
+_track_lock = _thread.allocate_lock()
+_net_loc_lock = _thread.allocate_lock()
+_acquire_lock = _thread.allocate_lock()
 
 
 def _transformLat(x, y):
@@ -85,98 +93,399 @@ def WGS84ToGCJ02(lon, lat):
     return lon02, lat02
 
 
+def _gcj02_offset(lon, lat):
+    """WGS84ToGCJ02 offset (dLon, dLat) with the sine terms shared between both axes.
+
+    sin(2a) and sin(6a) of the x terms are derived from sin(a)/cos(a), so a
+    point costs 11 trigonometric calls instead of 14.
+    """
+    x = lon - 105.0
+    y = lat - 35.0
+    sx = math.sin(x * M_PI)
+    s2x = 2.0 * sx * math.cos(x * M_PI)
+    s6x = s2x * (3.0 - 4.0 * s2x * s2x)
+    common = (20.0 * s6x + 20.0 * s2x) * 2.0 / 3.0
+    sqx = math.sqrt(math.fabs(x))
+
+    dLat = -100.0 + 2.0 * x + 3.0 * y + 0.2 * y * y + 0.1 * x * y + 0.2 * sqx + common
+    dLat += (20.0 * math.sin(y * M_PI) + 40.0 * math.sin(y / 3.0 * M_PI)) * 2.0 / 3.0
+    dLat += (160.0 * math.sin(y / 12.0 * M_PI) + 320 * math.sin(y * M_PI / 30.0)) * 2.0 / 3.0
+    dLon = 300.0 + x + 2.0 * y + 0.1 * x * x + 0.1 * x * y + 0.1 * sqx + common
+    dLon += (20.0 * sx + 40.0 * math.sin(x / 3.0 * M_PI)) * 2.0 / 3.0
+    dLon += (150.0 * math.sin(x / 12.0 * M_PI) + 300.0 * math.sin(x / 30.0 * M_PI)) * 2.0 / 3.0
+
+    radLat = lat / 180.0 * M_PI
+    magic = math.sin(radLat)
+    magic = 1 - magic * magic * EE
+    sqrtMagic = math.sqrt(magic)
+    dLat = (dLat * 180.0) / ((EARTH_RADIUS * 1000 * (1 - EE)) / (magic * sqrtMagic) * M_PI)
+    dLon = (dLon * 180.0) / (EARTH_RADIUS * 1000 / sqrtMagic * math.cos(radLat) * M_PI)
+    return dLon, dLat
+
+
+class GCJ02Grid:
+    """Offset cache for track input, consecutive points that stay in a small area.
+
+    The offset is evaluated exactly at the corners of `cell` degree cells
+    and bilinearly interpolated inside them; its shortest period is 1/3
+    degree, so at the default 0.01 degree (about 1 km) the interpolation
+    error stays below 0.1 m. The last `size` cells are kept.
+
+    Building a cell costs four exact offsets, so the first point in a cell
+    gets the exact offset and only a second one builds it: scattered
+    points stay exact at close to the speed of the exact path, a track
+    pays one extra exact offset per cell crossed.
+    """
+
+    def __init__(self, cell=0.01, size=8):
+        self.__cell = cell
+        self.__size = size
+        self.__cells = {}
+        self.__order = []
+        self.__seen = []
+
+    def __corners(self, i, j):
+        key = (i, j)
+        corners = self.__cells.get(key)
+        if corners is None:
+            lon0 = i * self.__cell
+            lat0 = j * self.__cell
+            lon1 = lon0 + self.__cell
+            lat1 = lat0 + self.__cell
+            corners = (_gcj02_offset(lon0, lat0), _gcj02_offset(lon1, lat0), _gcj02_offset(lon0, lat1), _gcj02_offset(lon1, lat1))
+            if len(self.__order) >= self.__size:
+                self.__cells.pop(self.__order.pop(0))
+            self.__cells[key] = corners
+            self.__order.append(key)
+        return corners
+
+    def offset(self, lon, lat):
+        fx = lon / self.__cell
+        fy = lat / self.__cell
+        i = math.floor(fx)
+        j = math.floor(fy)
+        if (i, j) not in self.__cells:
+            if (i, j) not in self.__seen:
+                if len(self.__seen) >= self.__size:
+                    self.__seen.pop(0)
+                self.__seen.append((i, j))
+                return _gcj02_offset(lon, lat)
+            self.__seen.remove((i, j))
+        fx -= i
+        fy -= j
+        c00, c10, c01, c11 = self.__corners(i, j)
+        w00 = (1 - fx) * (1 - fy)
+        w10 = fx * (1 - fy)
+        w01 = (1 - fx) * fy
+        w11 = fx * fy
+        return (c00[0] * w00 + c10[0] * w10 + c01[0] * w01 + c11[0] * w11,
+                c00[1] * w00 + c10[1] * w10 + c01[1] * w01 + c11[1] * w11)
+
+
+def WGS84ToGCJ02Batch(lons, lats, grid=None):
+    """WGS84ToGCJ02 over sequences of points, returns (lons, lats) lists.
+
+    With a GCJ02Grid the offsets come from its interpolated cells, which
+    pays off on track input only; scattered points are best left without.
+    """
+    offset = grid.offset if grid is not None else _gcj02_offset
+    lons02 = []
+    lats02 = []
+    for i in range(len(lons)):
+        lon = lons[i]
+        lat = lats[i]
+        dLon, dLat = offset(lon, lat)
+        lons02.append(lon + dLon)
+        lats02.append(lat + dLat)
+    return lons02, lats02
+
+
+def GCJ02ToWGS84(lon, lat, tolerance=1e-7, max_iter=10, grid=None):
+    """Inverse of WGS84ToGCJ02 by fixed point iteration.
+
+    The offset changes by well under 1% across its own size, so each step
+    gains about two decimal digits; 1e-7 degree (about 1 cm) takes 3-4 steps.
+    """
+    offset = grid.offset if grid is not None else _gcj02_offset
+    wgs_lon = lon
+    wgs_lat = lat
+    for _ in range(max_iter):
+        dLon, dLat = offset(wgs_lon, wgs_lat)
+        err_lon = wgs_lon + dLon - lon
+        err_lat = wgs_lat + dLat - lat
+        wgs_lon -= err_lon
+        wgs_lat -= err_lat
+        if math.fabs(err_lon) < tolerance and math.fabs(err_lat) < tolerance:
+            break
+    return wgs_lon, wgs_lat
+
+
+def GCJ02ToWGS84Batch(lons, lats, tolerance=1e-7, max_iter=10, grid=None):
+    """GCJ02ToWGS84 over sequences of points, returns (lons, lats) lists."""
+    wgs_lons = []
+    wgs_lats = []
+    for i in range(len(lons)):
+        wgs_lon, wgs_lat = GCJ02ToWGS84(lons[i], lats[i], tolerance, max_iter, grid)
+        wgs_lons.append(wgs_lon)
+        wgs_lats.append(wgs_lat)
+    return wgs_lons, wgs_lats
+
+
 class NMEAParse:
+    """NMEA sentence tokenizer.
+
+    set_gps_data() walks the buffer once, splitting on `$` and CRLF, drops
+    sentences whose `*hh` checksum does not match and keeps the last
+    sentence of each type (any talker) in a slot. Gx* return the slot
+    sentence, Gx*Data split its fields on first access only.
+
+    feed() merges a chunk of a live stream into the slots instead, so the
+    store never holds more than one sentence per type plus `history` older
+    ones and a `carry` sized partial sentence.
+    """
+
+    __sentences = ("RMC", "GGA", "VTG", "GSV", "GLL", "GSA")
 
-    def __init__(self):
-        self.__gps_data = ""
+    def __init__(self, history=0, carry=128):
+        self.__slots = {}
+        self.__fields = {}
+        self.__history_size = history
+        self.__history = {}
+        self.__carry_size = carry
+        self.__carry = ""
 
     def __parse(self, nmea):
         return tuple(nmea[1:].split("*")[0].split(",")) if nmea else ()
 
+    def __checksum(self, sentence):
+        star = len(sentence) - 3
+        if star < 1 or sentence[star] != "*":
+            return False
+        checksum = 0
+        for c in sentence[1:star]:
+            checksum ^= ord(c)
+        try:
+            return checksum == int(sentence[star + 1:], 16)
+        except ValueError:
+            return False
+
+    def __tokenize(self, gps_data):
+        start = gps_data.find("$")
+        while start != -1:
+            end = gps_data.find("$", start + 1)
+            sentence = gps_data[start:end] if end != -1 else gps_data[start:]
+            for eol in ("\r", "\n"):
+                pos = sentence.find(eol)
+                if pos != -1:
+                    sentence = sentence[:pos]
+            # $ + two talker characters (GP, GN, GL, GB...) + sentence type.
+            if len(sentence) > 6 and sentence[1] == "G" and sentence[6] == ",":
+                sentence_type = sentence[3:6]
+                if sentence_type in self.__sentences and self.__checksum(sentence):
+                    self.__store(sentence_type, sentence)
+            start = end
+
+    def __store(self, sentence_type, sentence):
+        if self.__history_size and sentence_type in self.__slots:
+            history = self.__history.setdefault(sentence_type, [])
+            history.append(self.__slots[sentence_type])
+            if len(history) > self.__history_size:
+                history.pop(0)
+        self.__slots[sentence_type] = sentence
+        self.__fields.pop(sentence_type, None)
+
+    def __sentence(self, sentence_type):
+        return self.__slots.get(sentence_type, "")
+
+    def __sentence_data(self, sentence_type):
+        fields = self.__fields.get(sentence_type)
+        if fields is None:
+            fields = self.__parse(self.__slots.get(sentence_type, ""))
+            self.__fields[sentence_type] = fields
+        return fields
+
+    def clear(self):
+        self.__slots = {}
+        self.__fields = {}
+        self.__history = {}
+        self.__carry = ""
+
     def set_gps_data(self, gps_data):
-        self.__gps_data = gps_data
+        """Replace the store with a buffer in stream order, the newest (last) sentence of each type wins."""
+        self.clear()
+        if gps_data:
+            self.__tokenize(gps_data)
+
+    def feed(self, gps_data):
+        """Merge a stream chunk, the newest sentence of each type wins.
+
+        A sentence still open at the end of the chunk is carried into the
+        next call, dropped if it grows beyond `carry` bytes.
+        """
+        data = self.__carry + gps_data if self.__carry else gps_data
+        self.__carry = ""
+        cut = data.rfind("$")
+        if cut != -1 and data.find("\n", cut) == -1 and data.find("\r", cut) == -1:
+            if len(data) - cut <= self.__carry_size:
+                self.__carry = data[cut:]
+            data = data[:cut]
+        self.__tokenize(data)
+
+    def put(self, sentence):
+        """Store one complete sentence already checked by NMEAAssembler."""
+        if len(sentence) > 6 and sentence[1] == "G" and sentence[6] == ",":
+            sentence_type = sentence[3:6]
+            if sentence_type in self.__sentences:
+                self.__store(sentence_type, sentence)
+
+    def history(self, sentence_type):
+        """Older sentences of a type (e.g. "RMC"), oldest first."""
+        return list(self.__history.get(sentence_type, ()))
+
+    @property
+    def gps_data(self):
+        """Newest sentence of each type, CRLF terminated."""
+        return "".join([self.__slots[i] + "\r\n" for i in self.__sentences if i in self.__slots])
 
     @property
     def GxRMC(self):
-        if self.__gps_data:
-            rmc_re = ure.search(
-                r"\$G[NP]RMC,\d*\.*\d*,*[AV],*\d*\.*\d*,*[NS],*\d*\.*\d*,*[EW],*\d*\.*\d*,*\d*\.*\d*,*\d*,*\d*\.*\d*,*[EW]*,*[ADEN]*,*[SCUV]*\**(\d|\w)*",
-                self.__gps_data)
-            if rmc_re:
-                return rmc_re.group(0)
-        return ""
+        return self.__sentence("RMC")
 
     @property
     def GxGGA(self):
-        if self.__gps_data:
-            gga_re = ure.search(
-                r"\$G[BLPN]GGA,\d*\.*\d*,*\d*\.*\d*,*[NS],*\d*\.*\d*,*[EW],*[0126],*\d*,*\d*\.*\d*,*-*\d*\.*\d*,*M,*-*\d*\.*\d*,*M,*\d*,*\**(\d|\w)*",
-                self.__gps_data)
-            if gga_re:
-                return gga_re.group(0)
-        return ""
+        return self.__sentence("GGA")
 
     @property
     def GxVTG(self):
-        if self.__gps_data:
-            vtg_re = ure.search(
-                r"\$G[NP]VTG,\d*\.*\d*,*T,*\d*\.*\d*,*M,*\d*\.*\d*,*N,*\d*\.*\d*,*K,*[ADEN]*\*(\d|\w)*",
-                self.__gps_data)
-            if vtg_re:
-                return vtg_re.group(0)
-        return ""
+        return self.__sentence("VTG")
 
     @property
     def GxGSV(self):
-        if self.__gps_data:
-            gsv_re = ure.search(
-                r"\$G[NP]GSV,\d*,*\d*,*\d*,*\d*,*\d*,*\d*,*\d*,*\d*,*\d*,*\d*,*\d*,*\d*,*\d*,*\d*,*\d*,*\d*,*\d*,*\d*,*\d*,*\d*\**(\d|\w)*",
-                self.__gps_data)
-            if gsv_re:
-                return gsv_re.group(0)
-        return ""
+        return self.__sentence("GSV")
 
     @property
     def GxGLL(self):
-        if self.__gps_data:
-            gll_re = ure.search(
-                r"\$G[NP]GLL,\d*\.*\d*,*[NS]*,*\d*\.*\d*,*[EW]*,*\d*\.*\d*,*[AV]*,*[ADEN]*\**(\d|\w)*",
-                self.__gps_data)
-            if gll_re:
-                return gll_re.group(0)
+        return self.__sentence("GLL")
 
     @property
     def GxGSA(self):
-        if self.__gps_data:
-            gsa_re = ure.search(
-                r"\$G[NP]GSA,[MA]*,*[123]*,*\d*,*\d*,*\d*,*\d*,*\d*,*\d*,*\d*,*\d*,*\d*,*\d*,*\d*,*\d*,*\d*\.*\d*,*\d*\.*\d*,*\d*\.*\d*,*(\d|\w)*\**(\d|\w)*",
-                self.__gps_data)
-            if gsa_re:
-                return gsa_re.group(0)
+        return self.__sentence("GSA")
 
     @property
     def GxRMCData(self):
-        return self.__parse(self.GxRMC)
+        return self.__sentence_data("RMC")
 
     @property
     def GxGGAData(self):
-        return self.__parse(self.GxGGA)
+        return self.__sentence_data("GGA")
 
     @property
     def GxGSVData(self):
-        return self.__parse(self.GxGSV)
+        return self.__sentence_data("GSV")
 
     @property
     def GxGSAData(self):
-        return self.__parse(self.GxGSA)
+        return self.__sentence_data("GSA")
 
     @property
     def GxVTGData(self):
-        return self.__parse(self.GxVTG)
+        return self.__sentence_data("VTG")
 
     @property
     def GxGLLData(self):
-        return self.__parse(self.GxGLL)
+        return self.__sentence_data("GLL")
+
+
+class NMEAAssembler:
+    """Raw UART bytes to complete NMEA sentences.
+
+    Bytes from `$` up to CR/LF are copied into a fixed `size` byte buffer,
+    feed() returns the sentences finished by the chunk whose `*hh` checksum
+    matches. A sentence split across reads simply continues in the buffer;
+    one without a line end (next `$` first) or longer than the buffer is
+    dropped and the stream resyncs at the next `$`.
+    """
+
+    def __init__(self, size=128):
+        self.__buf = bytearray(size)
+        self.__mv = memoryview(self.__buf)
+        self.__size = size
+        # -1 while waiting for "$", else the bytes buffered of the open sentence.
+        self.__len = -1
+        self.__stats = {"bytes": 0, "sentences": 0, "checksum": 0, "dropped": 0}
+
+    def __finish(self):
+        n = self.__len
+        self.__len = -1
+        buf = self.__buf
+        star = n - 3
+        if star < 1 or buf[star] != 0x2A:
+            self.__stats["checksum"] += 1
+            return None
+        checksum = 0
+        for i in range(1, star):
+            checksum ^= buf[i]
+        try:
+            if checksum != int(bytes(self.__mv[star + 1:n]), 16):
+                self.__stats["checksum"] += 1
+                return None
+        except ValueError:
+            self.__stats["checksum"] += 1
+            return None
+        self.__stats["sentences"] += 1
+        return bytes(self.__mv[:n]).decode()
+
+    def reset(self):
+        self.__len = -1
+
+    def feed(self, data):
+        """Consume a chunk of bytes, returns the list of completed sentences (str)."""
+        sentences = []
+        end = len(data)
+        self.__stats["bytes"] += end
+        src = memoryview(data)
+        pos = 0
+        while pos < end:
+            if self.__len < 0:
+                pos = data.find(b"$", pos)
+                if pos == -1:
+                    break
+                self.__len = 0
+            stop = data.find(b"\n", pos)
+            cr = data.find(b"\r", pos)
+            if cr != -1 and (stop == -1 or cr < stop):
+                stop = cr
+            dollar = data.find(b"$", pos + 1 if self.__len == 0 else pos)
+            if dollar != -1 and (stop == -1 or dollar < stop):
+                # No line end before the next sentence starts.
+                self.__stats["dropped"] += 1
+                self.__len = -1
+                pos = dollar
+                continue
+            count = (stop if stop != -1 else end) - pos
+            if self.__len + count > self.__size:
+                self.__stats["dropped"] += 1
+                self.__len = -1
+                pos = stop if stop != -1 else end
+                continue
+            self.__mv[self.__len:self.__len + count] = src[pos:pos + count]
+            self.__len += count
+            if stop == -1:
+                break
+            pos = stop + 1
+            sentence = self.__finish()
+            if sentence:
+                sentences.append(sentence)
+        return sentences
+
+    @property
+    def pending(self):
+        """Bytes of the sentence still open."""
+        return self.__len if self.__len > 0 else 0
+
+    @property
+    def stats(self):
+        return self.__stats
 
 
 class GPSLowEnergy:
@@ -228,6 +537,266 @@ class GPSLowEnergy:
         return False
 
 
+class GNSSDutyCycle:
+    """Decides when the GNSS receiver must be on.
+
+    Motion is inferred from successive fixes (reported speed or distance
+    from the last still position) and, when fed, from the battery current:
+    a pack that is discharging or being charged hard means the vehicle is
+    in use. While moving the receiver stays on. Once nothing moved for
+    `still_time` seconds it goes to standby, after `backup_after` seconds to
+    backup. Ahead of a report it is woken `report_lead` seconds early
+    (`backup_lead` from backup, which only allows a warm start) and kept on
+    until a fresh fix arrives or `fix_timeout` expires; while still
+    that only happens when the last fix is older than `still_refresh`, since
+    a parked vehicle's position does not go stale.
+
+    The engine is pure, `update()` takes the time and the inputs and returns
+    the wanted state, so the same code drives GPS and the host simulation.
+    """
+
+    class _state:
+        on = 0
+        standby = 1
+        backup = 2
+
+    state = _state
+
+    def __init__(self, move_speed=3.0, move_distance=30, still_time=120, backup_after=1800, current_threshold=1.0,
+                 report_lead=10, backup_lead=30, fix_timeout=60, still_refresh=900):
+        self.__move_speed = move_speed
+        self.__move_distance = move_distance
+        self.__still_time = still_time
+        self.__backup_after = backup_after
+        self.__current_threshold = current_threshold
+        self.__report_lead = report_lead
+        self.__backup_lead = backup_lead
+        self.__fix_timeout = fix_timeout
+        self.__still_refresh = still_refresh
+
+        self.__state = self._state.on
+        self.__last_update = None
+        self.__last_motion = None
+        self.__anchor = None
+        self.__last_fix = None
+        self.__last_fix_time = None
+        self.__current = None
+        self.__next_report = None
+        self.__report_wake = None
+        self.__stats = {"on": 0, "standby": 0, "backup": 0, "wakeups": 0}
+
+    def __distance(self, lat1, lon1, lat2, lon2):
+        # Equirectangular approximation, metres, plenty for tens of metres.
+        x = math.radians(lon2 - lon1) * math.cos(math.radians((lat1 + lat2) / 2))
+        y = math.radians(lat2 - lat1)
+        return math.sqrt(x * x + y * y) * EARTH_RADIUS * 1000
+
+    def __on_fix(self, now, fix):
+        self.__last_fix = fix["ticks"]
+        self.__last_fix_time = now
+        moved = fix.get("speed", 0) >= self.__move_speed
+        if self.__anchor is None:
+            self.__anchor = (fix["lat"], fix["lon"])
+        elif self.__distance(self.__anchor[0], self.__anchor[1], fix["lat"], fix["lon"]) >= self.__move_distance:
+            moved = True
+        if moved:
+            self.__last_motion = now
+            self.__anchor = (fix["lat"], fix["lon"])
+        if self.__report_wake is not None:
+            self.__report_wake = None
+
+    def __account(self, now):
+        if self.__last_update is not None:
+            key = ("on", "standby", "backup")[self.__state]
+            self.__stats[key] += now - self.__last_update
+        self.__last_update = now
+
+    def set_current(self, current):
+        """Latest battery current in A, None when unknown."""
+        self.__current = current
+
+    def set_next_report(self, timestamp):
+        self.__next_report = timestamp
+
+    def update(self, now, fix=None):
+        """Feed the time (s) and the latest fix (GPS.get_fix() dict or None), returns the wanted state."""
+        self.__account(now)
+        if self.__last_motion is None:
+            self.__last_motion = now
+        if fix is not None and fix["ticks"] != self.__last_fix:
+            self.__on_fix(now, fix)
+        if self.__current is not None and abs(self.__current) >= self.__current_threshold:
+            self.__last_motion = now
+
+        lead = self.__backup_lead if self.__state == self._state.backup else self.__report_lead
+        if self.__next_report is not None and now >= self.__next_report - lead:
+            if now - self.__last_motion < self.__still_time or self.__last_fix_time is None or \
+                    now - self.__last_fix_time >= self.__still_refresh - lead:
+                self.__report_wake = now + self.__fix_timeout
+            self.__next_report = None
+        if self.__report_wake is not None and now >= self.__report_wake:
+            self.__report_wake = None
+
+        still = now - self.__last_motion
+        if still < self.__still_time or self.__report_wake is not None:
+            state = self._state.on
+        elif still < self.__backup_after:
+            state = self._state.standby
+        else:
+            state = self._state.backup
+        if state == self._state.on and self.__state != self._state.on:
+            self.__stats["wakeups"] += 1
+        self.__state = state
+        return state
+
+    @property
+    def moving(self):
+        return self.__last_motion is None or self.__last_update - self.__last_motion < self.__still_time
+
+    @property
+    def still_refresh(self):
+        return self.__still_refresh
+
+    @property
+    def stats(self):
+        """Seconds spent on / in standby / in backup and the number of wakeups."""
+        return self.__stats
+
+
+class TrackBuffer:
+    """Ring of recorded fixes, simplified with Douglas-Peucker before upload.
+
+    Fixes are kept at most one per `interval` seconds in `capacity` slots of
+    int arrays: time (s), lon and lat (microdegrees), speed (0.1 km/h),
+    16 bytes a point. When the ring is full the oldest point is overwritten.
+
+    batch() simplifies the buffered points with tolerance `tolerance`
+    metres and returns up to `size` of the kept points in the object model
+    format of the track property; commit(batch) drops them once uploaded, so
+    a failed upload is retried with the next batch.
+    """
+
+    def __init__(self, capacity=512, interval=5, tolerance=10, size=64):
+        self.__capacity = capacity
+        self.__interval = interval
+        self.__tolerance = tolerance
+        self.__size = size
+        self.__time = array("i", [0] * capacity)
+        self.__lon = array("i", [0] * capacity)
+        self.__lat = array("i", [0] * capacity)
+        self.__speed = array("i", [0] * capacity)
+        self.__head = 0
+        self.__count = 0
+        self.__base = 0
+        self.__last = None
+        self.__stats = {"recorded": 0, "overwritten": 0, "uploaded": 0, "discarded": 0}
+
+    def __index(self, i):
+        return (self.__head + i) % self.__capacity
+
+    def __simplify(self, count, tolerance):
+        """Iterative Douglas-Peucker over the first count points, returns keep flags."""
+        keep = bytearray(count)
+        if count == 0:
+            return keep
+        keep[0] = 1
+        keep[count - 1] = 1
+        first = self.__index(0)
+        lon0 = self.__lon[first]
+        lat0 = self.__lat[first]
+        # Metres per microdegree around the first point.
+        kx = 0.11132 * math.cos(math.radians(lat0 / 1000000))
+        ky = 0.11054
+        stack = [(0, count - 1)]
+        while stack:
+            a, b = stack.pop()
+            if b - a < 2:
+                continue
+            ia = self.__index(a)
+            ib = self.__index(b)
+            ax = (self.__lon[ia] - lon0) * kx
+            ay = (self.__lat[ia] - lat0) * ky
+            dx = (self.__lon[ib] - lon0) * kx - ax
+            dy = (self.__lat[ib] - lat0) * ky - ay
+            length2 = dx * dx + dy * dy
+            dmax = -1.0
+            imax = a
+            for i in range(a + 1, b):
+                idx = self.__index(i)
+                px = (self.__lon[idx] - lon0) * kx - ax
+                py = (self.__lat[idx] - lat0) * ky - ay
+                t = (px * dx + py * dy) / length2 if length2 else 0.0
+                t = 0.0 if t < 0 else (1.0 if t > 1 else t)
+                ex = px - t * dx
+                ey = py - t * dy
+                d = ex * ex + ey * ey
+                if d > dmax:
+                    dmax = d
+                    imax = i
+            if dmax > tolerance * tolerance:
+                keep[imax] = 1
+                stack.append((a, imax))
+                stack.append((imax, b))
+        return keep
+
+    @option_lock(_track_lock)
+    def add(self, fix):
+        """Record a GPS.get_fix() dict, rate limited to one point per interval."""
+        timestamp = fix["timestamp"]
+        if self.__last is not None and timestamp - self.__last < self.__interval:
+            return False
+        self.__last = timestamp
+        if self.__count == self.__capacity:
+            self.__head = (self.__head + 1) % self.__capacity
+            self.__count -= 1
+            self.__base += 1
+            self.__stats["overwritten"] += 1
+        idx = self.__index(self.__count)
+        self.__time[idx] = timestamp
+        self.__lon[idx] = int(fix["lon"] * 1000000)
+        self.__lat[idx] = int(fix["lat"] * 1000000)
+        self.__speed[idx] = int(fix.get("speed", 0) * 10)
+        self.__count += 1
+        self.__stats["recorded"] += 1
+        return True
+
+    @option_lock(_track_lock)
+    def batch(self):
+        """Next upload: {"points": [{1: time, 2: lon, 3: lat, 4: speed}, ...], "end": n}.
+
+        points is empty when there is nothing to send, end marks the raw
+        points the batch covers for commit().
+        """
+        keep = self.__simplify(self.__count, self.__tolerance)
+        points = []
+        for i in range(self.__count):
+            if keep[i]:
+                idx = self.__index(i)
+                points.append({1: self.__time[idx], 2: self.__lon[idx], 3: self.__lat[idx], 4: self.__speed[idx]})
+                if len(points) == self.__size:
+                    break
+        consumed = i + 1 if points else 0
+        return {"points": points, "end": self.__base + consumed}
+
+    @option_lock(_track_lock)
+    def commit(self, batch):
+        """Drop the raw points a successfully uploaded batch covers."""
+        # Points overwritten since batch() already moved the base.
+        consumed = max(0, min(batch["end"] - self.__base, self.__count))
+        self.__head = self.__index(consumed)
+        self.__count -= consumed
+        self.__base += consumed
+        self.__stats["uploaded"] += len(batch["points"])
+        self.__stats["discarded"] += max(0, consumed - len(batch["points"]))
+
+    def __len__(self):
+        return self.__count
+
+    @property
+    def stats(self):
+        return self.__stats
+
+
 class GPS(GPSLowEnergy):
 
     __RMC = 0
@@ -250,7 +819,8 @@ class GPS(GPSLowEnergy):
         wifi = 0x4
         all = 0x7
 
-    def __init__(self, UARTn, buadrate, databits, parity, stopbits, flowctl, gps_mode, nmea, PowerPin, StandbyPin, BackupPin):
+    def __init__(self, UARTn, buadrate, databits, parity, stopbits, flowctl, gps_mode, nmea, PowerPin, StandbyPin, BackupPin,
+                 history=0):
         super().__init__(PowerPin, StandbyPin, BackupPin)
         self.__UARTn = UARTn
         self.__buadrate = buadrate
@@ -264,56 +834,137 @@ class GPS(GPSLowEnergy):
 
         self.__external_obj = None
         self.__internal_obj = quecgnss
-        self.__nmea_parse = NMEAParse()
+        self.__nmea_parse = NMEAParse(history=history)
+        self.__assembler = NMEAAssembler()
 
-        self.__external_retrieve_queue = None
-        self.__queue_size = 2
-        self.__first_break = 0
         self.__break = 0
-        self.__gps_data = ""
-        self.__rmc_data = ""
-        self.__gga_data = ""
-        self.__vtg_data = ""
-        self.__gsv_data = ""
 
-        self.__gps_timer = osTimer()
         self.__gps_data_check_timer = osTimer()
 
-        if self.__gps_mode == self._gps_mode.external:
-            self.__external_init()
-        elif self.__gps_mode == self._gps_mode.internal:
+        self.__fix = None
+        self.__duty = None
+        self.__track = None
+        self.__geofence = None
+        self.__power_state = GNSSDutyCycle.state.on
+        self.__acquiring = False
+        self.__acquire_thread_id = None
+
+        if self.__gps_mode == self._gps_mode.internal:
             self.__internal_init()
 
     @option_lock(_gps_data_set_lock)
-    def __set_gps_data(self, gps_data):
-        self.__gps_data = gps_data
+    def __feed_gps_data(self, gps_data):
+        log.debug("this_gps_data: \n%s" % gps_data)
+        self.__nmea_parse.feed(gps_data)
+
+    @option_lock(_gps_data_set_lock)
+    def __put_gps_sentences(self, sentences):
+        for sentence in sentences:
+            self.__nmea_parse.put(sentence)
 
     @option_lock(_gps_data_set_lock)
     def __get_gps_data(self):
-        return self.__gps_data
-
-    def __reverse_gps_data(self, this_gps_data):
-        log.debug("this_gps_data: \n%s" % this_gps_data)
-        CRLF = "\r\n"
-        if this_gps_data:
-            _gps_data = self.__get_gps_data()
-            if _gps_data:
-                _gps_data = CRLF.join(_gps_data.split(CRLF)[::-1])
-            _gps_data += this_gps_data.strip().replace("\r", "").replace("\n", "").replace("$", CRLF + "$")
-            _gps_data = CRLF.join(_gps_data.split(CRLF)[::-1])
-            self.__set_gps_data(_gps_data)
-
-    def __gps_timer_callback(self, args):
-        self.__break = 1
-        if self.__external_retrieve_queue is not None:
-            self.__external_retrieve_queue.put(False)
+        return self.__nmea_parse.gps_data
+
+    @option_lock(_gps_data_set_lock)
+    def __gps_nmea_data_clean(self):
+        self.__nmea_parse.clear()
 
     def __gps_data_check_callback(self, args):
         if not self.__check_gps_valid():
             self.__gps_nmea_data_clean()
 
-    def __external_init(self):
-        self.__external_retrieve_queue = Queue(maxsize=self.__queue_size)
+    def __nmea_degree(self, value, hemisphere):
+        value = float(value)
+        degree = int(value / 100) + (value % 100) / 60
+        return -degree if hemisphere in ("S", "W") else degree
+
+    @option_lock(_gps_data_set_lock)
+    def __update_fix(self):
+        parse = self.__nmea_parse
+        rmc = parse.GxRMCData
+        gga = parse.GxGGAData
+        vtg = parse.GxVTGData
+        if len(rmc) < 8 or rmc[2] != "A":
+            return False
+        try:
+            self.__fix = {
+                "timestamp": utime.time(),
+                "ticks": utime.ticks_ms(),
+                "lat": self.__nmea_degree(rmc[3], rmc[4]),
+                "lon": self.__nmea_degree(rmc[5], rmc[6]),
+                "speed": float(vtg[7]) if len(vtg) > 7 and vtg[7] else float(rmc[7] or 0) * 1.852,
+                "quality": int(gga[6]) if len(gga) > 6 and gga[6] else 0,
+                "satellites": int(gga[7]) if len(gga) > 7 and gga[7] else 0,
+                "hdop": float(gga[8]) if len(gga) > 8 and gga[8] else 0.0,
+                "nmea": [parse.GxRMC, parse.GxGGA, parse.GxVTG],
+                "source": "gps",
+            }
+        except ValueError:
+            return False
+        return True
+
+    def __poll(self):
+        """Wait for the next NMEA chunk, "" if nothing arrived in time.
+
+        External receivers are fed by the UART callback, this only paces the
+        duty cycle for them.
+        """
+        if self.__gps_mode == self._gps_mode.internal:
+            utime.sleep(1)
+            gnss_data = quecgnss.read(1024)
+            if gnss_data and len(gnss_data) > 1 and gnss_data[1]:
+                return gnss_data[1].decode()
+        else:
+            utime.sleep(1)
+        return ""
+
+    @option_lock(_acquire_lock)
+    def __acquire_continue(self):
+        """False once stopped, the exiting thread then gives up the thread id if it is still its own."""
+        if self.__acquiring:
+            return True
+        if self.__acquire_thread_id == _thread.get_ident():
+            self.__acquire_thread_id = None
+        return False
+
+    def __acquire(self):
+        log.debug("GPS acquisition start.")
+        while True:
+            if not self.__acquire_continue():
+                break
+            try:
+                gps_data = self.__poll()
+                if gps_data:
+                    self.__feed_gps_data(gps_data)
+                    self.__new_gps_data()
+                if self.__duty is not None:
+                    self.__set_power_state(self.__duty.update(utime.time(), self.get_fix()))
+            except Exception as e:
+                log.error("GPS acquisition error: %s" % str(e))
+                utime.sleep(1)
+        log.debug("GPS acquisition stop.")
+
+    def __new_gps_data(self):
+        if self.__check_gps_valid() and self.__update_fix():
+            if self.__track is not None:
+                self.__track.add(self.__fix)
+            if self.__geofence is not None:
+                self.__geofence.check(self.__fix)
+
+    def __set_power_state(self, state):
+        if state == self.__power_state:
+            return
+        log.debug("GNSS power state %s -> %s" % (self.__power_state, state))
+        if self.__gps_mode == self._gps_mode.internal:
+            if state == GNSSDutyCycle.state.on:
+                self.__internal_open()
+            elif self.__power_state == GNSSDutyCycle.state.on:
+                self.__internal_close()
+        else:
+            self.standby(1 if state == GNSSDutyCycle.state.standby else 0)
+            self.backup(1 if state == GNSSDutyCycle.state.backup else 0)
+        self.__power_state = state
 
     def __external_open(self):
         self.power_switch(1)
@@ -325,15 +976,30 @@ class GPS(GPSLowEnergy):
             self.__stopbits,
             self.__flowctl
         )
+        # Drop what queued up while closed, it is not part of this fix.
+        to_read = self.__external_obj.any()
+        if to_read > 0:
+            self.__external_obj.read(to_read)
+        self.__assembler.reset()
         self.__external_obj.set_callback(self.__external_retrieve_cb)
 
     def __external_close(self):
         self.__external_obj.close()
 
     def __external_retrieve_cb(self, args):
-        if self.__external_retrieve_queue.size() >= self.__queue_size:
-            self.__external_retrieve_queue.get()
-        self.__external_retrieve_queue.put(True)
+        """UART callback, turns the pending bytes into sentences as they arrive."""
+        to_read = self.__external_obj.any()
+        if to_read <= 0:
+            return
+        sentences = self.__assembler.feed(self.__external_obj.read(to_read))
+        if not sentences:
+            return
+        self.__put_gps_sentences(sentences)
+        if self.__acquiring:
+            try:
+                self.__new_gps_data()
+            except Exception as e:
+                log.error("GPS data error: %s" % str(e))
 
     def __internal_init(self):
         if self.__internal_obj:
@@ -353,43 +1019,21 @@ class GPS(GPSLowEnergy):
     def __nmea_statement_exist(self, nmea_item):
         return (self.__NMEA & (0b1 << nmea_item)) >> nmea_item
 
-    def __gps_nmea_data_clean(self):
-        self.__set_gps_data("")
-        self.__rmc_data = ""
-        self.__gga_data = ""
-        self.__gsv_data = ""
-        self.__gsa_data = ""
-        self.__vtg_data = ""
-        self.__gll_data = ""
-
+    @option_lock(_gps_data_set_lock)
     def __check_gps_valid(self):
-        self.__nmea_parse.set_gps_data(self.__get_gps_data())
-        if not self.__rmc_data:
-            self.__rmc_data = self.__nmea_parse.GxRMC
         _rmc_info = self.__nmea_parse.GxRMCData
-        loc_status = _rmc_info[2] if _rmc_info else "V"
-
-        if self.__rmc_data and loc_status == "A":
-            if self.__nmea_statement_exist(self.__GGA) and not self.__gga_data:
-                self.__gga_data = self.__nmea_parse.GxGGA
-            if self.__nmea_statement_exist(self.__GSV) and not self.__gsv_data:
-                self.__gsv_data = self.__nmea_parse.GxGSV
-            if self.__nmea_statement_exist(self.__GSA) and not self.__gsa_data:
-                self.__gsa_data = self.__nmea_parse.GxGSA
-            if self.__nmea_statement_exist(self.__VTG) and not self.__vtg_data:
-                self.__vtg_data = self.__nmea_parse.GxVTG
-            if self.__nmea_statement_exist(self.__GLL) and not self.__gll_data:
-                self.__gll_data = self.__nmea_parse.GxGLL
-
-            if self.__nmea_statement_exist(self.__GGA) and not self.__gga_data:
+        loc_status = _rmc_info[2] if len(_rmc_info) > 2 else "V"
+
+        if loc_status == "A":
+            if self.__nmea_statement_exist(self.__GGA) and not self.__nmea_parse.GxGGA:
                 return False
-            if self.__nmea_statement_exist(self.__GSV) and not self.__gsv_data:
+            if self.__nmea_statement_exist(self.__GSV) and not self.__nmea_parse.GxGSV:
                 return False
-            if self.__nmea_statement_exist(self.__GSA) and not self.__gsa_data:
+            if self.__nmea_statement_exist(self.__GSA) and not self.__nmea_parse.GxGSA:
                 return False
-            if self.__nmea_statement_exist(self.__VTG) and not self.__vtg_data:
+            if self.__nmea_statement_exist(self.__VTG) and not self.__nmea_parse.GxVTG:
                 return False
-            if self.__nmea_statement_exist(self.__GLL) and not self.__gll_data:
+            if self.__nmea_statement_exist(self.__GLL) and not self.__nmea_parse.GxGLL:
                 return False
             return True
 
@@ -399,41 +1043,15 @@ class GPS(GPSLowEnergy):
         #self.__external_open()
         log.debug("__external_read start")
 
-        while self.__break == 0:
-            self.__gps_timer.start(50, 0, self.__gps_timer_callback)
-            signal = self.__external_retrieve_queue.get()
-            log.debug("[first] signal: %s" % signal)
-            if signal:
-                to_read = self.__external_obj.any()
-                log.debug("[first] to_read: %s" % to_read)
-                if to_read > 0:
-                    self.__set_gps_data(self.__external_obj.read(to_read).decode())
-            self.__gps_timer.stop()
-        self.__break = 0
-
+        # Sentences keep arriving through the UART callback, only the ones
+        # from now on count for this fix.
         self.__gps_nmea_data_clean()
-        self.__gps_data_check_timer.start(2000, 1, self.__gps_data_check_callback)
         cycle = 0
-        while self.__break == 0:
-            self.__gps_timer.start(1500, 0, self.__gps_timer_callback)
-            signal = self.__external_retrieve_queue.get()
-            log.debug("[second] signal: %s" % signal)
-            if signal:
-                to_read = self.__external_obj.any()
-                log.debug("[second] to_read: %s" % to_read)
-                if to_read > 0:
-                    self.__reverse_gps_data(self.__external_obj.read(to_read).decode())
-                    if self.__check_gps_valid():
-                        self.__break = 1
-
-            self.__gps_timer.stop()
+        while not self.__check_gps_valid():
             cycle += 1
             if cycle >= self.__retry:
-                self.__break = 1
-            if self.__break != 1:
-                utime.sleep(1)
-        self.__gps_data_check_timer.stop()
-        self.__break = 0
+                break
+            utime.sleep(1)
 
         # To check GPS data is usable or not.
         self.__gps_data_check_callback(None)
@@ -456,7 +1074,7 @@ class GPS(GPSLowEnergy):
             gnss_data = quecgnss.read(1024)
             if gnss_data and gnss_data[1]:
                 this_gps_data = gnss_data[1].decode() if len(gnss_data) > 1 and gnss_data[1] else ""
-                self.__reverse_gps_data(this_gps_data)
+                self.__feed_gps_data(this_gps_data)
                 _gps_valid = self.__check_gps_valid()
                 log.debug("_gps_valid: %s" % _gps_valid)
                 if _gps_valid:
@@ -474,6 +1092,11 @@ class GPS(GPSLowEnergy):
         return self.__get_gps_data()
 
     def read(self, retry=30):
+        if self.__acquiring:
+            # The acquisition thread owns the receiver, answer from the cached fix.
+            fix = self.get_fix()
+            return (0, "".join([i + "\r\n" for i in fix["nmea"] if i])) if fix else (-1, "")
+
         self.__retry = retry
         gps_data = ""
         if self.__gps_mode == self._gps_mode.external:
@@ -484,8 +1107,72 @@ class GPS(GPSLowEnergy):
         res = 0 if gps_data else -1
         return (res, gps_data)
 
+    @option_lock(_acquire_lock)
+    def start(self):
+        """Keep acquiring in a background thread, the latest valid fix is served by get_fix()."""
+        self.__acquiring = True
+        if self.__acquire_thread_id is None:
+            self.__gps_nmea_data_clean()
+            self.__acquire_thread_id = _thread.start_new_thread(self.__acquire, ())
+
+    @option_lock(_acquire_lock)
+    def stop(self):
+        self.__acquiring = False
+        self.__set_power_state(GNSSDutyCycle.state.on)
+
+    def set_duty_cycle(self, duty):
+        """Let a GNSSDutyCycle drive the receiver power while acquisition runs, None disables it."""
+        self.__duty = duty
+        if duty is None:
+            self.__set_power_state(GNSSDutyCycle.state.on)
+
+    def set_track(self, track):
+        """Record every new fix into a TrackBuffer, None disables recording."""
+        self.__track = track
+
+    def set_geofence(self, geofence):
+        """Check every new fix against a geofence.Geofence, None disables it."""
+        self.__geofence = geofence
+
+    def set_activity(self, current):
+        """Battery current (A) as a motion hint for the duty cycle."""
+        if self.__duty is not None:
+            self.__duty.set_current(current)
+
+    def set_next_report(self, timestamp):
+        """Time (utime.time()) of the next report, the duty cycle wakes the receiver ahead of it."""
+        if self.__duty is not None:
+            self.__duty.set_next_report(timestamp)
+
+    @property
+    def duty_stats(self):
+        return self.__duty.stats if self.__duty is not None else {}
+
+    @option_lock(_gps_data_set_lock)
+    def get_fix(self, max_age=None):
+        """Latest valid fix, None if there is none or it is older than max_age seconds.
+
+        While a duty cycle reports the vehicle still, max_age is raised to its
+        still_refresh.
+
+        Keys: timestamp (device time of the fix), age (s), lat, lon (WGS84
+        degrees), speed (km/h), quality (GGA fix quality), satellites, hdop,
+        nmea ([RMC, GGA, VTG]) and source.
+        """
+        if self.__fix is None:
+            return None
+        age = utime.ticks_diff(utime.ticks_ms(), self.__fix["ticks"]) // 1000
+        if max_age is not None and self.__duty is not None and not self.__duty.moving:
+            # Parked: the duty cycle keeps the position fresh enough.
+            max_age = max(max_age, self.__duty.still_refresh)
+        if max_age is not None and age > max_age:
+            return None
+        fix = dict(self.__fix)
+        fix["age"] = age
+        return fix
 
     def close(self):
+        self.stop()
         if self.__gps_mode == self._gps_mode.external:
             self.__external_close()
         elif self.__gps_mode == self._gps_mode.internal:
@@ -495,4 +1182,221 @@ class GPS(GPSLowEnergy):
         if self.__gps_mode == self._gps_mode.external:
             self.__external_open()
         elif self.__gps_mode == self._gps_mode.internal:
-            self.__internal_open()
\ No newline at end of file
+            self.__internal_open()
+
+
+class _LocationCache:
+    """Small LRU of lookup results with a time to live."""
+
+    def __init__(self, size=16, ttl=86400):
+        self.__size = size
+        self.__ttl = ttl
+        self.__keys = []
+        self.__values = []
+
+    def get(self, match):
+        """Copy of the first fresh entry whose key satisfies match(key), moved to the front.
+
+        The match places the device there now, so the copy is stamped with
+        the current time, the entry keeps its lookup time for the ttl.
+        """
+        now = utime.time()
+        for i in range(len(self.__keys)):
+            value = self.__values[i]
+            if now - value["timestamp"] > self.__ttl:
+                continue
+            if match(self.__keys[i]):
+                self.__keys.insert(0, self.__keys.pop(i))
+                self.__values.insert(0, self.__values.pop(i))
+                res = dict(value)
+                res["timestamp"] = now
+                res["cached"] = True
+                return res
+        return None
+
+    def put(self, key, value):
+        self.__keys.insert(0, key)
+        self.__values.insert(0, value)
+        if len(self.__keys) > self.__size:
+            self.__keys.pop()
+            self.__values.pop()
+
+
+class CellLocation:
+    """cellLocator lookups cached by serving cell (mcc, mnc, lac/tac, cid)."""
+
+    def __init__(self, serverAddr="www.queclocator.com", port=80, token="xxxxxxxxxxxxxxxx", timeout=8, profileIdx=1,
+                 cache_size=16, cache_ttl=86400):
+        self.__server = serverAddr
+        self.__port = port
+        self.__token = token
+        self.__timeout = timeout
+        self.__profile = profileIdx
+        self.__cache = _LocationCache(cache_size, cache_ttl)
+        self.__stats = {"hits": 0, "lookups": 0, "errors": 0}
+
+    def __serving_cell(self):
+        cell_info = net.getCellInfo()
+        if not isinstance(cell_info, tuple) or len(cell_info) < 3:
+            return None
+        gsm, umts, lte = cell_info[:3]
+        # LTE: (flag, cid, mcc, mnc, pci, tac, ...), GSM: (flag, cid, mcc, mnc, lac, ...), flag 0 is serving.
+        for cell in lte:
+            if cell[0] == 0:
+                return (cell[2], cell[3], cell[5], cell[1])
+        for cell in gsm:
+            if cell[0] == 0:
+                return (cell[2], cell[3], cell[4], cell[1])
+        return None
+
+    def read(self):
+        """Location dict (lon, lat, accuracy, source, timestamp, cached) or None."""
+        key = self.__serving_cell()
+        if key is None:
+            return None
+        result = self.__cache.get(lambda cached: cached == key)
+        if result is not None:
+            self.__stats["hits"] += 1
+            return result
+        self.__stats["lookups"] += 1
+        loc = cellLocator.getLocation(self.__server, self.__port, self.__token, self.__timeout, self.__profile)
+        if not isinstance(loc, tuple):
+            log.warn("cellLocator error %s" % loc)
+            self.__stats["errors"] += 1
+            return None
+        result = {"lon": loc[0], "lat": loc[1], "accuracy": loc[2], "source": "cell", "timestamp": utime.time(), "cached": False}
+        self.__cache.put(key, result)
+        return result
+
+    @property
+    def stats(self):
+        return self.__stats
+
+
+class WifiLocation:
+    """wifilocator lookups cached by the set of the `max_aps` strongest BSSIDs.
+
+    A scan matches a cached set when their Jaccard similarity reaches
+    `similarity`, so an access point coming and going next to a parked
+    cabinet does not cost another lookup.
+    """
+
+    def __init__(self, token="xxxxxxxxxxxxxxxx", max_aps=8, similarity=0.6, cache_size=16, cache_ttl=86400):
+        self.__token = token
+        self.__max_aps = max_aps
+        self.__similarity = similarity
+        self.__cache = _LocationCache(cache_size, cache_ttl)
+        self.__stats = {"hits": 0, "lookups": 0, "errors": 0}
+
+    def __fingerprint(self):
+        if wifiScan.getState() == 0:
+            wifiScan.control(1)
+        scan = wifiScan.start()
+        if not isinstance(scan, tuple) or scan[0] <= 0:
+            return None
+        aps = sorted(scan[1], key=lambda i: i[1], reverse=True)[:self.__max_aps]
+        return set([i[0] for i in aps])
+
+    def __match(self, fingerprint):
+        def match(cached):
+            common = len(cached & fingerprint)
+            return common and common / len(cached | fingerprint) >= self.__similarity
+        return match
+
+    def read(self):
+        """Location dict (lon, lat, accuracy, source, timestamp, cached) or None."""
+        fingerprint = self.__fingerprint()
+        if not fingerprint:
+            return None
+        result = self.__cache.get(self.__match(fingerprint))
+        if result is not None:
+            self.__stats["hits"] += 1
+            return result
+        if wifilocator is None:
+            log.error("Module wifilocator Import Error.")
+            return None
+        self.__stats["lookups"] += 1
+        loc = wifilocator(self.__token).getwifilocator()
+        if not isinstance(loc, tuple):
+            log.warn("wifilocator error %s" % loc)
+            self.__stats["errors"] += 1
+            return None
+        result = {"lon": loc[0], "lat": loc[1], "accuracy": loc[2], "source": "wifi", "timestamp": utime.time(), "cached": False}
+        self.__cache.put(fingerprint, result)
+        return result
+
+    @property
+    def stats(self):
+        return self.__stats
+
+
+class NetLocation:
+    """Cell and Wi-Fi positioning in the background, next to GNSS acquisition.
+
+    request() hands one lookup round to a persistent worker thread and
+    returns at once; get() serves the most accurate result of the latest
+    round.
+    """
+
+    def __init__(self, cell=None, wifi=None):
+        self.__cell = cell
+        self.__wifi = wifi
+        self.__result = None
+        self.__queue = Queue(maxsize=1)
+        self.__busy = False
+        self.__worker = False
+
+    def __work(self):
+        while True:
+            method = self.__queue.get()
+            try:
+                self.__lookup(method)
+            finally:
+                self.__done()
+
+    def __lookup(self, method):
+        results = []
+        for loc, bit in ((self.__wifi, GPS._loc_method.wifi), (self.__cell, GPS._loc_method.cell)):
+            if loc is not None and method & bit:
+                try:
+                    res = loc.read()
+                    if res:
+                        results.append(res)
+                except Exception as e:
+                    log.error("Net location error: %s" % str(e))
+        if results:
+            results.sort(key=lambda i: i["accuracy"])
+            self.__set_result(dict(results[0]))
+
+    @option_lock(_net_loc_lock)
+    def __set_result(self, result):
+        result["ticks"] = utime.ticks_ms()
+        self.__result = result
+
+    @option_lock(_net_loc_lock)
+    def __done(self):
+        self.__busy = False
+
+    @option_lock(_net_loc_lock)
+    def request(self, method=GPS._loc_method.cell | GPS._loc_method.wifi):
+        """Start a lookup with the cell/wifi bits of method, False if one is still running."""
+        if self.__busy:
+            return False
+        if not self.__worker:
+            _thread.start_new_thread(self.__work, ())
+            self.__worker = True
+        self.__busy = True
+        self.__queue.put(method)
+        return True
+
+    @option_lock(_net_loc_lock)
+    def get(self, max_age=None):
+        """Latest result with its age (s), None if there is none or it is older than max_age."""
+        if self.__result is None:
+            return None
+        age = utime.ticks_diff(utime.ticks_ms(), self.__result["ticks"]) // 1000
+        if max_age is not None and age > max_age:
+            return None
+        res = dict(self.__result)
+        res["age"] = age
+        return res
@@ -25,25 +25,28 @@
 """
 
 import pm
+import net
 import usys
 import ujson
 import utime
 import _thread
 import osTimer
+import urandom
+import dataCall
 
+from queue import Queue
 from misc import Power, ADC
 from machine import Pin, I2C
 
 from usr.logging import Logger
 
-try:
-    from machine import RTC
-except ImportError:
-    RTC = None
-
 log = Logger(__name__)
 
 _history_lock = _thread.allocate_lock()
+_event_loop_lock = _thread.allocate_lock()
+_scheduler_lock = _thread.allocate_lock()
+_power_lock = _thread.allocate_lock()
+_alarm_lock = _thread.allocate_lock()
 
 BATTERY_OCV_TABLE = {
     "nix_coy_mnzo2": {
@@ -62,8 +65,6 @@ BATTERY_OCV_TABLE = {
     },
 }
 
-LOW_ENERGY_METHOD = ("NULL", "PM", "POWERDOWN")
-
 
 def option_lock(thread_lock):
     def function_lock(func):
@@ -214,80 +215,633 @@ class History:
         return self.__write(res)
 
 
-class LowEnergyManage:
-
-    def __init__(self, period=60, method="PM"):
-        self.__timer = RTC() if RTC else osTimer()
-        self.__period = period
-        self.__lpm_fd = None
-        self.__low_energy_method = method
-        self.__pm_lock_name = "low_energy_pm_lock"
-        self.__callback = None
+class PowerManage:
+    """Power state machine: active -> idle -> sleep -> wake -> active.
 
-    def __callback_thread(self):
-        if self.__low_energy_method == "PM":
-            self.__pm_init()
-            wlk_res = pm.wakelock_lock(self.__lpm_fd)
-            log.debug("pm.wakelock_lock %s." % ("Success" if wlk_res == 0 else "Falied"))
+    set_state() is the only way to change state and requesting the state
+    the machine is already in does nothing, so the enter handlers of a
+    state run once per transition however often it is asked for.
 
-        if self.__callback:
-            self.__callback(self.__low_energy_method)
+    The wakelock is reference counted by lock()/unlock() around work and
+    held for the whole wake state, so autosleep may suspend the module
+    whenever nothing is being done. Time in each state, the time the
+    wakelock was held and the wake latency, from entering wake to woke()
+    (the first report after waking up), are accounted in ms. A wake state
+    left without woke() counts as wake_aborted.
+    """
 
-        if self.__low_energy_method == "PM":
-            wulk_res = pm.wakelock_unlock(self.__lpm_fd)
-            log.debug("pm.wakelock_unlock %s." % ("Success" if wulk_res == 0 else "Falied"))
+    class _state:
+        active = 0
+        idle = 1
+        sleep = 2
+        wake = 3
 
-    def __timer_callback(self, args):
-        _thread.start_new_thread(self.__callback_thread, ())
-
-    def __rtc_enable(self, enable):
-        return True if self.__timer.enable_alarm(enable) == 0 else False
-
-    def __rtc_start(self):
-        self.__rtc_enable(0)
-        atime = utime.localtime(utime.mktime(utime.localtime()) + self.__period)
-        alarm_time = [atime[0], atime[1], atime[2], atime[6], atime[3], atime[4], atime[5], 0]
-        if self.__timer.register_callback(self.__timer_callback) == 0:
-            if self.__timer.set_alarm(alarm_time) == 0:
-                return self.__rtc_enable(1)
+    def __init__(self, name="bms_box_pm_lock"):
+        self.__name = name
+        self.__lpm_fd = None
+        self.__state = self._state.active
+        self.__handlers = {}
+        self.__holds = 0
+        self.__state_ticks = utime.ticks_ms()
+        self.__lock_ticks = 0
+        self.__wake_ticks = 0
+        self.__woke = False
+        self.__stats = {
+            "time": {self._state.active: 0, self._state.idle: 0, self._state.sleep: 0, self._state.wake: 0},
+            "transitions": 0,
+            "wakeups": 0,
+            "wake_aborted": 0,
+            "wake_latency": None,
+            "wake_latency_max": 0,
+            "locked": 0,
+        }
+
+    def init(self):
+        """Enable autosleep and create the wakelock."""
+        pm.autosleep(1)
+        if not self.__lpm_fd:
+            self.__lpm_fd = pm.create_wakelock(self.__name, len(self.__name))
+
+    @option_lock(_power_lock)
+    def lock(self):
+        self.__holds += 1
+        if self.__holds == 1:
+            self.__lock_ticks = utime.ticks_ms()
+            if self.__lpm_fd:
+                pm.wakelock_lock(self.__lpm_fd)
+
+    @option_lock(_power_lock)
+    def unlock(self):
+        if self.__holds == 0:
+            return
+        self.__holds -= 1
+        if self.__holds == 0:
+            if self.__lpm_fd:
+                pm.wakelock_unlock(self.__lpm_fd)
+            self.__stats["locked"] += utime.ticks_diff(utime.ticks_ms(), self.__lock_ticks)
+
+    @option_lock(_power_lock)
+    def __transit(self, state):
+        if state == self.__state:
+            return None
+        now = utime.ticks_ms()
+        previous = self.__state
+        self.__stats["time"][previous] += utime.ticks_diff(now, self.__state_ticks)
+        self.__stats["transitions"] += 1
+        self.__state_ticks = now
+        self.__state = state
+        if state == self._state.wake:
+            self.__wake_ticks = now
+            self.__woke = False
+            self.__stats["wakeups"] += 1
+        elif previous == self._state.wake and not self.__woke:
+            self.__stats["wake_aborted"] += 1
+        return previous
+
+    @option_lock(_power_lock)
+    def __wake_latency(self):
+        if self.__state != self._state.wake:
+            return None
+        latency = utime.ticks_diff(utime.ticks_ms(), self.__wake_ticks)
+        self.__woke = True
+        self.__stats["wake_latency"] = latency
+        self.__stats["wake_latency_max"] = max(self.__stats["wake_latency_max"], latency)
+        return latency
+
+    def add_handler(self, state, handler):
+        """handler(previous_state) runs on every transition into `state`."""
+        if callable(handler):
+            self.__handlers.setdefault(state, []).append(handler)
+            return True
         return False
 
-    def __rtc_stop(self):
-        return self.__rtc_enable(0)
-
-    def __ostimer_start(self):
-        return True if self.__timer.start(self.__period * 1000, 0, self.__timer_callback) == 0 else False
+    def set_state(self, state):
+        """Move to `state` and run its enter handlers, False if already there."""
+        previous = self.__transit(state)
+        if previous is None:
+            return False
+        log.debug("Power state %s -> %s." % (previous, state))
+        if previous == self._state.wake:
+            self.unlock()
+        elif state == self._state.wake:
+            self.lock()
+        for handler in self.__handlers.get(state, ()):
+            try:
+                handler(previous)
+            except Exception as e:
+                log.error("Power state %s handler error: %s" % (state, str(e)))
+                usys.print_exception(e)
+        return True
+
+    def woke(self):
+        """The first report after waking up went out: account the wake latency and go active.
+
+        Returns the latency in ms, None when not waking up.
+        """
+        latency = self.__wake_latency()
+        if latency is not None:
+            self.set_state(self._state.active)
+        return latency
 
-    def __ostimer_stop(self):
-        return True if self.__timer.stop() == 0 else False
+    @property
+    def state(self):
+        return self.__state
+
+    @option_lock(_power_lock)
+    def __snapshot(self):
+        now = utime.ticks_ms()
+        stats = dict(self.__stats)
+        stats["time"] = dict(self.__stats["time"])
+        stats["time"][self.__state] += utime.ticks_diff(now, self.__state_ticks)
+        if self.__holds:
+            stats["locked"] += utime.ticks_diff(now, self.__lock_ticks)
+        stats["state"] = self.__state
+        return stats
 
-    def __pm_init(self):
-        pm.autosleep(1)
-        if not self.__lpm_fd:
-            self.__lpm_fd = pm.create_wakelock(self.__pm_lock_name, len(self.__pm_lock_name))
+    @property
+    def stats(self):
+        """Time per state, wakelock held time and the last and worst wake latency, all in ms."""
+        return self.__snapshot()
+
+
+class NetManage:
+    """Network attach supervisor.
+
+    Owns the data call recovery on its own thread and publishes readiness
+    changes to subscribers, so callers never block on bearer recovery.
+    """
+
+    def __init__(self, pdp=1, check_period=60, grace=10, attach_timeout=30, backoff_min=2, backoff_max=60):
+        self.__pdp = pdp
+        self.__check_period = check_period
+        self.__grace = grace
+        self.__attach_timeout = attach_timeout
+        self.__backoff_min = backoff_min
+        self.__backoff_max = backoff_max
+        self.__ready = False
+        self.__callbacks = []
+        self.__queue = Queue(maxsize=4)
+        self.__timer = osTimer()
+        self.__start_ticks = None
+        self.__outage_ticks = None
+        self.__stats = {
+            "attach_latency": -1,
+            "last_attach_latency": -1,
+            "outages": 0,
+            "last_outage": 0,
+            "total_outage": 0,
+        }
+
+    def __post(self, event):
+        if self.__queue.size() < 4:
+            self.__queue.put(event)
+
+    def __datacall_callback(self, args):
+        log.debug("dataCall callback pdp[%s] state[%s]" % tuple(args[:2]))
+        self.__post(args[1])
 
-    def set_period(self, seconds=0):
-        if isinstance(seconds, int) and seconds > 0:
-            self.__period = seconds
+    def __timer_callback(self, args):
+        self.__post(None)
+
+    def __datacall_state(self):
+        data_call_info = dataCall.getInfo(self.__pdp, 0)
+        return True if isinstance(data_call_info, tuple) and data_call_info[2][0] == 1 else False
+
+    def __wait_datacall(self, timeout):
+        count = 0
+        while count < timeout:
+            if self.__datacall_state():
+                return True
+            utime.sleep(1)
+            count += 1
+        return self.__datacall_state()
+
+    def __set_ready(self, ready):
+        if ready == self.__ready:
+            return
+        now = utime.ticks_ms()
+        if ready:
+            if self.__outage_ticks is not None:
+                outage = utime.ticks_diff(now, self.__outage_ticks)
+                self.__stats["outages"] += 1
+                self.__stats["last_outage"] = outage
+                self.__stats["total_outage"] += outage
+                self.__outage_ticks = None
+                log.info("Network recovered after %s ms." % outage)
+            elif self.__stats["attach_latency"] < 0:
+                self.__stats["attach_latency"] = utime.ticks_diff(now, self.__start_ticks)
+                log.info("Network attached in %s ms." % self.__stats["attach_latency"])
+        else:
+            self.__outage_ticks = now
+            log.warn("Network data call lost.")
+        self.__ready = ready
+        for callback in self.__callbacks:
+            try:
+                callback(ready)
+            except Exception as e:
+                usys.print_exception(e)
+
+    def __recover(self):
+        # The modem usually re-establishes the bearer by itself, give it a chance first.
+        if self.__wait_datacall(self.__grace):
+            return True
+        attempt = 0
+        while True:
+            start = utime.ticks_ms()
+            net.setModemFun(4)
+            utime.sleep_ms(200)
+            net.setModemFun(1)
+            if self.__wait_datacall(self.__attach_timeout):
+                self.__stats["last_attach_latency"] = utime.ticks_diff(utime.ticks_ms(), start)
+                log.info("Network re-attach took %s ms." % self.__stats["last_attach_latency"])
+                return True
+            delay = min(self.__backoff_max, self.__backoff_min << min(attempt, 16))
+            log.warn("Network re-attach failed, retry in %s s." % delay)
+            attempt += 1
+            utime.sleep(delay)
+
+    def __supervise(self):
+        while True:
+            self.__queue.get()
+            if self.__datacall_state():
+                self.__set_ready(True)
+                continue
+            self.__set_ready(False)
+            self.__recover()
+            self.__set_ready(self.__datacall_state())
+
+    def add_callback(self, callback):
+        """Subscribe to readiness changes, callback(ready) runs on the supervisor thread."""
+        if callable(callback):
+            self.__callbacks.append(callback)
             return True
         return False
 
-    def set_method(self, method):
-        if method in LOW_ENERGY_METHOD:
-            if RTC is None and method == "POWERDOWN":
-                return False
-            self.__low_energy_method = method
+    def is_ready(self):
+        return self.__ready
+
+    @property
+    def stats(self):
+        return self.__stats
+
+    def start(self):
+        self.__start_ticks = utime.ticks_ms()
+        dataCall.setCallback(self.__datacall_callback)
+        self.__timer.start(self.__check_period * 1000, 1, self.__timer_callback)
+        _thread.start_new_thread(self.__supervise, ())
+        self.__post(None)
+        return True
+
+
+class EventLoop:
+    """Single queue dispatcher the application runs on.
+
+    post() is safe from any thread, driver or timer callback. run() blocks
+    on the queue and calls the handlers of each event in order, so
+    handlers never run concurrently and the loop only wakes when there is
+    work. An event posted without data while the same one is still
+    waiting is merged into it.
+    """
+
+    def __init__(self, size=16):
+        self.__size = size
+        self.__queue = Queue(maxsize=size)
+        self.__handlers = {}
+        self.__timers = {}
+        self.__waiting = {}
+        self.__reserved = []
+        self.__wakelock = None
+        self.__start_ticks = utime.ticks_ms()
+        self.__stats = {"wakeups": 0, "merged": 0, "dropped": 0, "events": {}}
+
+    @option_lock(_event_loop_lock)
+    def __enqueue(self, event, data):
+        if data is None:
+            if self.__waiting.get(event):
+                self.__stats["merged"] += 1
+                return True
+        limit = self.__size if event in self.__reserved else self.__size - len(self.__reserved)
+        if self.__queue.size() >= limit:
+            self.__stats["dropped"] += 1
+            return False
+        if data is None:
+            self.__waiting[event] = True
+        self.__queue.put((event, data))
+        return True
+
+    @option_lock(_event_loop_lock)
+    def __dequeued(self, event, data):
+        if data is None:
+            self.__waiting[event] = False
+        self.__stats["wakeups"] += 1
+        self.__stats["events"][event] = self.__stats["events"].get(event, 0) + 1
+
+    def post(self, event, data=None):
+        """Queue an event, False if the queue is full."""
+        return self.__enqueue(event, data)
+
+    @option_lock(_event_loop_lock)
+    def reserve(self, event):
+        """Keep a queue slot for `event`, other events fill one less.
+
+        Posted without data, a reserved event is merged while it waits, so
+        it always finds its slot and is never dropped.
+        """
+        if event not in self.__reserved:
+            self.__reserved.append(event)
+
+    def add_handler(self, event, handler):
+        """handler(data) runs on the loop for every `event`."""
+        if callable(handler):
+            self.__handlers.setdefault(event, []).append(handler)
             return True
         return False
 
+    def start_timer(self, event, period, periodic=False):
+        """Post `event` after `period` ms, every `period` ms if periodic; restarts a running timer."""
+        timer = self.__timers.get(event)
+        if timer is None:
+            timer = osTimer()
+            self.__timers[event] = timer
+        timer.stop()
+        return timer.start(period, 1 if periodic else 0, lambda args: self.post(event)) == 0
+
+    def stop_timer(self, event):
+        timer = self.__timers.get(event)
+        if timer is not None:
+            timer.stop()
+
+    def set_wakelock(self, wakelock):
+        """Hold wakelock (lock()/unlock(), e.g. a PowerManage) while handlers run, not while waiting."""
+        self.__wakelock = wakelock
+
+    def run_once(self):
+        """Wait for one event and dispatch it."""
+        event, data = self.__queue.get()
+        self.__dequeued(event, data)
+        wakelock = self.__wakelock
+        if wakelock is not None:
+            wakelock.lock()
+        try:
+            for handler in self.__handlers.get(event, ()):
+                try:
+                    handler(data)
+                except Exception as e:
+                    log.error("Event %s handler error: %s" % (event, str(e)))
+                    usys.print_exception(e)
+        finally:
+            if wakelock is not None:
+                wakelock.unlock()
+
+    def run(self):
+        while True:
+            self.run_once()
+
+    @property
+    def stats(self):
+        """Wakeups, merged and dropped posts, per event counts and the uptime in ms."""
+        stats = dict(self.__stats)
+        stats["events"] = dict(self.__stats["events"])
+        stats["uptime"] = utime.ticks_diff(utime.ticks_ms(), self.__start_ticks)
+        return stats
+
+
+class Scheduler:
+    """Named periodic and one-shot tasks run by deadline on an EventLoop.
+
+    Only the earliest deadline is armed, as the timer of `event` on the
+    loop, so nothing wakes up between deadlines. Due tasks run in priority
+    order, lower first. A periodic task is due again one period after its
+    previous deadline plus 0..jitter seconds; one that fell more than a
+    period behind restarts from now instead of running to catch up.
+    """
+
+    __CALLBACK = 0
+    __PERIOD = 1
+    __JITTER = 2
+    __PRIORITY = 3
+    __DEADLINE = 4
+
+    def __init__(self, loop, event):
+        self.__loop = loop
+        self.__event = event
+        self.__tasks = {}
+        self.__stats = {}
+        self.__suspended = False
+        loop.add_handler(event, self.__run)
+
+    def __jitter(self, task):
+        return urandom.randint(0, task[self.__JITTER]) if task[self.__JITTER] > 0 else 0
+
+    @option_lock(_scheduler_lock)
+    def __earliest(self, name=None):
+        now = utime.ticks_ms()
+        earliest = None
+        for _name, task in self.__tasks.items():
+            if task[self.__DEADLINE] is None or (name is not None and _name != name):
+                continue
+            delay = utime.ticks_diff(task[self.__DEADLINE], now)
+            if earliest is None or delay < earliest:
+                earliest = delay
+        return None if earliest is None else max(earliest, 0)
+
+    def __arm(self):
+        delay = None if self.__suspended else self.__earliest()
+        if delay is None:
+            self.__loop.stop_timer(self.__event)
+        else:
+            self.__loop.start_timer(self.__event, max(delay, 1))
+
+    @option_lock(_scheduler_lock)
+    def __take_due(self):
+        now = utime.ticks_ms()
+        due = []
+        for name, task in self.__tasks.items():
+            deadline = task[self.__DEADLINE]
+            if deadline is None or utime.ticks_diff(deadline, now) > 0:
+                continue
+            late = utime.ticks_diff(now, deadline)
+            stats = self.__stats[name]
+            stats["runs"] += 1
+            stats["max_late"] = max(stats["max_late"], late)
+            period = task[self.__PERIOD] * 1000
+            if period > 0:
+                base = deadline if late < period else now
+                task[self.__DEADLINE] = utime.ticks_add(base, period + self.__jitter(task) * 1000)
+            else:
+                task[self.__DEADLINE] = None
+            due.append((task[self.__PRIORITY], name, task[self.__CALLBACK]))
+        due.sort(key=lambda i: i[0])
+        return due
+
+    def __run(self, data):
+        if self.__suspended:
+            return
+        for priority, name, callback in self.__take_due():
+            try:
+                callback()
+            except Exception as e:
+                log.error("Task %s error: %s" % (name, str(e)))
+                usys.print_exception(e)
+        self.__arm()
+
+    @option_lock(_scheduler_lock)
+    def __add(self, name, callback, period, delay, jitter, priority):
+        task = [callback, period, jitter, priority, None]
+        if delay is None:
+            delay = period + self.__jitter(task)
+        task[self.__DEADLINE] = utime.ticks_add(utime.ticks_ms(), delay * 1000)
+        self.__tasks[name] = task
+        self.__stats.setdefault(name, {"runs": 0, "max_late": 0})
+
+    def add(self, name, callback, period=0, delay=None, jitter=0, priority=5):
+        """Add or replace task `name`.
+
+        callback() runs every `period` seconds, first after `delay` seconds
+        (default one period plus jitter); period 0 makes a one-shot.
+        """
+        if not callable(callback):
+            return False
+        self.__add(name, callback, period, delay, jitter, priority)
+        self.__arm()
+        return True
+
+    @option_lock(_scheduler_lock)
+    def __set(self, name, period, delay):
+        task = self.__tasks.get(name)
+        if task is None:
+            return False
+        if period is not None:
+            task[self.__PERIOD] = period
+        if delay is not None:
+            task[self.__DEADLINE] = utime.ticks_add(utime.ticks_ms(), delay * 1000)
+        elif period is not None:
+            # A new period takes effect from now, 0 stops a periodic task.
+            task[self.__DEADLINE] = utime.ticks_add(utime.ticks_ms(), period * 1000) if period > 0 else None
+        return True
+
+    def set_period(self, name, period):
+        """Change the period (s) of a task at runtime, 0 pauses it."""
+        if not isinstance(period, int) or period < 0:
+            return False
+        res = self.__set(name, period, None)
+        self.__arm()
+        return res
+
+    def trigger(self, name, delay=0):
+        """Run task `name` after `delay` seconds, a periodic task goes on from there."""
+        res = self.__set(name, None, delay)
+        self.__arm()
+        return res
+
+    @option_lock(_scheduler_lock)
+    def remove(self, name):
+        return self.__tasks.pop(name, None) is not None
+
+    def next_deadline(self, name=None):
+        """Milliseconds until the earliest deadline (of task `name`), None if there is none."""
+        return self.__earliest(name)
+
+    def suspend(self):
+        """Stop waking up for tasks, deadlines keep running out meanwhile."""
+        self.__suspended = True
+        self.__arm()
+
+    def resume(self):
+        """Wake up for tasks again, the ones that came due while suspended run right away."""
+        self.__suspended = False
+        self.__arm()
+
+    @property
+    def stats(self):
+        """Runs and worst lateness (ms) per task."""
+        return dict([(k, dict(v)) for k, v in self.__stats.items()])
+
+
+class AlarmEngine:
+    """Per fault debounce and clear hysteresis over the faults decoded from BMS frames.
+
+    update() takes the faults (object model event codes) active in one
+    frame. A fault is raised after `debounce` consecutive frames with it
+    and cleared after `clear` consecutive frames without it, each fault on
+    its own, so one that flaps is reported once per raise and clear.
+    `overrides` maps a fault to its own [debounce, clear].
+
+    On a confirmed change callback(raised, cleared, ticks) runs from
+    update(), ticks being utime.ticks_ms() of the decode; reported(ticks)
+    turns it into the frame to cloud latency.
+    """
+
+    def __init__(self, debounce=2, clear=3, overrides=None):
+        self.__debounce = debounce
+        self.__clear = clear
+        self.__overrides = overrides or {}
+        self.__active = {}
+        self.__counts = {}
+        self.__callback = None
+        self.__stats = {"frames": 0, "raised": 0, "cleared": 0, "suppressed": 0, "latency": None, "latency_max": 0}
+
+    def __frames(self, fault, present):
+        override = self.__overrides.get(fault)
+        if override:
+            return override[0] if present else override[1]
+        return self.__debounce if present else self.__clear
+
+    @option_lock(_alarm_lock)
+    def __update(self, faults):
+        self.__stats["frames"] += 1
+        raised = []
+        cleared = []
+        for fault in set(faults) | set(self.__active) | set(self.__counts):
+            present = fault in faults
+            if present == (fault in self.__active):
+                # Back to the confirmed state before the change was: a flap absorbed.
+                if self.__counts.pop(fault, 0):
+                    self.__stats["suppressed"] += 1
+                continue
+            count = self.__counts.get(fault, 0) + 1
+            if count < self.__frames(fault, present):
+                self.__counts[fault] = count
+                continue
+            self.__counts.pop(fault, None)
+            if present:
+                self.__active[fault] = True
+                raised.append(fault)
+            else:
+                self.__active.pop(fault)
+                cleared.append(fault)
+        self.__stats["raised"] += len(raised)
+        self.__stats["cleared"] += len(cleared)
+        return raised, cleared
+
+    def update(self, faults):
+        """Feed the faults of one frame, returns the (raised, cleared) faults confirmed by it."""
+        ticks = utime.ticks_ms()
+        raised, cleared = self.__update(faults)
+        if (raised or cleared) and self.__callback:
+            self.__callback(raised, cleared, ticks)
+        return raised, cleared
+
+    @option_lock(_alarm_lock)
+    def reported(self, ticks):
+        """The change decoded at `ticks` reached the cloud, returns the latency in ms."""
+        latency = utime.ticks_diff(utime.ticks_ms(), ticks)
+        self.__stats["latency"] = latency
+        self.__stats["latency_max"] = max(self.__stats["latency_max"], latency)
+        return latency
+
     def set_callback(self, callback):
         if callable(callback):
             self.__callback = callback
             return True
         return False
 
-    def start(self):
-        return self.__rtc_start() if RTC else self.__ostimer_start()
+    @option_lock(_alarm_lock)
+    def active(self):
+        """Faults currently raised."""
+        return list(self.__active)
 
-    def stop(self):
-        return self.__rtc_stop() if RTC else self.__ostimer_stop()
+    @property
+    def stats(self):
+        """Frames, raised, cleared and suppressed flaps, last and worst frame to cloud latency (ms)."""
+        return dict(self.__stats)
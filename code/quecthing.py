@@ -23,23 +23,32 @@
 @date      :2022-10-10 13:52:52
 @copyright :Copyright (c) 2022
 """
+import gc
+import uio
 import uos
 import usys
 import ql_fs
 import uzlib
 import ujson
 import utime
+import _thread
 import quecIot
+import urandom
 import uhashlib
+import osTimer
 import ubinascii
 import app_fota_download
 
 from misc import Power
+from queue import Queue
 
 from usr.logging import Logger
+from usr.modules import option_lock
 
 log = Logger(__name__)
 
+_ack_lock = _thread.allocate_lock()
+
 
 class QuecObjectModel:
 
@@ -153,7 +162,15 @@ class QuecObjectModel:
 
 class QuecThing:
 
-    def __init__(self, pk, ps, dk, ds, mode=1, server="iot-south.quectel.com:1883", life_time=120, fw_name="", fw_version=""):
+    class _conn_state:
+        disconnected = 0
+        connecting = 1
+        authenticated = 2
+        accessed = 3
+        online = 4
+
+    def __init__(self, pk, ps, dk, ds, mode=1, server="iot-south.quectel.com:1883", life_time=120, fw_name="", fw_version="",
+                 reconnect_min=2, reconnect_max=300, connect_timeout=30, ack_timeout=10):
         self.__pk = pk
         self.__ps = ps
         self.__dk = dk
@@ -164,7 +181,19 @@ class QuecThing:
         self.__fw_name = fw_name
         self.__fw_version = fw_version
         self.__callback = None
-        self.__report_res = {}
+        self.__ack_timeout = ack_timeout
+        self.__ack_queue = Queue(maxsize=8)
+        self.__ack_timer = osTimer()
+        self.__ack_stats = {"acks": 0, "timeouts": 0, "latency": 0, "latency_max": 0}
+        self.__conn_state = self._conn_state.disconnected
+        self.__state_callback = None
+        self.__auto_reconnect = False
+        self.__initialized = False
+        self.__reconnect_min = reconnect_min
+        self.__reconnect_max = reconnect_max
+        self.__connect_timeout = connect_timeout
+        self.__reconnect_queue = Queue(maxsize=1)
+        self.__reconnect_thread_id = None
 
     def __event_callback(self, args):
         _data = ()
@@ -176,13 +205,22 @@ class QuecThing:
                 msg = ""
                 if event == 1:
                     msg = "Device authentication succeeded."
+                    self.__set_conn_state(self._conn_state.authenticated)
                 elif event == 2:
                     msg = "Access is successful."
+                    self.__set_conn_state(self._conn_state.accessed)
                 elif event == 3:
                     msg = "Subscription succeeded."
+                    self.__set_conn_state(self._conn_state.online)
                 elif event == 6:
                     msg = "Logout succeeded (disconnection succeeded)."
+                    self.__set_conn_state(self._conn_state.disconnected)
+                    self.__schedule_reconnect()
                 log.debug(msg)
+            else:
+                log.warn("QuecIot connection error. Event[%s] ErrCode[%s]" % (event, errcode))
+                self.__set_conn_state(self._conn_state.disconnected)
+                self.__schedule_reconnect()
         if event == 4:
             if errcode == 10200:
                 self.__set_report_res(0, True)
@@ -213,27 +251,103 @@ class QuecThing:
                 retry += 1
                 utime.sleep(1)
 
-    def __get_report_res(self, mode):
-        report_res = False
-        retry = 0
-        while retry < 10:
-            if mode in self.__report_res.keys():
-                report_res = self.__report_res.pop(mode)
-                break
-            retry += 1
-            utime.sleep(1)
+    def __clear_report_res(self):
+        """Drop acks and timeouts left over from reports that were given up on."""
+        while self.__ack_queue.size() > 0:
+            self.__ack_queue.get()
 
-        return report_res
+    def __ack_timer_callback(self, args):
+        self.__set_report_res(None, False)
 
+    def __get_report_res(self, mode, start):
+        """Block until the ack of report `mode` arrives, False after ack_timeout seconds."""
+        self.__ack_timer.start(self.__ack_timeout * 1000, 0, self.__ack_timer_callback)
+        while True:
+            _mode, report_res = self.__ack_queue.get()
+            if _mode is None:
+                self.__ack_stats["timeouts"] += 1
+                return False
+            if _mode == mode:
+                self.__ack_timer.stop()
+                latency = utime.ticks_diff(utime.ticks_ms(), start)
+                self.__ack_stats["acks"] += 1
+                self.__ack_stats["latency"] = latency
+                self.__ack_stats["latency_max"] = max(self.__ack_stats["latency_max"], latency)
+                return report_res
+
+    @option_lock(_ack_lock)
     def __set_report_res(self, mode, res):
-        self.__report_res[mode] = res
+        """Queue an ack, the ack timeout drops the oldest ack if full so a waiting report always wakes up."""
+        if mode is None:
+            while self.__ack_queue.size() >= 8:
+                self.__ack_queue.get()
+        if self.__ack_queue.size() < 8:
+            self.__ack_queue.put((mode, res))
+
+    def __set_conn_state(self, state):
+        if state == self.__conn_state:
+            return
+        log.debug("QuecIot conn state %s -> %s" % (self.__conn_state, state))
+        self.__conn_state = state
+        if self.__state_callback:
+            try:
+                self.__state_callback(state)
+            except Exception as e:
+                usys.print_exception(e)
+
+    def __backoff(self, attempt):
+        """Reconnect delay in milliseconds, exponential with equal jitter."""
+        delay = min(self.__reconnect_max, self.__reconnect_min << min(attempt, 16)) * 1000
+        return delay // 2 + urandom.randint(0, delay // 2)
+
+    def __wait_online(self, timeout_ms):
+        """Sleep up to timeout_ms, return True early once online or reconnect is cancelled."""
+        start = utime.ticks_ms()
+        while utime.ticks_diff(utime.ticks_ms(), start) < timeout_ms:
+            if self.is_online() or not self.__auto_reconnect:
+                return True
+            utime.sleep_ms(100)
+        return False
+
+    def __wait_attempt(self, timeout_ms):
+        """Wait for a connection attempt, up to timeout_ms, return False as soon as it fails."""
+        start = utime.ticks_ms()
+        while utime.ticks_diff(utime.ticks_ms(), start) < timeout_ms:
+            if self.is_online() or not self.__auto_reconnect:
+                return True
+            if self.__conn_state == self._conn_state.disconnected:
+                return False
+            utime.sleep_ms(100)
+        return False
+
+    def __reconnect_thread(self):
+        while True:
+            self.__reconnect_queue.get()
+            attempt = 0
+            while not self.__wait_online(self.__backoff(attempt)):
+                attempt += 1
+                log.debug("QuecIot reconnect attempt %s." % attempt)
+                self.__set_conn_state(self._conn_state.connecting)
+                quecIot.setConnmode(0)
+                quecIot.setConnmode(1)
+                self.__wait_attempt(self.__connect_timeout * 1000)
+
+    def __schedule_reconnect(self):
+        if not self.__auto_reconnect:
+            return
+        if self.__reconnect_thread_id is None:
+            self.__reconnect_thread_id = _thread.start_new_thread(self.__reconnect_thread, ())
+        if self.__reconnect_queue.size() == 0:
+            self.__reconnect_queue.put(True)
 
     @property
     def status(self):
         ws = quecIot.getWorkState()
         cm = quecIot.getConnmode()
-        log.debug("QuecIot WorkState[%s] ConnMode[%s]" % (ws, cm))
-        return True if ws == 8 and cm == 1 else False
+        online = True if ws == 8 and cm == 1 else False
+        if online:
+            self.__set_conn_state(self._conn_state.online)
+        return online
 
     @property
     def device_secret(self):
@@ -245,7 +359,34 @@ class QuecThing:
             return True
         return False
 
+    def on_state_change(self, callback):
+        """Register a hook called with the new connection state on every transition.
+
+        The hook runs on the QuecIot event thread and must return quickly.
+        """
+        if callable(callback):
+            self.__state_callback = callback
+            return True
+        return False
+
+    def is_online(self):
+        return self.__conn_state == self._conn_state.online
+
+    @property
+    def conn_state(self):
+        return self.__conn_state
+
+    def reconnect(self):
+        """Request a background reconnect, returns immediately."""
+        if not self.__initialized:
+            return False
+        self.__auto_reconnect = True
+        self.__schedule_reconnect()
+        return True
+
     def connect(self):
+        self.__auto_reconnect = True
+        self.__set_conn_state(self._conn_state.connecting)
         if not quecIot.init():
             return 1
         if not quecIot.setEventCB(self.__event_callback):
@@ -263,27 +404,38 @@ class QuecThing:
             return 7
         if not quecIot.setConnmode(1):
             return 8
-            
+        self.__initialized = True
+
         self.__get_device_secret()
         utime.sleep_ms(200)
         return self.status
 
     def disconnect(self):
+        self.__auto_reconnect = False
         return quecIot.setConnmode(0)
 
     def objmodel_report(self, data, qos=2):
+        self.__clear_report_res()
+        start = utime.ticks_ms()
         res = quecIot.phymodelReport(qos, data)
         log.debug("phymodelReport res: %s" % res)
-        return self.__get_report_res(1) if res else False
+        return self.__get_report_res(1, start) if res else False
 
     def loc_report(self, data, mode="gps"):
         res = False
+        self.__clear_report_res()
+        start = utime.ticks_ms()
         if mode == "gps":
             res = quecIot.locReportOutside(data)
         else:
             res = quecIot.locReportInside(data)
 
-        return self.__get_report_res(2) if res else False
+        return self.__get_report_res(2, start) if res else False
+
+    @property
+    def ack_stats(self):
+        """Report acks, timeouts and the last and worst ack latency in ms."""
+        return dict(self.__ack_stats)
 
     def device_report(self):
         return quecIot.devInfoReport([i for i in range(1, 13)])
@@ -295,36 +447,331 @@ class QuecThing:
         return quecIot.otaAction(action) if action in range(4) else False
 
 
+def _elapsed_us(start):
+    return utime.ticks_diff(utime.ticks_us(), start)
+
+
+class _BufferedWriter:
+    """Write-behind buffer reused across files, so flash only sees block sized writes."""
+
+    def __init__(self, stats, key, size=4096):
+        self.__stats = stats
+        self.__key = key
+        self.__buf = bytearray(size)
+        self.__mv = memoryview(self.__buf)
+        self.__len = 0
+        self.__fp = None
+
+    def open(self, path, mode="wb", offset=0):
+        self.close()
+        self.__fp = open(path, mode)
+        if offset:
+            self.__fp.seek(offset)
+
+    def write(self, data):
+        data = memoryview(data)
+        total = len(data)
+        pos = 0
+        while pos < total:
+            size = min(total - pos, len(self.__buf) - self.__len)
+            self.__mv[self.__len:self.__len + size] = data[pos:pos + size]
+            self.__len += size
+            pos += size
+            if self.__len == len(self.__buf):
+                self.flush()
+        return total
+
+    def flush(self):
+        if self.__len:
+            start = utime.ticks_us()
+            self.__fp.write(self.__mv[:self.__len])
+            self.__len = 0
+            self.__stats[self.__key] += _elapsed_us(start)
+
+    def sync(self):
+        self.flush()
+        self.__fp.flush()
+
+    def close(self):
+        if self.__fp is not None:
+            self.flush()
+            self.__fp.close()
+            self.__fp = None
+
+    @property
+    def is_open(self):
+        return self.__fp is not None
+
+
+class _OTAJournal:
+    """Spool of the downloaded package with a checkpoint, so an interrupted download resumes.
+
+    The checkpoint records the package identity (size, MD5), the number of
+    bytes safely written to the spool and their CRC32. On the next attempt
+    the spool is verified against it and replayed instead of downloaded.
+    """
+
+    def __init__(self, file_size, file_md5, stats, spool="/usr/sotaFile.tar.gz", checkpoint="/usr/sotaFile.ckpt", interval=0x8000):
+        self.__file_size = file_size
+        self.__file_md5 = file_md5
+        self.__spool = spool
+        self.__checkpoint = checkpoint
+        self.__interval = interval
+        self.__writer = _BufferedWriter(stats, "journal")
+        self.__buf = bytearray(4096)
+        self.__offset = 0
+        self.__size = 0
+        self.__crc = 0
+        self.__load()
+
+    def __remove(self, path):
+        try:
+            uos.remove(path)
+        except Exception:
+            pass
+
+    def __chunks(self, offset):
+        mv = memoryview(self.__buf)
+        size = 0
+        with open(self.__spool, "rb") as fp:
+            while size < offset:
+                n = fp.readinto(mv[:min(len(self.__buf), offset - size)])
+                if not n:
+                    raise OSError("OTA spool truncated at %s" % size)
+                size += n
+                yield mv[:n]
+
+    def __verify(self, offset):
+        crc = 0
+        try:
+            for data in self.__chunks(offset):
+                crc = ubinascii.crc32(data, crc)
+        except OSError:
+            return None
+        return crc
+
+    def __load(self):
+        ckpt = {}
+        if ql_fs.path_exists(self.__checkpoint) and ql_fs.path_exists(self.__spool):
+            try:
+                with open(self.__checkpoint, "r") as f:
+                    ckpt = ujson.load(f)
+            except Exception as e:
+                usys.print_exception(e)
+        if ckpt.get("size") == self.__file_size and ckpt.get("md5") == self.__file_md5 and ckpt.get("offset", 0) > 0:
+            crc = self.__verify(ckpt["offset"])
+            if crc is not None and crc == ckpt.get("crc"):
+                self.__offset = self.__size = ckpt["offset"]
+                self.__crc = crc
+                log.info("OTA resume from checkpoint %s/%s." % (self.__offset, self.__file_size))
+            else:
+                log.warn("OTA checkpoint verification failed, restart download.")
+        if self.__offset == 0:
+            self.remove()
+
+    def replay_size(self):
+        return self.__offset
+
+    def replay(self):
+        """Generator over the verified spool content, chunks share one buffer."""
+        return self.__chunks(self.__offset)
+
+    def write(self, data):
+        if not self.__writer.is_open:
+            if self.__size:
+                self.__writer.open(self.__spool, "rb+", self.__size)
+            else:
+                self.__writer.open(self.__spool, "wb")
+        self.__writer.write(data)
+        self.__crc = ubinascii.crc32(data, self.__crc)
+        self.__size += len(data)
+        if self.__size - self.__offset >= self.__interval:
+            self.checkpoint()
+
+    def checkpoint(self):
+        if not self.__writer.is_open or self.__size == self.__offset:
+            return
+        self.__writer.sync()
+        with open(self.__checkpoint, "w") as f:
+            ujson.dump({"size": self.__file_size, "md5": self.__file_md5, "offset": self.__size, "crc": self.__crc}, f)
+        self.__offset = self.__size
+        log.debug("OTA checkpoint %s/%s." % (self.__offset, self.__file_size))
+
+    def close(self):
+        self.checkpoint()
+        self.__writer.close()
+
+    def remove(self):
+        self.__writer.close()
+        self.__remove(self.__checkpoint)
+        self.__remove(self.__spool)
+        self.__offset = self.__size = self.__crc = 0
+
+
+class _OTAStream(uio.IOBase):
+    """Read-only stream over the OTA package, pulled with mcuFWDataRead as it is consumed.
+
+    Every chunk goes through the MD5 hasher when it is fetched, so the package
+    is hashed, inflated and extracted in a single pass without a temp file.
+    The read size adapts to the measured read time and free RAM.
+    """
+
+    def __init__(self, file_size, next_piece, stats, journal=None, readsize=4096, min_readsize=1024, max_readsize=16384,
+                 fast_us=100000, slow_us=1000000):
+        self.__file_size = file_size
+        self.__next_piece = next_piece
+        self.__stats = stats
+        self.__journal = journal
+        self.__replay = journal.replay() if journal and journal.replay_size() else None
+        self.__readsize = readsize
+        self.__min_readsize = min_readsize
+        self.__max_readsize = max_readsize
+        self.__fast_us = fast_us
+        self.__slow_us = slow_us
+        self.__hash = uhashlib.md5()
+        self.__addr = 0
+        self.__piece_left = 0
+        self.__download_size = 0
+        self.__mv = memoryview(b"")
+        self.__pos = 0
+
+    def __adapt(self, size, elapsed):
+        if size < self.__readsize:
+            # A short tail read says nothing about the link.
+            return
+        free = gc.mem_free()
+        if elapsed < self.__fast_us and free > self.__readsize * 8 and self.__readsize < self.__max_readsize:
+            self.__readsize <<= 1
+        elif (elapsed > self.__slow_us or free < self.__readsize * 4) and self.__readsize > self.__min_readsize:
+            self.__readsize >>= 1
+        self.__stats["chunk_max"] = max(self.__stats["chunk_max"], self.__readsize)
+        self.__stats["chunk_min"] = min(self.__stats["chunk_min"], self.__readsize)
+
+    def __download(self):
+        while self.__piece_left == 0:
+            piece = self.__next_piece()
+            if not piece:
+                raise OSError("OTA piece wait timeout")
+            self.__addr, self.__piece_left = piece
+            # Pieces may overlap what the journal already holds, only fetch the rest.
+            if self.__addr < self.__download_size:
+                skip = min(self.__download_size - self.__addr, self.__piece_left)
+                self.__addr += skip
+                self.__piece_left -= skip
+        size = min(self.__readsize, self.__piece_left)
+        start = utime.ticks_us()
+        data = quecIot.mcuFWDataRead(self.__addr, size)
+        elapsed = _elapsed_us(start)
+        self.__stats["read"] += elapsed
+        if not data:
+            raise OSError("mcuFWDataRead failed at %s" % self.__addr)
+        self.__adapt(len(data), elapsed)
+        self.__addr += len(data)
+        self.__piece_left -= len(data)
+        self.__stats["downloaded"] += len(data)
+        if self.__journal:
+            self.__journal.write(data)
+        return data
+
+    def __fetch(self):
+        if self.__download_size >= self.__file_size:
+            return False
+        data = None
+        if self.__replay is not None:
+            try:
+                data = next(self.__replay)
+            except StopIteration:
+                self.__replay = None
+        if data is None:
+            data = self.__download()
+        start = utime.ticks_us()
+        self.__hash.update(data)
+        self.__stats["hash"] += _elapsed_us(start)
+        self.__download_size += len(data)
+        log.debug("Download File Size: %s/%s" % (self.__download_size, self.__file_size))
+        self.__mv = memoryview(data)
+        self.__pos = 0
+        return True
+
+    def readinto(self, buf):
+        if self.__pos >= len(self.__mv) and not self.__fetch():
+            return 0
+        size = min(len(buf), len(self.__mv) - self.__pos)
+        buf[:size] = self.__mv[self.__pos:self.__pos + size]
+        self.__pos += size
+        return size
+
+    def skip(self, size):
+        buf = bytearray(1)
+        while size > 0 and self.readinto(buf):
+            size -= 1
+
+    def drain(self):
+        """Download and hash whatever the inflater did not consume (gzip trailer, padding)."""
+        while self.__fetch():
+            pass
+
+    @property
+    def download_size(self):
+        return self.__download_size
+
+    @property
+    def md5(self):
+        return ubinascii.hexlify(self.__hash.digest()).decode("ascii")
+
+
+class _ota_result:
+    success = 0
+    failed = 1
+    delta_failed = 2
+
+
 class QuecOTA:
+    """SOTA package download and staging.
 
-    def __init__(self):
-        self.__ota_file = "/usr/sotaFile.tar.gz"
+    A package is a gzip'd tar of the usr/ files. A delta package (built by
+    tools/sota_delta.py) also carries a .delta.json manifest and per-file
+    patches in .delta/, the patched files are rebuilt from the installed
+    /usr/ files and every file is checked against the manifest MD5 before
+    anything is staged.
+
+    resume spools the package to /usr/ so an interrupted download picks up
+    from its last checkpoint, at the cost of writing it to flash twice.
+    """
+
+    result = _ota_result
+
+    def __init__(self, piece_timeout=60, resume=False, version=""):
         self.__updater_dir = "/usr/.updater/usr/"
-        self.__file_hash = uhashlib.md5()
+        self.__delta_manifest = ".delta.json"
+        self.__delta_dir = ".delta/"
+        self.__version = version
+        self.__callback = None
         self.__file_size = 0
         self.__file_md5 = ""
-        self.__download_size = 0
-
-    def __write_ota_file(self, data):
-        with open(self.__ota_file, "ab+") as fp:
-            fp.write(data)
-            self.__file_hash.update(data)
+        self.__piece_timeout = piece_timeout
+        self.__resume = resume
+        self.__piece_queue = Queue(maxsize=2)
+        self.__piece_timer = osTimer()
+        self.__pieces = 0
+        self.__running = False
+        self.__stats = {}
 
     def __get_file_size(self, data):
-        size = data.decode("ascii")
-        size = size.rstrip("\0")
-        if (len(size) == 0):
-            return 0
-        size = int(size, 8)
+        # Octal digits, terminated by NUL or space.
+        size = 0
+        for c in data:
+            if 0x30 <= c <= 0x37:
+                size = (size << 3) + c - 0x30
+            elif c == 0 or (c == 0x20 and size):
+                break
         return size
 
     def __get_file_name(self, name):
-        file_name = name.decode("ascii")
-        file_name = file_name.rstrip("\0")
-        return file_name
+        file_name = bytes(name).split(b"\0")[0]
+        return file_name.decode("ascii")
 
-    def __check_md5(self):
-        file_md5 = ubinascii.hexlify(self.__file_hash.digest()).decode("ascii")
+    def __check_md5(self, file_md5):
         log.debug("DMP Calc MD5 Value: %s, Device Calc MD5 Value: %s" % (self.__file_md5, file_md5))
         if (self.__file_md5 != file_md5):
             log.error("MD5 Verification Failed")
@@ -333,88 +780,299 @@ class QuecOTA:
         log.debug("MD5 Verification Success.")
         return True
 
-    def __download(self, start_addr, piece_size):
-        res = 2
-        readsize = 4096
-        while piece_size > 0:
-            readsize = readsize if readsize <= piece_size else piece_size
-            updateFile = quecIot.mcuFWDataRead(start_addr, readsize)
-            self.__write_ota_file(updateFile)
-            log.debug("Download File Size: %s" % readsize)
-            piece_size -= readsize
-            start_addr += readsize
-            self.__download_size += readsize
-            if (self.__download_size == self.__file_size):
-                log.debug("File Download Success, Update Start.")
-                res = 3
-                quecIot.otaAction(res)
+    def __piece_timeout_callback(self, args):
+        if self.__piece_queue.size() == 0:
+            self.__piece_queue.put(None)
+
+    def __next_piece(self):
+        if self.__pieces > 0:
+            # Ask the cloud for the next piece, it arrives through start_ota().
+            quecIot.otaAction(2)
+        self.__pieces += 1
+        self.__piece_timer.start(self.__piece_timeout * 1000, 0, self.__piece_timeout_callback)
+        piece = self.__piece_queue.get()
+        self.__piece_timer.stop()
+        return piece
+
+    def __read_block(self, unzip_fp, mv):
+        """Fill mv from the inflater, the time spent upstream (read, hash, journal) is not inflate time."""
+        stats = self.__stats
+        start = utime.ticks_us()
+        upstream = stats["read"] + stats["hash"] + stats["journal"]
+        size = 0
+        while size < len(mv):
+            n = unzip_fp.readinto(mv[size:])
+            if not n:
+                break
+            size += n
+        stats["inflate"] += _elapsed_us(start) - (stats["read"] + stats["hash"] + stats["journal"] - upstream)
+        stats["inflated"] += size
+        return size
+
+    def __untar(self, unzip_fp, writer):
+        file_list = []
+        block = bytearray(0x800)
+        mv = memoryview(block)
+        header = mv[:0x200]
+        while True:
+            if self.__read_block(unzip_fp, header) < 0x200:
+                log.debug("[OTA Upgrade] Read file size zore.")
                 break
+
+            size = self.__get_file_size(header[124:136])
+            file_name = self.__get_file_name(header[:100])
+            log.debug("[OTA Upgrade] File Name: %s, File Size: %s" % (file_name, size))
+
+            if not size:
+                if len(file_name):
+                    log.debug("[OTA Upgrade] Create file: %s" % self.__updater_dir + file_name)
+                    ql_fs.mkdirs(self.__updater_dir + file_name)
+                else:
+                    log.debug("[OTA Upgrade] Have no file unzip.")
+                    break
             else:
-                quecIot.otaAction(res)
+                log.debug("File %s write size %s" % (self.__updater_dir + file_name, size))
+                file_list.append({"file_name": "/usr/" + file_name, "size": size})
+                writer.open(self.__updater_dir + file_name, "wb")
+                last_size = size
+                # Member data is padded to a whole number of 512 byte blocks.
+                padded_size = (size + 0x1FF) & ~0x1FF
+                while padded_size > 0:
+                    read_size = self.__read_block(unzip_fp, mv[:min(padded_size, len(block))])
+                    if not read_size:
+                        raise OSError("OTA package truncated in %s" % file_name)
+                    write_size = min(read_size, last_size)
+                    if write_size:
+                        writer.write(mv[:write_size])
+                    last_size -= write_size
+                    padded_size -= read_size
+                writer.close()
+        return file_list
 
-        return res
+    def __clean_updater(self, file_list):
+        for file_name in file_list:
+            try:
+                uos.remove("/usr/.updater" + file_name["file_name"])
+            except Exception:
+                pass
+
+    def __md5sum(self, path, buf):
+        md5 = uhashlib.md5()
+        mv = memoryview(buf)
+        with open(path, "rb") as f:
+            while True:
+                n = f.readinto(buf)
+                if not n:
+                    break
+                md5.update(mv[:n])
+        return ubinascii.hexlify(md5.digest()).decode("ascii")
+
+    def __read_exact(self, fp, size):
+        data = fp.read(size)
+        if len(data) != size:
+            raise OSError("Delta patch truncated")
+        return data
+
+    def __patch(self, src_path, patch_path, dst_path, writer, buf):
+        """Rebuild dst_path from the installed file and a C(opy)/A(dd) patch, returns (size, md5)."""
+        md5 = uhashlib.md5()
+        mv = memoryview(buf)
+        size = 0
+        with open(src_path, "rb") as src, open(patch_path, "rb") as patch:
+            if self.__read_exact(patch, 4) != b"QDP1":
+                raise OSError("Bad delta patch %s" % patch_path)
+            target_size = int.from_bytes(self.__read_exact(patch, 4), "little")
+            writer.open(dst_path, "wb")
+            while True:
+                op = patch.read(1)
+                if not op:
+                    break
+                if op == b"C":
+                    src.seek(int.from_bytes(self.__read_exact(patch, 4), "little"))
+                    fp = src
+                elif op == b"A":
+                    fp = patch
+                else:
+                    raise OSError("Bad delta op %s" % op)
+                length = int.from_bytes(self.__read_exact(patch, 4), "little")
+                while length > 0:
+                    n = fp.readinto(mv[:min(length, len(buf))])
+                    if not n:
+                        raise OSError("Delta source truncated")
+                    md5.update(mv[:n])
+                    writer.write(mv[:n])
+                    size += n
+                    length -= n
+            writer.close()
+        if size != target_size:
+            raise OSError("Delta size mismatch %s != %s" % (size, target_size))
+        return size, ubinascii.hexlify(md5.digest()).decode("ascii")
+
+    def __apply_delta(self, staged, writer):
+        """Build the delta package targets into staged, returns False on any mismatch."""
+        with open(self.__updater_dir + self.__delta_manifest, "r") as f:
+            manifest = ujson.load(f)
+        if self.__version and manifest.get("base") != self.__version:
+            log.error("Delta base %s does not match installed %s" % (manifest.get("base"), self.__version))
+            return False
+
+        buf = bytearray(0x800)
+        for item in manifest["files"]:
+            name = item["name"]
+            target = self.__updater_dir + name
+            if item["op"] == "patch":
+                source = "/usr/" + name
+                if not ql_fs.path_exists(source) or self.__md5sum(source, buf) != item["src_md5"]:
+                    log.error("Delta source %s does not match" % source)
+                    return False
+                if "/" in name:
+                    ql_fs.mkdirs(target[:target.rfind("/")])
+                staged.append({"file_name": "/usr/" + name, "size": item["size"]})
+                size, md5 = self.__patch(source, self.__updater_dir + self.__delta_dir + name, target, writer, buf)
+            else:
+                size, md5 = item["size"], self.__md5sum(target, buf)
+                staged.append({"file_name": "/usr/" + name, "size": size})
+            if size != item["size"] or md5 != item["md5"]:
+                log.error("Delta target %s MD5 %s != %s" % (name, md5, item["md5"]))
+                return False
+        return True
+
+    def __remove_tree(self, path):
+        """Remove path and everything below it, deepest entries first."""
+        try:
+            entries = list(uos.ilistdir(path))
+        except Exception:
+            return
+        for entry in entries:
+            name = path + "/" + entry[0]
+            if entry[1] == 0x4000:
+                self.__remove_tree(name)
+            else:
+                try:
+                    uos.remove(name)
+                except Exception:
+                    pass
+        try:
+            uos.rmdir(path)
+        except Exception:
+            pass
+
+    def __remove_delta_dir(self):
+        self.__remove_tree(self.__updater_dir + self.__delta_dir[:-1])
+
+    def __is_delta(self, file_list):
+        for file_name in file_list:
+            if file_name["file_name"] == "/usr/" + self.__delta_manifest:
+                return True
+        return False
+
+    def __log_stats(self, start):
+        stats = self.__stats
+        total = utime.ticks_diff(utime.ticks_ms(), start)
+        log.info("OTA stats: %s B downloaded, %s B inflated in %s ms (%s B/s), chunk %s-%s B" % (
+            stats["downloaded"], stats["inflated"], total, stats["downloaded"] * 1000 // max(total, 1),
+            stats["chunk_min"], stats["chunk_max"]))
+        log.info("OTA time: read %s ms, hash %s ms, inflate %s ms, write %s ms, journal %s ms" % (
+            stats["read"] // 1000, stats["hash"] // 1000, stats["inflate"] // 1000, stats["write"] // 1000, stats["journal"] // 1000))
 
     def __upgrade(self):
-        with open(self.__ota_file, "rb+") as ota_file:
-            ota_file.seek(10)
-            unzipFp = uzlib.DecompIO(ota_file, -15, 1)
-            log.debug("[OTA Upgrade] Unzip file success.")
+        self.__stats = {"read": 0, "hash": 0, "inflate": 0, "write": 0, "journal": 0, "downloaded": 0, "inflated": 0,
+                        "chunk_min": 4096, "chunk_max": 4096}
+        start = utime.ticks_ms()
+        journal = _OTAJournal(self.__file_size, self.__file_md5, self.__stats) if self.__resume else None
+        stream = _OTAStream(self.__file_size, self.__next_piece, self.__stats, journal)
+        writer = _BufferedWriter(self.__stats, "write")
+        file_list = []
+        try:
+            # Skip the fixed 10 byte gzip header, the rest is a raw deflate stream.
+            stream.skip(10)
+            unzip_fp = uzlib.DecompIO(stream, -15, 1)
             ql_fs.mkdirs(self.__updater_dir)
-            file_list = []
-            try:
-                while True:
-                    data = unzipFp.read(0x200)
-                    if not data:
-                        log.debug("[OTA Upgrade] Read file size zore.")
-                        break
+            file_list = self.__untar(unzip_fp, writer)
+            stream.drain()
+            self.__log_stats(start)
+            log.debug("File Download Success, Update Start.")
+            quecIot.otaAction(3)
+            if not self.__check_md5(stream.md5):
+                self.__clean_updater(file_list)
+                if journal:
+                    journal.remove()
+                return _ota_result.failed
+
+            if self.__is_delta(file_list):
+                if journal:
+                    journal.remove()
+                package_list = file_list
+                file_list = []
+                try:
+                    applied = self.__apply_delta(file_list, writer)
+                except Exception as e:
+                    usys.print_exception(e)
+                    applied = False
+                if not applied:
+                    writer.close()
+                    self.__clean_updater(package_list + file_list)
+                    self.__remove_delta_dir()
+                    return _ota_result.delta_failed
+                # Only the rebuilt targets are staged, the manifest and patches are dropped.
+                self.__clean_updater([i for i in package_list if i not in file_list])
+                self.__remove_delta_dir()
+
+            for file_name in file_list:
+                app_fota_download.update_download_stat("/usr/.updater" + file_name["file_name"], file_name["file_name"], file_name["size"])
+            app_fota_download.set_update_flag()
+            if journal:
+                journal.remove()
+        except Exception as e:
+            # Interrupted download: keep the journal, the next attempt resumes from it.
+            usys.print_exception(e)
+            writer.close()
+            self.__log_stats(start)
+            self.__clean_updater(file_list)
+            if journal:
+                journal.close()
+            return _ota_result.failed
+
+        return _ota_result.success
 
-                    size = self.__get_file_size(data[124:135])
-                    file_name = self.__get_file_name(data[:100])
-                    log.debug("[OTA Upgrade] File Name: %s, File Size: %s" % (file_name, size))
-
-                    if not size:
-                        if len(file_name):
-                            log.debug("[OTA Upgrade] Create file: %s" % self.__updater_dir + file_name)
-                            ql_fs.mkdirs(self.__updater_dir + file_name)
-                        else:
-                            log.debug("[OTA Upgrade] Have no file unzip.")
-                            break
-                    else:
-                        log.debug("File %s write size %s" % (self.__updater_dir + file_name, size))
-                        with open(self.__updater_dir + file_name, "wb+") as fp:
-                            read_size = 0x200
-                            last_size = size
-                            while last_size > 0:
-                                data = unzipFp.read(read_size)
-                                write_size = read_size if read_size <= last_size else last_size
-                                fp.write(data[:write_size])
-                                last_size -= write_size
-                            file_list.append({"file_name": "/usr/" + file_name, "size": size})
-
-                for file_name in file_list:
-                    app_fota_download.update_download_stat("/usr/.updater" + file_name["file_name"], file_name["file_name"], file_name["size"])
-
-                log.debug("Remove %s" % self.__ota_file)
-                uos.remove(self.__ota_file)
-
-                app_fota_download.set_update_flag()
+    def __ota_thread(self):
+        self.__pieces = 0
+        res = self.__upgrade()
+        self.__running = False
+        if self.__callback:
+            try:
+                self.__callback(res)
             except Exception as e:
                 usys.print_exception(e)
-                return False
+        if res == _ota_result.success:
+            log.debug("File Update Success, Power Restart.")
+            Power.powerRestart()
+        else:
+            log.debug("File Update Failed, result %s." % res)
 
-        return True
+    @property
+    def stats(self):
+        return self.__stats
+
+    def set_callback(self, callback):
+        """callback(result) with a QuecOTA.result value once a download finishes."""
+        if callable(callback):
+            self.__callback = callback
+            return True
+        return False
 
     def set_ota_info(self, size, md5):
         self.__file_size = size
         self.__file_md5 = md5
 
     def start_ota(self, start_addr, piece_size):
-        ota_download_res = self.__download(start_addr, piece_size)
-        if ota_download_res == 3:
-            if self.__check_md5():
-                if self.__upgrade():
-                    log.debug("File Update Success, Power Restart.")
-                else:
-                    log.debug("File Update Failed, Power Restart.")
+        """Hand a downloaded piece to the OTA worker, returns immediately.
 
-        Power.powerRestart()
+        The first piece starts the worker thread, later pieces are the
+        answers to the otaAction(2) requests it sends.
+        """
+        if self.__piece_queue.size() < 2:
+            self.__piece_queue.put((start_addr, piece_size))
+        if not self.__running:
+            self.__running = True
+            _thread.start_new_thread(self.__ota_thread, ())
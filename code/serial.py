@@ -33,12 +33,16 @@ class Serial(object):
         self._queue = Queue(maxsize = 1)
         self._timer = Timer(Timer.Timer1)
         self._log = Logger(__name__)
+        self._callback = None
 
         self._uart.set_callback(self._uart_cb)
         self.log_enable(False)
 
     def _uart_cb(self, args):
         self._log.debug("_uart_cb called with args:", args)
+        if self._callback:
+            self._callback(args)
+            return
         if self._queue.size() == 0:
             self._log.debug("_uart_cb send a signal")
             self._queue.put(None)
@@ -49,6 +53,10 @@ class Serial(object):
             self._log.debug("_timer_cb send a signal")
             self._queue.put(None)
 
+    def set_callback(self, callback):
+        """Call callback(args) on received data instead of waking a blocking read(), None restores it."""
+        self._callback = callback
+
     def log_enable(self, en):
         if not isinstance(en, bool):
             return False
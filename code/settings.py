@@ -27,6 +27,7 @@
 import uos
 import ure
 import ql_fs
+import usys
 import ujson
 import modem
 import _thread
@@ -36,6 +37,8 @@ from usr.modules import option_lock
 
 PROJECT_NAME = "QuecPython-Tracker"
 
+PROJECT_DELTA_NAME = PROJECT_NAME + "-delta"
+
 PROJECT_VERSION = "2.1.0"
 
 DEVICE_FIRMWARE_NAME = uos.uname()[0].split("=")[1]
@@ -89,6 +92,61 @@ class LocConfig:
     }
 
     loc_method = _loc_method.gps
+
+    # Seconds a background GPS fix stays usable for reports.
+    fix_max_age = 120
+
+    # GNSSDutyCycle parameters, enable False keeps the receiver on.
+    duty_cfg = {
+        "enable": True,
+        "move_speed": 3.0,
+        "move_distance": 30,
+        "still_time": 120,
+        "backup_after": 1800,
+        "current_threshold": 1.0,
+        "report_lead": 10,
+        "backup_lead": 30,
+        "fix_timeout": 60,
+        "still_refresh": 900,
+    }
+
+    # TrackBuffer parameters, uploaded as the track property after each report.
+    track_cfg = {
+        "enable": True,
+        "capacity": 512,
+        "interval": 5,
+        "tolerance": 10,
+        "size": 64,
+    }
+
+    # Geofence parameters, fences come from /usr/geofence.txt or the geofence property.
+    geofence_cfg = {
+        "enable": True,
+        "cell": 0.01,
+        "margin": 10,
+        "confirm": 2,
+        "coord": "wgs84",
+    }
+
+    # CellLocation parameters, used with the cell bit of loc_method.
+    cell_cfg = {
+        "serverAddr": "www.queclocator.com",
+        "port": 80,
+        "token": "xxxxxxxxxxxxxxxx",
+        "timeout": 8,
+        "profileIdx": 1,
+        "cache_size": 16,
+        "cache_ttl": 86400,
+    }
+
+    # WifiLocation parameters, used with the wifi bit of loc_method.
+    wifi_cfg = {
+        "token": "xxxxxxxxxxxxxxxx",
+        "max_aps": 8,
+        "similarity": 0.6,
+        "cache_size": 16,
+        "cache_ttl": 86400,
+    }
     
 
 
@@ -112,10 +170,29 @@ class UserConfig:
 
     sota = True
 
+    sota_delta = True
+
+    sota_delta_failed = ""
+
     bms_protocol = _bms_protocol.rs485
 
     reportTimes = 60
 
+    # Periods (s) of the scheduled cell voltage, device info and OTA search reports, 0 disables.
+    cellVoltTimes = 300
+
+    deviceInfoTimes = 86400
+
+    otaSearchTimes = 3600
+
+    # BMS frames a fault has to be seen to raise its alarm and missed to clear it,
+    # overrides per alarm event as [debounce, clear]; over current level 2 raises at once.
+    alarm_cfg = {
+        "debounce": 2,
+        "clear": 3,
+        "overrides": {"doc2p": [1, 3]},
+    }
+
     rs485_config = {
         "UARTn": UART.UART2,
         "buadrate": 9600,
@@ -127,60 +204,164 @@ class UserConfig:
     }
 
 
+class SettingsSnapshot:
+    """Read-only view of one settings version, keys as attributes: snapshot.user_cfg.reportTimes.
+
+    The dicts behind it are never changed once published, so a snapshot
+    stays consistent however the settings are set meanwhile.
+    """
+
+    def __init__(self, data, version):
+        self.__data = data
+        self.__version = version
+
+    def __wrap(self, value):
+        return SettingsSnapshot(value, self.__version) if isinstance(value, dict) else value
+
+    def __getattr__(self, name):
+        try:
+            return self.__wrap(self.__data[name])
+        except KeyError:
+            raise AttributeError(name)
+
+    def __getitem__(self, key):
+        return self.__wrap(self.__data[key])
+
+    def __contains__(self, key):
+        return key in self.__data
+
+    def get(self, key, default=None):
+        return self.__wrap(self.__data[key]) if key in self.__data else default
+
+    def keys(self):
+        return self.__data.keys()
+
+    def as_dict(self):
+        """The dict behind the view, shared: do not change it."""
+        return self.__data
+
+    @property
+    def version(self):
+        return self.__version
+
+
 class Settings:
+    """Settings published copy-on-write.
+
+    set() copies the section it changes, so the dicts get() and snapshot()
+    hand out never change afterwards and reading takes no lock. Every
+    change bumps the version and calls the subscribers with the new
+    snapshot and the changed [(mode, key), ...].
+    """
 
     def __init__(self, settings_file="/usr/bms_box_settings.json"):
         self.settings_file = settings_file
         self.current_settings = {}
+        self.__version = 0
+        self.__snapshot = SettingsSnapshot({}, 0)
+        self.__subscribers = []
         self.init()
 
-    def __init_config(self):
-        try:
-            # CloudConfig config
-            self.current_settings["quec_cloud_cfg"] = {k: v for k, v in QuecCloudConfig.__dict__.items() if not k.startswith("_")}
+    def __default_config(self):
+        settings = {}
+        # CloudConfig config
+        settings["quec_cloud_cfg"] = {k: v for k, v in QuecCloudConfig.__dict__.items() if not k.startswith("_")}
+
+        # LocConfig config
+        settings["loc_cfg"] = {k: v for k, v in LocConfig.__dict__.items() if not k.startswith("_")}
 
-            # LocConfig config
-            self.current_settings["loc_cfg"] = {k: v for k, v in LocConfig.__dict__.items() if not k.startswith("_")}
+        # UserConfig config
+        settings["user_cfg"] = {k: v for k, v in UserConfig.__dict__.items() if not k.startswith("_")}
+        return settings
 
-            # UserConfig config
-            self.current_settings["user_cfg"] = {k: v for k, v in UserConfig.__dict__.items() if not k.startswith("_")}
+    def __init_config(self):
+        try:
+            self.current_settings = self.__default_config()
             return True
         except:
             return False
 
+    def __merge_config(self, saved, defaults):
+        """saved plus the keys it lacks from defaults, nested dicts too; returns (merged, changed)."""
+        merged = dict(saved)
+        changed = False
+        for k, v in defaults.items():
+            if k not in merged:
+                merged[k] = v
+                changed = True
+            elif isinstance(v, dict) and isinstance(merged[k], dict):
+                merged[k], _changed = self.__merge_config(merged[k], v)
+                changed = changed or _changed
+        return merged, changed
+
     def __read_config(self):
         if ql_fs.path_exists(self.settings_file):
             with open(self.settings_file, "r") as f:
-                self.current_settings = ujson.load(f)
-                return True
+                saved = ujson.load(f)
+            # A file saved by an older release lacks the keys added since, take their defaults.
+            self.current_settings, changed = self.__merge_config(saved, self.__default_config())
+            if changed:
+                self.__save_config()
+            return True
         return False
 
+    def __write(self, mode, opt, val):
+        if opt in self.current_settings[mode] and self.current_settings[mode][opt] == val:
+            return True
+        section = dict(self.current_settings[mode])
+        section[opt] = val
+        settings = dict(self.current_settings)
+        settings[mode] = section
+        self.current_settings = settings
+        return True
+
+    def __publish(self):
+        if self.__snapshot.as_dict() is not self.current_settings:
+            self.__version += 1
+            self.__snapshot = SettingsSnapshot(self.current_settings, self.__version)
+        return self.__snapshot
+
+    def __notify(self, snapshot, changed):
+        for callback in self.__subscribers:
+            try:
+                callback(snapshot, changed)
+            except Exception as e:
+                usys.print_exception(e)
+
     def __set_config(self, mode, opt, val):
         if mode == "user_cfg":
-            if opt == "reportTimes":
-                if not isinstance(val, int):
+            if opt in ("reportTimes", "cellVoltTimes", "deviceInfoTimes", "otaSearchTimes"):
+                if not isinstance(val, int) or val < 0:
+                    return False
+                return self.__write(mode, opt, val)
+            elif opt == "sota_delta":
+                if not isinstance(val, bool):
                     return False
-                self.current_settings[mode][opt] = val
-                return True
+                return self.__write(mode, opt, val)
+            elif opt == "sota_delta_failed":
+                if not isinstance(val, str):
+                    return False
+                return self.__write(mode, opt, val)
         elif mode == "loc_cfg":
             if opt == "loc_method":
                 if not isinstance(val, int):
                     return False
                 if val > LocConfig._loc_method.all:
                     return False
-                self.current_settings[mode][opt] = val
-                return True
+                return self.__write(mode, opt, val)
+            elif opt == "fix_max_age":
+                if not isinstance(val, int) or val < 0:
+                    return False
+                return self.__write(mode, opt, val)
         elif mode == "quec_cloud_cfg":
             if opt == "life_time":
                 if not isinstance(val, int):
                     return False
-                self.current_settings[mode][opt] = val
-                return True
+                return self.__write(mode, opt, val)
             elif opt in ("pk", "ps", "dk", "ds", "server"):
                 if not isinstance(val, str):
                     return False
-                self.current_settings[mode][opt] = val
-                return True
+                return self.__write(mode, opt, val)
         return False
 
     def __save_config(self):
@@ -199,30 +380,65 @@ class Settings:
             return False
 
     def __get_config(self):
-        return self.current_settings
+        return self.__snapshot.as_dict()
 
     @option_lock(_settings_lock)
     def init(self):
+        res = False
         if self.__read_config() is False:
             if self.__init_config():
-                return self.__save_config()
-        return False
+                res = self.__save_config()
+        self.__publish()
+        return res
 
-    @option_lock(_settings_lock)
     def get(self):
+        """Current settings as a dict, lock-free; it never changes, set() publishes a new one."""
         return self.__get_config()
 
+    def snapshot(self):
+        """Current settings as a SettingsSnapshot, lock-free."""
+        return self.__snapshot
+
+    @property
+    def version(self):
+        return self.__snapshot.version
+
+    def subscribe(self, callback):
+        """callback(snapshot, changed) after every change, on the thread that made it."""
+        if callable(callback):
+            self.__subscribers.append(callback)
+            return True
+        return False
+
     @option_lock(_settings_lock)
+    def __set(self, mode, opt, val):
+        version = self.__snapshot.version
+        if not self.__set_config(mode, opt, val):
+            return False, None
+        snapshot = self.__publish()
+        return True, snapshot if snapshot.version != version else None
+
     def set(self, mode, opt, val):
-        return self.__set_config(mode, opt, val)
+        res, snapshot = self.__set(mode, opt, val)
+        if snapshot is not None:
+            self.__notify(snapshot, [(mode, opt)])
+        return res
 
     @option_lock(_settings_lock)
     def save(self):
         return self.__save_config()
 
     @option_lock(_settings_lock)
-    def reset(self):
+    def __reset(self):
         if self.__remove_config():
             if self.__init_config():
+                self.__publish()
                 return self.__save_config()
         return False
+
+    def reset(self):
+        version = self.version
+        res = self.__reset()
+        if self.version != version:
+            self.__notify(self.__snapshot, [])
+        return res
@@ -27,7 +27,7 @@
 import sif
 import usys
 import utime
-import _thread
+import osTimer
 import ubinascii
 from usr.logging import Logger
 from usr.serial import Serial
@@ -75,10 +75,26 @@ class XinghengRs485Protocol():
         self.__read_data = b''
         self.__queue = Queue(maxsize = 1)
         self.__data_fresh_timestamp = utime.time()
+        self.__callback = None
+        self.__request_cmds = (
+            self.__get_temp_cmd,
+            self.__get_bat_volt_cmd,
+            self.__get_current_cmd,
+            self.__get_soc_cmd,
+            self.__get_bat_cycle_cmd,
+            self.__get_cell_volt_cmd1,
+            self.__get_cell_volt_cmd2,
+            self.__get_soh_cmd,
+            self.__get_version_cmd,
+            self.__get_bat_id_cmd,
+        )
+        self.__request_index = 0
+        self.__request_timer = osTimer()
         self.__uart_init()
-        _thread.start_new_thread(self.__read_rs485_data, ())
+        # Frames are parsed in the UART callback and requests sent from a timer, no threads of our own.
+        self.__uart_obj.set_callback(self.__read_rs485_data)
         if en_req:
-           _thread.start_new_thread(self.__request_bat_info, ())
+            self.__request_timer.start(500, 1, self.__request_bat_info)
         
     def __uart_init(self):
         self.__uart_obj = Serial(
@@ -139,7 +155,7 @@ class XinghengRs485Protocol():
                 elif parse_data[2] == self.__get_current_cmd:
                     if parse_data[3] >= 4:
                         self.__bat_current = ((parse_data[7]<<24)+(parse_data[6]<<16)+(parse_data[5]<<8)+parse_data[4]) / 1000
-                        print("__bat_current", self.__ba__bat_currentt_volt)
+                        print("__bat_current", self.__bat_current)
                 elif parse_data[2] == self.__get_soc_cmd:
                     self.__soc = parse_data[5]
                     print("__soc", self.__soc)
@@ -183,60 +199,48 @@ class XinghengRs485Protocol():
                         self.__bat_id = parse_data[4:5+data_len].decode()
                         print("__bat_id", self.__bat_id)
                 self.__read_data = self.__read_data[frame_byte_len:]
+                if self.__callback:
+                    self.__callback()
             else:
                 self.__read_data = b''
                 break
 
-    def __read_rs485_data(self):
-        while True:
-            data = self.__uart_obj.read(1024, -1).encode()
-            log.debug("UART data: ", ubinascii.hexlify(data, ' '))
-            #print("uart data len:", len(read_data))
-            self.__read_data += data
-            try:
-                if len(self.__read_data) > 0:
-                    self.__parse()
-            except Exception as e:
-                log.error("Read RS485 data error:", e)
-                usys.print_exception(e)
-                return False
-        
-    def __request_bat_info(self):
-        while True:
-            self.__send_rs485_cmd(self.__get_temp_cmd)
-            utime.sleep(0.5)
-
-            self.__send_rs485_cmd(self.__get_bat_volt_cmd)
-            utime.sleep(0.5)
-
-            self.__send_rs485_cmd(self.__get_current_cmd)
-            utime.sleep(0.5)
-
-            self.__send_rs485_cmd(self.__get_soc_cmd)
-            utime.sleep(0.5)
+    def __read_rs485_data(self, args):
+        data = self.__uart_obj.read(1024).encode()
+        log.debug("UART data: ", ubinascii.hexlify(data, ' '))
+        self.__read_data += data
+        try:
+            if len(self.__read_data) > 0:
+                self.__parse()
+        except Exception as e:
+            log.error("Read RS485 data error:", e)
+            usys.print_exception(e)
+            self.__read_data = b''
 
-            self.__send_rs485_cmd(self.__get_bat_cycle_cmd)
-            utime.sleep(0.5)
+    def __request_bat_info(self, args):
+        # One command every 500 ms, round robin.
+        self.__send_rs485_cmd(self.__request_cmds[self.__request_index])
+        self.__request_index = (self.__request_index + 1) % len(self.__request_cmds)
 
-            self.__send_rs485_cmd(self.__get_cell_volt_cmd1)
-            utime.sleep(0.5)
-
-            self.__send_rs485_cmd(self.__get_cell_volt_cmd2)
-            utime.sleep(0.5)
-
-            self.__send_rs485_cmd(self.__get_soh_cmd)
-            utime.sleep(0.5)
-
-            self.__send_rs485_cmd(self.__get_version_cmd)
-            utime.sleep(0.5)
+    def set_callback(self, callback):
+        """callback() after every valid frame, from the UART callback context."""
+        if callable(callback):
+            self.__callback = callback
+            return True
+        return False
 
-            self.__send_rs485_cmd(self.__get_bat_id_cmd)
-            utime.sleep(0.5)
+    def set_alarm(self, alarm):
+        """None of the requested registers carries a fault code, there is nothing to feed an AlarmEngine."""
+        return False
 
     def received_data(self):
         if self.__queue.get():
             return True
 
+    def get_cell_volt(self):
+        """Voltages (mV) of the cells the BMS reported, empty before the first cell frame."""
+        return self.__cell_volt[:int(self.__battery_serial_num)]
+
     def get_data_fresh_timestamp(self):
         return self.__data_fresh_timestamp
 
@@ -246,7 +250,10 @@ class XinghengRs485Protocol():
         else:
             return True
 
-    def get_alarm_data(self):
+    def get_faults(self):
+        return []
+
+    def get_alarm_data(self, faults=None):
         _data = {}
         return _data
 
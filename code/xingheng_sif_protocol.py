@@ -33,6 +33,21 @@ from queue import Queue
 
 log = Logger(__name__)
 
+# Battery fault code of the public/private frames -> object model alarm event.
+FAULT_EVENTS = {
+    0x01: "doc2p",
+    0x02: "doc1p",
+    0x03: "cutp",
+    0x04: "cotp",
+    0x05: "dotp",
+    0x06: "uvp",
+    0x07: "ovp",
+    0x08: "cocp",
+    0x09: "dutp",
+    0x0A: "cmosp",
+    0x0B: "dmosp",
+}
+
 class XinghengSifProtocol():
     """This class is the protocol of xingheng SIF"""
     def __init__(self, gpio):
@@ -79,6 +94,8 @@ class XinghengSifProtocol():
         self.__cell_volt = []
         self.__queue = Queue(maxsize = 1)
         self.__data_fresh_timestamp = utime.time()
+        self.__callback = None
+        self.__alarm = None
         self.__protocol_provider = 1
         self.__device_type = 101 # 101:LTE电池云盒，102：BLE电池云盒
         sif.init(gpio, self.__recv_sif_data_callback)
@@ -88,9 +105,15 @@ class XinghengSifProtocol():
             self.__queue.put(True)
         log.debug("SIF data: ", ubinascii.hexlify(data, ' '))
         self.__data_fresh_timestamp = utime.time()
-        self.__parse_sif_data(data)
+        if self.__parse_sif_data(data) and self.__alarm:
+            # Faults go to the alarm engine straight from the decode, ahead of the frame event.
+            self.__alarm.update(self.get_faults())
+        if self.__callback:
+            self.__callback()
         
     def __parse_sif_data(self, data):
+        """Decode one frame, True if it carried the battery fault code."""
+        fault_frame = False
         if data != b'':
             try:
                 if len(data) == 20 and data[0] == 1: # public message
@@ -110,6 +133,7 @@ class XinghengSifProtocol():
                         self.__mos_temperatiure = data[16] - 40
                         self.__battery_fault = data[17]
                         self.__battery_work_state = data[18]
+                        fault_frame = True
                 elif len(data) == (data[2]+4) and data[0] == 0x3A:
                     check_sum = sum(data[:-1])
                     if check_sum & 0xff == data[-1]:
@@ -122,6 +146,7 @@ class XinghengSifProtocol():
                         self.__mos_temperatiure = data[10] - 40
                         self.__battery_fault = data[11]
                         self.__battery_work_state = data[12]
+                        fault_frame = True
                         self.__allow_charg = True if data[13] & 0x01 else False
                         self.__illegal_charger_alarm = True if data[13] & 0x02 else False
                         self.__charger_link_sta = True if data[13] & 0x04 else False
@@ -162,6 +187,7 @@ class XinghengSifProtocol():
                         self.__bar = data[3:data_len+3].decode()
             except Exception as e:
                 log.error("SIF receive data fault:", e)
+        return fault_frame
 
     def __init_battery_base_data(self):
         _data = {}
@@ -198,10 +224,25 @@ class XinghengSifProtocol():
         })
         return _data
 
+    def set_callback(self, callback):
+        """callback() after every SIF frame, from the driver callback context."""
+        if callable(callback):
+            self.__callback = callback
+            return True
+        return False
+
+    def set_alarm(self, alarm):
+        """AlarmEngine fed with get_faults() of every frame carrying the fault code."""
+        self.__alarm = alarm
+
     def received_data(self):
         if self.__queue.get():
             return True
 
+    def get_cell_volt(self):
+        """Voltages (mV) of the cells the BMS reported, empty before the first cell frame."""
+        return self.__cell_volt[:int(self.__battery_serial_num)]
+
     def get_data_fresh_timestamp(self):
         return self.__data_fresh_timestamp
 
@@ -211,31 +252,20 @@ class XinghengSifProtocol():
         else:
             return True
 
-    def get_alarm_data(self):
-        _data = {}
-        if self.__battery_fault == 0x01:
-            _data.update({"doc2p" : True})
-        elif self.__battery_fault == 0x02:
-            _data.update({"doc1p" : True})
-        elif self.__battery_fault == 0x03:
-            _data.update({"cutp" : True})
-        elif self.__battery_fault == 0x04:
-            _data.update({"cutp" : True})
-        elif self.__battery_fault == 0x05:
-            _data.update({"dotp" : True})
-        elif self.__battery_fault == 0x06:
-            _data.update({"uvp" : True})
-        elif self.__battery_fault == 0x07:
-            _data.update({"ovp" : True})
-        elif self.__battery_fault == 0x08:
-            _data.update({"cocp" : True})
-        elif self.__battery_fault == 0x09:
-            _data.update({"dutp" : True})
-        elif self.__battery_fault == 0x0A:
-            _data.update({"cmosp" : True})
-        elif self.__battery_fault == 0x0B:
-            _data.update({"dmosp" : True})
-        _data.update(self.__init_battery_base_data())
+    def get_faults(self):
+        """Alarm events of the current fault code, empty without a (known) fault."""
+        event = FAULT_EVENTS.get(self.__battery_fault)
+        return [event] if event else []
+
+    def get_alarm_data(self, faults=None):
+        """The fault code and an event report {event: battery data} per fault, the current ones by default."""
+        if faults is None:
+            faults = self.get_faults()
+        _data = {"fault": self.__battery_fault}
+        if faults:
+            base_data = self.__init_battery_base_data()
+            for fault in faults:
+                _data[fault] = base_data
         return _data
 
     def get_report_data(self):
@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+@file      :bench_alarm.py
+@brief     :Frame to cloud alarm latency and reports of flapping faults.
+
+Runs BmsBox.running on the host with the AlarmEngine of UserConfig and
+injects SIF public frames at --frame-hz carrying fault codes:
+
+  * step  - over voltage (0x07) for 10 frames, clear for 10, three times
+  * flap  - over voltage toggling every frame for 20 frames, then clear
+  * noisy - over voltage present with 30% of the frames missing it
+  * burst - over current level 2 (0x01, raised on the first frame) once
+
+For each it prints the alarms raised and cleared, the flaps suppressed,
+the object model reports sent and the worst frame to cloud ack latency,
+against the former path: one full alarm report per change of the fault
+state, seen on the next 50 ms poll and acked in steps of the 1 s polling.
+
+Usage: python tools/bench_alarm.py [--frame-hz 5] [--ack-ms 50]
+"""
+
+import argparse
+import os
+import random
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import qpy_host  # noqa: E402
+from bench_report import sif_public_frame  # noqa: E402
+
+SCENARIOS = ("step", "flap", "noisy", "burst")
+
+
+def faults(scenario, seed=3):
+    rnd = random.Random(seed)
+    if scenario == "step":
+        return ([0x07] * 10 + [0] * 10) * 3
+    if scenario == "flap":
+        return [0x07 if i % 2 else 0 for i in range(20)] + [0] * 10
+    if scenario == "noisy":
+        return [0x07 if rnd.random() > 0.3 else 0 for i in range(30)] + [0] * 10
+    return [0x01] * 3 + [0] * 10
+
+
+def build(args):
+    qpy_host.install()
+    import quecIot
+    from usr.bms_box import BmsBox
+    from usr.location import GPS, NMEAParse
+    from usr.modules import NetManage, AlarmEngine
+    from usr.quecthing import QuecObjectModel, QuecOTA, QuecThing
+    from usr.settings import Settings
+    from usr.xingheng_sif_protocol import XinghengSifProtocol
+    qpy_host.quiet("critical")
+
+    quecIot.sim.reset(ack_latency=args.ack_ms / 1000.0)
+    settings = Settings()
+    settings.set("loc_cfg", "loc_method", 0)
+    # Keep the scheduled reports out of the counts.
+    for key in ("reportTimes", "cellVoltTimes", "deviceInfoTimes", "otaSearchTimes"):
+        settings.set("user_cfg", key, 0)
+    _settings = settings.get()
+
+    cloud = QuecThing(**_settings["quec_cloud_cfg"])
+    net_manage = NetManage()
+    bms_box = BmsBox()
+    for module in (settings, QuecObjectModel(), cloud, QuecOTA(), NMEAParse(),
+                   GPS(**_settings["loc_cfg"]["gps_cfg"]), XinghengSifProtocol(gpio=32),
+                   AlarmEngine(**_settings["user_cfg"]["alarm_cfg"]), net_manage):
+        bms_box.add_module(module)
+    net_manage.start()
+    cloud.set_callback(bms_box.execute)
+    cloud.connect()
+    return bms_box
+
+
+def run(bms_box, codes, frame_hz):
+    import quecIot
+    import sif
+    start_stats = bms_box.alarm_stats
+    start_reports = len(quecIot.sim.reported)
+    bms_box._BmsBox__alarm._AlarmEngine__stats["latency_max"] = 0
+    for code in codes:
+        sif.inject(sif_public_frame(fault=code))
+        time.sleep(1.0 / frame_hz)
+    time.sleep(0.5)
+    stats = bms_box.alarm_stats
+    reports = len([i for i in quecIot.sim.reported[start_reports:] if i[0] == "phymodel"])
+    delta = dict([(k, stats[k] - start_stats[k]) for k in ("raised", "cleared", "suppressed")])
+    changes = len([i for i in range(1, len(codes)) if bool(codes[i]) != bool(codes[i - 1])]) + (1 if codes[0] else 0)
+    return delta, reports, stats["latency_max"], changes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--frame-hz", type=float, default=5)
+    parser.add_argument("--ack-ms", type=float, default=50)
+    args = parser.parse_args()
+
+    bms_box = build(args)
+    threading.Thread(target=bms_box.running, daemon=True).start()
+    time.sleep(1)
+
+    poll_ms = 50 / 2.0 + 1000 * (int(args.ack_ms / 1000.0) + 1)
+    print("frames at %g Hz, ack after %g ms; former path ~%.0f ms per alarm" % (args.frame_hz, args.ack_ms, poll_ms))
+    print("  %-6s %7s %8s %11s %8s %12s %15s" % ("", "raised", "cleared", "suppressed", "reports", "latency ms",
+                                                "former reports"))
+    for scenario in SCENARIOS:
+        codes = faults(scenario)
+        delta, reports, latency, changes = run(bms_box, codes, args.frame_hz)
+        print("  %-6s %7d %8d %11d %8d %12d %15d" % (scenario, delta["raised"], delta["cleared"], delta["suppressed"],
+                                                     reports, latency, changes))
+
+
+if __name__ == "__main__":
+    main()
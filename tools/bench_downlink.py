@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+@file      :bench_downlink.py
+@brief     :Downlink callback time and coalescing of set and query bursts.
+
+Runs BmsBox.running on the host and
+
+  * times BmsBox.execute, the quecIot callback, for set, query and OTA
+    events (host microseconds, the SDK thread is blocked for this long)
+  * sends a burst of --burst property sets (reportTimes) and as many
+    queries through the quecIot stand-in, acks taking --ack-ms, and counts
+    the settings saves and query answers it costs, against one of each
+    per command when every command was handled on its own.
+
+Usage: python tools/bench_downlink.py [--calls 2000] [--burst 50] [--ack-ms 50]
+"""
+
+import argparse
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import qpy_host  # noqa: E402
+from bench_report import percentile  # noqa: E402
+from bench_alarm import build  # noqa: E402
+
+
+def time_execute(bms_box, args, calls):
+    samples = []
+    for i in range(calls):
+        start = time.perf_counter()
+        bms_box.execute(args)
+        samples.append((time.perf_counter() - start) * 1e6)
+        if i % 8 == 7:
+            # Let the loop drain so the queue never fills up.
+            time.sleep(0.001)
+    return percentile(samples, 50), percentile(samples, 99)
+
+
+def burst(bms_box, count):
+    import quecIot
+    settings = bms_box._BmsBox__settings
+    saves = []
+    save = settings.save
+    settings.save = lambda: saves.append(1) or save()
+    start_reports = len(quecIot.sim.reported)
+    start_stats = bms_box.downlink_stats
+    for i in range(count):
+        quecIot.sim.downlink(10210, {73: 60 + i})
+        quecIot.sim.downlink(10220, [2, 3, 73])
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline and bms_box._BmsBox__settings.get()["user_cfg"]["reportTimes"] != 59 + count:
+        time.sleep(0.01)
+    time.sleep(0.5)
+    settings.save = save
+    answers = len([i for i in quecIot.sim.reported[start_reports:] if i[0] == "phymodel"])
+    stats = bms_box.downlink_stats
+    return len(saves), answers, stats["coalesced"] - start_stats["coalesced"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calls", type=int, default=2000)
+    parser.add_argument("--burst", type=int, default=50)
+    parser.add_argument("--ack-ms", type=float, default=50)
+    args = parser.parse_args()
+
+    bms_box = build(args)
+    threading.Thread(target=bms_box.running, daemon=True).start()
+    time.sleep(1)
+
+    print("execute() per call, us:")
+    for name, event in (("set", (5, 10210, {73: 60})), ("query", (5, 10220, [2, 3])),
+                        ("ota", (7, 10704, b""))):
+        p50, p99 = time_execute(bms_box, event, args.calls)
+        print("  %-6s p50 %6.1f  p99 %6.1f" % (name, p50, p99))
+    time.sleep(1)
+
+    saves, answers, coalesced = burst(bms_box, args.burst)
+    print("burst of %d sets and %d queries: %d settings saves, %d query answers, %d commands coalesced"
+          " (%d saves and %d answers one by one)" % (args.burst, args.burst, saves, answers, coalesced,
+                                                    args.burst, args.burst))
+
+
+if __name__ == "__main__":
+    main()
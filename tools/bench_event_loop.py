@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+@file      :bench_event_loop.py
+@brief     :Main loop wakeups, power states and thread stacks of BmsBox.running.
+
+Runs BmsBox.running on the host with SIF frames injected at --frame-hz,
+then stops the frames so the box goes idle and to sleep, then resumes
+them. Prints the EventLoop wakeups per hour of each phase (per event)
+against the 72000/h of the former 50 ms polling loop, and the threads the
+RS485 protocol starts (the former reader and request threads were two
+stacks of --stack-kb each).
+
+For every phase it also prints the share of time in each power state,
+the share the wakelock was held and the average current that makes with
+the per state currents of --current (mA, active idle sleep wake; the
+wakelock decides between the state's current and the sleep current), and
+the wake latency from the first frame to the first report after waking.
+
+The report period and the idle and sleep timeouts are shortened with
+--report, --idle and --sleep so the phases fit in seconds.
+
+Usage: python tools/bench_event_loop.py [--active 20] [--quiet 20] [--frame-hz 2] [--report 5]
+                                        [--idle 5] [--sleep 5] [--current 30 15 2 60] [--stack-kb 8]
+"""
+
+import argparse
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import qpy_host  # noqa: E402
+from bench_report import sif_public_frame  # noqa: E402
+
+POLL_WAKEUPS_PER_HOUR = 3600 * 1000 // 50
+EVENT_NAMES = {1: "bms_frame", 2: "schedule", 3: "idle", 4: "cloud", 5: "net", 6: "geofence", 7: "cloud_state"}
+STATE_NAMES = ("active", "idle", "sleep", "wake")
+
+
+def build(args):
+    qpy_host.install()
+    import quecIot
+    from usr.bms_box import BmsBox
+    from usr.location import GPS, NMEAParse
+    from usr.modules import NetManage
+    from usr.quecthing import QuecObjectModel, QuecOTA, QuecThing
+    from usr.settings import Settings
+    from usr.xingheng_sif_protocol import XinghengSifProtocol
+    # Handler errors are logged by the loop, keep stdout for the results.
+    qpy_host.quiet("critical")
+
+    quecIot.sim.reset(ack_latency=0.02)
+    settings = Settings()
+    settings.set("loc_cfg", "loc_method", 0)
+    settings.set("user_cfg", "reportTimes", args.report)
+    _settings = settings.get()
+
+    cloud = QuecThing(**_settings["quec_cloud_cfg"])
+    net_manage = NetManage()
+    bms_box = BmsBox()
+    for module in (settings, QuecObjectModel(), cloud, QuecOTA(), NMEAParse(),
+                   GPS(**_settings["loc_cfg"]["gps_cfg"]), XinghengSifProtocol(gpio=32), net_manage):
+        bms_box.add_module(module)
+    bms_box._BmsBox__idle_timeout = args.idle
+    bms_box._BmsBox__sleep_timeout = args.sleep
+    net_manage.start()
+    cloud.set_callback(bms_box.execute)
+    cloud.connect()
+    return bms_box
+
+
+def rs485_threads():
+    """_thread.start_new_thread calls of the RS485 protocol, host timers are threads too so count those."""
+    import _thread
+    from machine import UART, Pin
+    from usr.xingheng_rs485_protocol import XinghengRs485Protocol
+    started = []
+    start_new_thread = _thread.start_new_thread
+    _thread.start_new_thread = lambda func, args: started.append(func) or start_new_thread(func, args)
+    try:
+        XinghengRs485Protocol(UART.UART2, 9600, 8, 0, 1, 0, Pin.GPIO30, en_req=True)
+    finally:
+        _thread.start_new_thread = start_new_thread
+    return len(started)
+
+
+def phase(bms_box, seconds, frame_hz):
+    import sif
+    start_stats = bms_box.loop_stats
+    start_power = bms_box.power_stats
+    start = time.monotonic()
+    soc = 100
+    while time.monotonic() - start < seconds:
+        if frame_hz:
+            sif.inject(sif_public_frame(soc_raw=soc))
+            soc = 100 + (soc + 1) % 100
+            time.sleep(1.0 / frame_hz)
+        else:
+            time.sleep(0.1)
+    elapsed = time.monotonic() - start
+    stats = bms_box.loop_stats
+    events = {}
+    for event, count in stats["events"].items():
+        delta = count - start_stats["events"].get(event, 0)
+        if delta:
+            events[EVENT_NAMES.get(event, event)] = delta * 3600.0 / elapsed
+    wakeups = (stats["wakeups"] - start_stats["wakeups"]) * 3600.0 / elapsed
+    merged = stats["merged"] - start_stats["merged"]
+    power = bms_box.power_stats
+    states = dict([(k, power["time"][k] - start_power["time"][k]) for k in power["time"]])
+    locked = power["locked"] - start_power["locked"]
+    woke = power["wakeups"] - start_power["wakeups"]
+    return wakeups, events, merged, (states, locked, power["wake_latency"] if woke else None)
+
+
+def current(states, locked, ma):
+    """Average mA: unlocked time draws the sleep current, locked time is spread over the states."""
+    total = float(sum(states.values())) or 1.0
+    awake = sum([ms * ma[k] for k, ms in states.items()]) / total
+    held = min(1.0, locked / total)
+    return held * awake + (1 - held) * ma[2]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--active", type=float, default=20, help="seconds with BMS frames")
+    parser.add_argument("--quiet", type=float, default=20, help="seconds without frames")
+    parser.add_argument("--frame-hz", type=float, default=2)
+    parser.add_argument("--report", type=int, default=5, help="reportTimes in seconds")
+    parser.add_argument("--idle", type=int, default=5, help="idle timeout in seconds")
+    parser.add_argument("--sleep", type=int, default=5, help="seconds idle before sleep")
+    parser.add_argument("--current", type=float, nargs=4, default=[30, 15, 2, 60],
+                        help="assumed mA in active idle sleep wake")
+    parser.add_argument("--stack-kb", type=float, default=8, help="device thread stack size")
+    args = parser.parse_args()
+
+    bms_box = build(args)
+    threading.Thread(target=bms_box.running, daemon=True).start()
+    time.sleep(0.5)
+
+    print("50 ms polling loop: %d wakeups/h in every phase" % POLL_WAKEUPS_PER_HOUR)
+    for name, seconds, hz in (("active", args.active, args.frame_hz), ("idle", args.quiet, 0),
+                              ("resumed", args.active, args.frame_hz)):
+        wakeups, events, merged, (states, locked, latency) = phase(bms_box, seconds, hz)
+        detail = ", ".join(["%s %.0f" % (k, v) for k, v in sorted(events.items())])
+        print("%-8s event loop: %7.0f wakeups/h (%.2f%% of polling)  [%s]  %d merged" % (
+            name, wakeups, 100.0 * wakeups / POLL_WAKEUPS_PER_HOUR, detail, merged))
+        total = float(sum(states.values())) or 1.0
+        shares = ", ".join(["%s %.0f%%" % (STATE_NAMES[k], 100.0 * ms / total) for k, ms in sorted(states.items()) if ms])
+        print("%-8s power: [%s]  wakelock %.1f%%  ~%.1f mA%s" % (
+            "", shares, 100.0 * locked / total, current(states, locked, args.current),
+            "  wake latency %d ms" % latency if latency is not None else ""))
+
+    threads = rs485_threads()
+    print("RS485 protocol threads: %d (was 2), about %.0f KB of stacks saved" % (threads, (2 - threads) * args.stack_kb))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+@file      :bench_geofence.py
+@brief     :Per-fix Geofence evaluation time as the fence count grows.
+
+Scatters N station circles and depot polygons over a 40 km square, drives
+a synthetic ride track through it and prints the mean time per fix, fence
+tests per fix and the events raised, for the grid index and for a single
+huge cell (every fence tested, i.e. a linear scan).
+
+Usage: python tools/bench_geofence.py [--fences 10 100 1000 5000] [--fixes 3000]
+"""
+
+import argparse
+import math
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import qpy_host  # noqa: E402
+from sim_gnss_duty import synthetic  # noqa: E402
+
+LON0, LAT0 = 121.4737, 31.2304
+
+
+def fence_text(n, rnd):
+    lines = []
+    for i in range(n):
+        lon = LON0 + rnd.uniform(-0.2, 0.2)
+        lat = LAT0 + rnd.uniform(-0.2, 0.2)
+        if i % 4:
+            lines.append("C,%d,%.6f,%.6f,%d" % (i, lon, lat, rnd.randint(30, 200)))
+        else:
+            size = rnd.uniform(0.001, 0.004)
+            corners = [(lon + size * math.cos(a), lat + size * math.sin(a)) for a in (0.3, 1.9, 3.5, 4.6)]
+            lines.append("P,%d,%s" % (i, ",".join("%.6f,%.6f" % c for c in corners)))
+    return "\n".join(lines)
+
+
+def run(Geofence, text, fixes, cell):
+    geofence = Geofence(file="/usr/bench_geofence.txt", cell=cell)
+    geofence.load_text(text)
+    start = time.perf_counter()
+    for fix in fixes:
+        geofence.check(fix)
+    elapsed = time.perf_counter() - start
+    stats = geofence.stats
+    return elapsed / len(fixes) * 1e6, stats["tests"] / stats["fixes"], stats["events"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--fences", type=int, nargs="+", default=[10, 100, 1000, 5000])
+    parser.add_argument("--fixes", type=int, default=3000)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    qpy_host.install()
+    from usr.geofence import Geofence
+    qpy_host.quiet()
+
+    rnd = random.Random(args.seed)
+    rows = [r for r in synthetic("delivery", args.seed) if r[3] > 0][:args.fixes]
+    fixes = [{"timestamp": int(t), "lat": lat, "lon": lon} for t, lat, lon, _, _ in rows]
+    print("%d fixes along a ride track" % len(fixes))
+    print("%7s | %12s %10s %7s | %12s %10s %7s" % ("fences", "grid us/fix", "tests/fix", "events",
+                                                    "scan us/fix", "tests/fix", "events"))
+    for n in args.fences:
+        text = fence_text(n, rnd)
+        grid = run(Geofence, text, fixes, 0.01)
+        scan = run(Geofence, text, fixes, 10.0)
+        print("%7d | %12.1f %10.1f %7d | %12.1f %10.1f %7d" % ((n,) + grid + scan))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,309 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+@file      :bench_nmea.py
+@brief     :NMEA replay through NMEAParse and GPS, the baseline for location rework.
+
+Every trace is replayed three ways:
+
+  * parse - decoded chunks straight into NMEAParse.feed()
+  * uart  - an external receiver: GPS on the machine.UART stand-in, the
+            bytes arrive in random 1..256 byte callbacks
+  * gnss  - the built-in receiver: GPS polling the quecgnss stand-in once
+            per second of trace time, 1024 bytes per read as on the device
+
+and prints sentences per second (host CPU), time to the first valid fix
+in trace seconds as judged by GPS.__check_gps_valid, the share of epochs
+(polls for gnss) with a valid fix, the peak partial sentence / receive
+buffer in bytes and the tracemalloc peak and retained bytes of the replay.
+
+Traces are synthetic receiver logs (L76 style epochs: RMC VTG GGA GSA GSV
+GLL) for the scenarios cold (35 s without a fix, then riding), urban
+(riding with outages and corrupted bytes), stationary and moving, or
+recorded logs passed with --log (one epoch per RMC). --save DIR writes
+the synthetic logs as .nmea files.
+
+Usage: python tools/bench_nmea.py [--scenario cold urban stationary moving] [--rate 1 10]
+                                  [--duration 600] [--log FILE.nmea ...] [--save DIR]
+"""
+
+import argparse
+import math
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import qpy_host  # noqa: E402
+
+LAT0, LON0 = 31.2304, 121.4737
+
+
+def _sentence(body):
+    checksum = 0
+    for c in body:
+        checksum ^= ord(c)
+    return "$%s*%02X\r\n" % (body, checksum)
+
+
+def _ddmm(value, digits):
+    value = abs(value)
+    degrees = int(value)
+    return "%0*d%07.4f" % (digits, degrees, (value - degrees) * 60)
+
+
+def epoch(t, fix, lat, lon, speed, course, sats):
+    """One receiver epoch at trace time t (s) as bytes."""
+    hms = "%02d%02d%06.3f" % (t // 3600 % 24, t // 60 % 60, t % 60)
+    knots = speed / 1.852
+    if fix:
+        pos = "%s,N,%s,E" % (_ddmm(lat, 2), _ddmm(lon, 3))
+        hdop = 0.6 + 6.0 / sats
+        used = ",".join(["%02d" % (i + 1) for i in range(min(sats, 12))] + [""] * (12 - min(sats, 12)))
+        lines = [
+            "GNRMC,%s,A,%s,%.3f,%.2f,181026,,,A" % (hms, pos, knots, course),
+            "GNVTG,%.2f,T,,M,%.3f,N,%.3f,K,A" % (course, knots, speed),
+            "GNGGA,%s,%s,1,%02d,%.2f,12.3,M,8.5,M,," % (hms, pos, sats, hdop),
+            "GNGSA,A,3,%s,%.2f,%.2f,%.2f" % (used, hdop * 1.6, hdop, hdop * 1.3),
+        ]
+    else:
+        lines = [
+            "GNRMC,%s,V,,,,,,,181026,,,N" % hms,
+            "GNVTG,,T,,M,,N,,K,N",
+            "GNGGA,%s,,,,,0,%02d,,,M,,M,," % (hms, sats),
+            "GNGSA,A,1,,,,,,,,,,,,,,,",
+        ]
+    seen = max(sats, 1)
+    count = (seen + 3) // 4
+    for n in range(count):
+        sv = ["%02d,%02d,%03d,%s" % (4 * n + k + 1, 15 + 7 * k, (40 * (4 * n + k)) % 360, "%02d" % (20 + k) if fix else "")
+              for k in range(min(4, seen - 4 * n))]
+        lines.append("GPGSV,%d,%d,%02d,%s" % (count, n + 1, seen, ",".join(sv)))
+    if fix:
+        lines.append("GNGLL,%s,%s,A,A" % (pos, hms))
+    else:
+        lines.append("GNGLL,,,,,%s,V,N" % hms)
+    return "".join([_sentence(i) for i in lines]).encode()
+
+
+def synthetic(scenario, rate=1, duration=600, seed=1):
+    """List of epochs (bytes) at `rate` Hz."""
+    rnd = random.Random(seed)
+    lat, lon, heading = LAT0, LON0, rnd.uniform(0, 2 * math.pi)
+    epochs = []
+    outage = 0
+    for i in range(int(duration * rate)):
+        t = i / float(rate)
+        moving = scenario in ("cold", "urban", "moving")
+        speed = max(0.0, rnd.gauss(20, 4)) if moving else 0.0
+        heading += rnd.gauss(0, 0.05) / rate
+        lat += speed / 3.6 / rate * math.cos(heading) / 110540.0
+        lon += speed / 3.6 / rate * math.sin(heading) / (111320.0 * math.cos(math.radians(lat)))
+        fix = True
+        sats = 14
+        if scenario == "cold" and t < 35:
+            fix = False
+            sats = int(t / 5)
+        elif scenario == "urban":
+            if outage <= 0 and rnd.random() < 0.015 / rate:
+                outage = rnd.uniform(3, 20)
+            if outage > 0:
+                outage -= 1.0 / rate
+                fix = False
+            sats = rnd.randint(3, 8) if fix else rnd.randint(0, 3)
+        elif scenario == "stationary":
+            lat = LAT0 + rnd.gauss(0, 2e-5)
+            lon = LON0 + rnd.gauss(0, 2e-5)
+        data = epoch(t, fix, lat, lon, speed, math.degrees(heading) % 360, sats)
+        if scenario == "urban":
+            data = bytearray(data)
+            for _ in range(len(data) // 1500 + (1 if rnd.random() < 0.1 else 0)):
+                data[rnd.randrange(len(data))] ^= 1 << rnd.randrange(7)
+            data = bytes(data)
+        epochs.append(data)
+    return epochs
+
+
+def load(path):
+    """Recorded log to (epochs, rate), a new epoch starts at every RMC."""
+    with open(path, "rb") as f:
+        data = f.read()
+    epochs, times = [], []
+    for line in data.splitlines(True):
+        if line[3:6] == b"RMC" or not epochs:
+            epochs.append(b"")
+            fields = line.split(b",")
+            try:
+                hms = fields[1]
+                times.append(int(hms[:2]) * 3600 + int(hms[2:4]) * 60 + float(hms[4:]))
+            except (IndexError, ValueError):
+                pass
+        epochs[-1] += line
+    steps = sorted([b - a for a, b in zip(times, times[1:]) if b > a])
+    rate = int(round(1.0 / steps[len(steps) // 2])) if steps else 1
+    return epochs, max(rate, 1)
+
+
+def _measure(run):
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    base = tracemalloc.get_traced_memory()[0]
+    start = time.perf_counter()
+    res = run()
+    res["cpu"] = time.perf_counter() - start
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    res["alloc_peak"] = peak - base
+    res["retained"] = current - base
+    return res
+
+
+def _new_gps(mode):
+    from usr.location import GPS
+    # gps_mode 1 internal / 2 external, nmea RMC+GGA+GSV as in LocConfig.
+    return GPS(1, 115200, 8, 0, 1, 0, mode, 0b000111, None, None, None)
+
+
+def replay_parse(epochs, rate):
+    from usr.location import NMEAParse
+    total = _count(epochs)
+
+    def run():
+        parse = NMEAParse()
+        rnd = random.Random(2)
+        res = {"ttff": None, "valid": 0, "checks": len(epochs), "sentences": total, "buffer": 0}
+        for i, data in enumerate(epochs):
+            pos = 0
+            while pos < len(data):
+                n = rnd.randint(1, 256)
+                parse.feed(data[pos:pos + n].decode("latin-1"))
+                res["buffer"] = max(res["buffer"], len(parse._NMEAParse__carry))
+                pos += n
+            rmc = parse.GxRMCData
+            if len(rmc) > 2 and rmc[2] == "A" and parse.GxGGA and parse.GxGSV:
+                res["valid"] += 1
+                if res["ttff"] is None:
+                    res["ttff"] = i / float(rate)
+        return res
+
+    return _measure(run)
+
+
+def replay_uart(epochs, rate):
+    gps = _new_gps(2)
+    gps.open()
+    uart = gps._GPS__external_obj
+    assembler = gps._GPS__assembler
+    total = _count(epochs)
+
+    def run():
+        rnd = random.Random(2)
+        res = {"ttff": None, "valid": 0, "checks": len(epochs), "sentences": total, "buffer": 0}
+        for i, data in enumerate(epochs):
+            pos = 0
+            while pos < len(data):
+                n = rnd.randint(1, 256)
+                uart.feed(data[pos:pos + n])
+                res["buffer"] = max(res["buffer"], assembler.pending)
+                pos += n
+            if gps._GPS__check_gps_valid():
+                gps._GPS__update_fix()
+                res["valid"] += 1
+                if res["ttff"] is None:
+                    res["ttff"] = i / float(rate)
+        return res
+
+    res = _measure(run)
+    res["passed"] = assembler.stats["sentences"]
+    res["rejected"] = assembler.stats["checksum"] + assembler.stats["dropped"]
+    gps.close()
+    return res
+
+
+def replay_gnss(epochs, rate):
+    import quecgnss
+    quecgnss.sim.reset()
+    quecgnss.sim.load(epochs, rate)
+    gps = _new_gps(1)
+    gps.open()
+
+    def run():
+        res = {"ttff": None, "valid": 0, "checks": 0, "sentences": 0}
+        while not quecgnss.sim.finished:
+            gnss_data = quecgnss.read(1024)
+            res["checks"] += 1
+            if gnss_data[0]:
+                res["sentences"] += gnss_data[1].count(b"$")
+                gps._GPS__feed_gps_data(gnss_data[1].decode("latin-1"))
+            if gps._GPS__check_gps_valid():
+                gps._GPS__update_fix()
+                res["valid"] += 1
+                if res["ttff"] is None:
+                    res["ttff"] = quecgnss.sim.clock
+            quecgnss.sim.advance(1)
+        return res
+
+    res = _measure(run)
+    res["buffer"] = quecgnss.sim.peak
+    res["lost"] = quecgnss.sim.dropped
+    gps.close()
+    return res
+
+
+def _count(epochs):
+    return sum([i.count(b"$") for i in epochs])
+
+
+def report(name, epochs, rate):
+    total = _count(epochs)
+    print("%s: %d epochs at %d Hz, %d sentences, %d bytes" % (name, len(epochs), rate, total, sum(map(len, epochs))))
+    print("  %-6s %12s %8s %7s %8s %11s %10s" % ("path", "sentences/s", "ttff s", "valid", "buffer", "alloc peak", "retained"))
+    for path, replay in (("parse", replay_parse), ("uart", replay_uart), ("gnss", replay_gnss)):
+        res = replay(epochs, rate)
+        ttff = "%.1f" % res["ttff"] if res["ttff"] is not None else "-"
+        extra = ""
+        if "rejected" in res:
+            extra = "  %d passed, %d rejected" % (res["passed"], res["rejected"])
+        if res.get("lost"):
+            extra = "  %d bytes lost to the 4 KB receive buffer" % res["lost"]
+        print("  %-6s %12.0f %8s %6.1f%% %8d %11d %10d%s" % (
+            path, res["sentences"] / res["cpu"], ttff, 100.0 * res["valid"] / res["checks"], res["buffer"],
+            res["alloc_peak"], res["retained"], extra))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenario", nargs="+", default=["cold", "urban", "stationary", "moving"],
+                        choices=["cold", "urban", "stationary", "moving"])
+    parser.add_argument("--rate", nargs="+", type=int, default=[1, 10])
+    parser.add_argument("--duration", type=int, default=600)
+    parser.add_argument("--log", nargs="*", default=[])
+    parser.add_argument("--save")
+    args = parser.parse_args()
+
+    qpy_host.install()
+    import usr.location  # noqa: F401
+    qpy_host.quiet()
+
+    if args.log:
+        for path in args.log:
+            epochs, rate = load(path)
+            report(os.path.basename(path), epochs, rate)
+        return
+    for rate in args.rate:
+        for scenario in args.scenario:
+            epochs = synthetic(scenario, rate, args.duration)
+            name = "%s-%dhz" % (scenario, rate)
+            if args.save:
+                os.makedirs(args.save, exist_ok=True)
+                with open(os.path.join(args.save, name + ".nmea"), "wb") as f:
+                    f.write(b"".join(epochs))
+            report(name, epochs, rate)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+@file      :bench_query.py
+@brief     :Cloud property query response latency and payload.
+
+Runs BmsBox.running on the host, injects SIF frames and sends property
+queries (quecIot event 5/10220) for a few id sets through the quecIot
+stand-in, with a fresh GPS fix. Prints the time from the query to the
+object model answer being sent and the ids and bytes answered, against
+the former handler: a full report built on the spot (location report
+and its ack first) whatever was asked for.
+
+Usage: python tools/bench_query.py [--queries 20] [--ack-ms 50]
+"""
+
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import qpy_host  # noqa: E402
+from bench_report import percentile, sif_public_frame  # noqa: E402
+from bench_alarm import build  # noqa: E402
+
+QUERIES = {
+    "soc": [2],
+    "soc vol current": [2, 3, 4],
+    "reportTimes": [73],
+    "temperatures": [5, 6, 7],
+}
+
+
+def wait_report(start_count, timeout=5):
+    import quecIot
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        for kind, data in quecIot.sim.reported[start_count:]:
+            if kind == "phymodel":
+                return data
+        time.sleep(0.001)
+    return None
+
+
+def query(ids):
+    import quecIot
+    count = len(quecIot.sim.reported)
+    start = time.monotonic()
+    quecIot.sim.downlink(10220, ids)
+    data = wait_report(count)
+    ms = (time.monotonic() - start) * 1000
+    time.sleep(0.2)
+    return ms, data
+
+
+def former_query(bms_box):
+    """The former handler: a full report built on the spot, the ids ignored."""
+    return lambda data: bms_box._BmsBox__data_report(bms_box._BmsBox__init_report_data())
+
+
+def set_fix(bms_box):
+    """A fresh GPS fix, so the full report sends it first like on the road."""
+    import utime
+    rmc = "$GNRMC,120000.000,A,3113.8240,N,12128.4220,E,10.0,90.0,181026,,,A*00"
+    gga = "$GNGGA,120000.000,3113.8240,N,12128.4220,E,1,12,0.80,12.3,M,8.5,M,,*00"
+    bms_box._BmsBox__gps._GPS__fix = {"timestamp": utime.time(), "ticks": utime.ticks_ms(), "lat": 31.2304,
+                                      "lon": 121.4737, "speed": 18.5, "quality": 1, "satellites": 12, "hdop": 0.8,
+                                      "nmea": [rmc, gga, ""], "source": "gps"}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--queries", type=int, default=20)
+    parser.add_argument("--ack-ms", type=float, default=50)
+    args = parser.parse_args()
+
+    bms_box = build(args)
+    import sif
+    bms_box._BmsBox__settings.set("loc_cfg", "loc_method", 1)
+    threading.Thread(target=bms_box.running, daemon=True).start()
+    time.sleep(1)
+    set_fix(bms_box)
+
+    print("  %-16s %6s %9s %9s %5s %6s" % ("query", "", "p50 ms", "max ms", "ids", "bytes"))
+    for name, ids in sorted(QUERIES.items()):
+        for label in ("before", "after"):
+            if label == "before":
+                bms_box._BmsBox__query_objmodel = former_query(bms_box)
+            else:
+                del bms_box._BmsBox__query_objmodel
+            latency, size, answered = [], 0, 0
+            for i in range(args.queries):
+                sif.inject(sif_public_frame(soc_raw=100 + i))
+                ms, data = query(ids)
+                latency.append(ms)
+                if data:
+                    answered = len(data)
+                    size = len(json.dumps(data, default=str))
+            print("  %-16s %6s %9.1f %9.1f %5d %6d" % (name, label, percentile(latency, 50), max(latency),
+                                                      answered, size))
+
+
+if __name__ == "__main__":
+    main()
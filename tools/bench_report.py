@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+@file      :bench_report.py
+@brief     :End-to-end report path benchmark against the quecIot stand-in.
+
+Runs BmsBox's report pipeline (BMS frame -> report data -> phymodelReport
+-> cloud ack) on a Linux host with no network and prints:
+
+  * frame-to-ack latency (p50/p90/max)
+  * sequential reports per second
+  * behaviour during an injected cloud outage
+
+Usage: python tools/bench_report.py [--reports 20] [--ack-ms 50] [--loss 0] [--outage 5]
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import qpy_host  # noqa: E402
+
+
+def sif_public_frame(soc_raw=160, fault=0):
+    data = bytearray(20)
+    data[0] = 0x01
+    data[2] = 0x01
+    data[5:7] = (480).to_bytes(2, "little")
+    data[9] = soc_raw
+    data[10:12] = (512).to_bytes(2, "little")
+    data[12:14] = (5000).to_bytes(2, "little")
+    data[14], data[15], data[16] = 65, 60, 62
+    data[17] = fault
+    data[19] = sum(data[:19]) & 0xFF
+    return bytes(data)
+
+
+def percentile(values, pct):
+    if not values:
+        return float("nan")
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100.0))]
+
+
+def build(args):
+    qpy_host.install()
+    import quecIot
+    from usr.bms_box import BmsBox
+    from usr.location import GPS, NMEAParse
+    from usr.modules import NetManage
+    from usr.quecthing import QuecObjectModel, QuecOTA, QuecThing
+    from usr.settings import Settings
+    from usr.xingheng_sif_protocol import XinghengSifProtocol
+    qpy_host.quiet()
+
+    quecIot.sim.reset(ack_latency=args.ack_ms / 1000.0, loss=args.loss, seed=args.seed)
+    settings = Settings()
+    settings.set("loc_cfg", "loc_method", 0)
+    _settings = settings.get()
+
+    cloud = QuecThing(**_settings["quec_cloud_cfg"])
+    net_manage = NetManage()
+    bms_box = BmsBox()
+    for module in (settings, QuecObjectModel(), cloud, QuecOTA(), NMEAParse(),
+                   GPS(**_settings["loc_cfg"]["gps_cfg"]), XinghengSifProtocol(gpio=32), net_manage):
+        bms_box.add_module(module)
+    net_manage.start()
+    cloud.connect()
+    deadline = time.monotonic() + 5
+    while not cloud.is_online() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return bms_box, cloud
+
+
+def report_once(bms_box):
+    return bms_box._BmsBox__data_report(bms_box._BmsBox__init_report_data())
+
+
+def bench_latency(bms_box, count):
+    import sif
+    latencies, ok = [], 0
+    for i in range(count):
+        start = time.monotonic()
+        sif.inject(sif_public_frame(soc_raw=100 + i % 100))
+        if report_once(bms_box):
+            ok += 1
+            latencies.append((time.monotonic() - start) * 1000)
+    return latencies, ok
+
+
+def bench_throughput(bms_box, seconds):
+    count, start = 0, time.monotonic()
+    while time.monotonic() - start < seconds:
+        if report_once(bms_box):
+            count += 1
+    return count / (time.monotonic() - start)
+
+
+def bench_outage(bms_box, cloud, duration):
+    import quecIot
+    quecIot.sim.inject_outage(duration)
+    start = time.monotonic()
+    while cloud.is_online() and time.monotonic() - start < 1:
+        time.sleep(0.001)
+    failed = attempts = 0
+    while not cloud.is_online() and time.monotonic() - start < duration + 120:
+        attempts += 1
+        if not report_once(bms_box):
+            failed += 1
+        time.sleep(0.2)
+    return time.monotonic() - start, attempts, failed, quecIot.sim.stats["connects"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--reports", type=int, default=20, help="reports for the latency run")
+    parser.add_argument("--ack-ms", type=float, default=50.0, help="simulated cloud ack latency")
+    parser.add_argument("--loss", type=float, default=0.0, help="probability that a report is never acked")
+    parser.add_argument("--throughput-s", type=float, default=5.0, help="duration of the throughput run")
+    parser.add_argument("--outage", type=float, default=5.0, help="injected outage in seconds, 0 to skip")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    bms_box, cloud = build(args)
+    if not cloud.is_online():
+        sys.exit("cloud stand-in did not come online")
+
+    latencies, ok = bench_latency(bms_box, args.reports)
+    print("frame-to-ack latency: n=%d ok=%d p50=%.1fms p90=%.1fms max=%.1fms" % (
+        args.reports, ok, percentile(latencies, 50), percentile(latencies, 90), max(latencies or [float("nan")])))
+    print("reports per second: %.2f" % bench_throughput(bms_box, args.throughput_s))
+    if args.outage > 0:
+        recovered, attempts, failed, connects = bench_outage(bms_box, cloud, args.outage)
+        print("outage %.1fs: back online after %.1fs, %d/%d reports failed, %d connect attempts" % (
+            args.outage, recovered, failed, attempts, connects))
+
+
+if __name__ == "__main__":
+    main()
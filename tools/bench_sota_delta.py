@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+@file      :bench_sota_delta.py
+@brief     :Bytes transferred by full vs delta SOTA packages across releases.
+
+Every pair of consecutive git revisions that touch code/ is treated as a
+release step; for each one the full and the delta package are built with
+sota_delta.py and their sizes are compared. With --apply the delta is also
+downloaded and applied by QuecOTA through the quecIot stand-in, and the
+staged files are checked against the target tree.
+
+Usage: python tools/bench_sota_delta.py [--revs REV ...] [--last 10] [--apply]
+"""
+
+import argparse
+import hashlib
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+TOOLS = os.path.dirname(os.path.abspath(__file__))
+REPO = os.path.dirname(TOOLS)
+sys.path.insert(0, TOOLS)
+
+import sota_delta  # noqa: E402
+
+
+def git(*args):
+    return subprocess.run(("git", "-C", REPO) + args, check=True, capture_output=True).stdout
+
+
+def checkout(rev, dest):
+    os.makedirs(dest)
+    archive = git("archive", "--format=tar", rev, "code")
+    subprocess.run(("tar", "-x", "-C", dest), input=archive, check=True)
+    return os.path.join(dest, "code")
+
+
+def apply_on_host(old_dir, new_dir, package):
+    """Download and apply package with QuecOTA, returns (result, seconds)."""
+    import qpy_host
+    root = qpy_host.install()
+    qpy_host.quiet()
+    for name in os.listdir(old_dir):
+        shutil.copy(os.path.join(old_dir, name), os.path.join(root, name))
+    import quecIot
+    import app_fota_download
+    from usr.quecthing import QuecOTA
+
+    app_fota_download.staged[:] = []
+    quecIot.sim.load_ota(package, piece_size=4096)
+    ota = QuecOTA()
+    results = []
+    ota.set_callback(results.append)
+    ota.set_ota_info(len(package), hashlib.md5(package).hexdigest())
+
+    def callback(args):
+        if args[0] == 7 and args[1] == 10703:
+            data = eval(args[2])
+            ota.start_ota(data[2], data[3])
+
+    quecIot.sim.callback = callback
+    start = time.time()
+    quecIot.sim.next_piece()
+    while not results and time.time() - start < 60:
+        time.sleep(0.01)
+    for src, dst, _ in app_fota_download.staged:
+        with open(os.path.join(root, src[len("/usr/"):]), "rb") as a, open(os.path.join(new_dir, dst[len("/usr/"):]), "rb") as b:
+            assert a.read() == b.read(), dst
+    return (results or [None])[0], time.time() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--revs", nargs="+", help="release revisions, oldest first")
+    parser.add_argument("--last", type=int, default=10, help="without --revs, the last N revisions touching code/")
+    parser.add_argument("--apply", action="store_true", help="apply each delta with QuecOTA on the host")
+    args = parser.parse_args()
+
+    revs = args.revs or git("rev-list", "--reverse", "-n", str(args.last + 1), "HEAD", "--", "code").decode().split()
+    tmp = tempfile.mkdtemp()
+    try:
+        trees = [checkout(rev, os.path.join(tmp, str(i))) for i, rev in enumerate(revs)]
+        total_full = total_delta = 0
+        print("%-9s -> %-9s %9s %9s %7s %s" % ("from", "to", "full B", "delta B", "ratio", "files"))
+        for i in range(1, len(revs)):
+            full = sota_delta.make_full(trees[i])
+            delta, manifest = sota_delta.make_delta(trees[i - 1], trees[i], base="")
+            total_full += len(full)
+            total_delta += len(delta)
+            ops = ",".join("%s:%s" % (item["op"][0], item["name"]) for item in manifest["files"])
+            print("%-9s -> %-9s %9d %9d %6.1f%% %s" % (revs[i - 1][:9], revs[i][:9], len(full), len(delta),
+                                                      100.0 * len(delta) / len(full), ops))
+            if args.apply:
+                result, seconds = apply_on_host(trees[i - 1], trees[i], delta)
+                print("    applied: result %s in %.2fs" % (result, seconds))
+        if total_full:
+            print("total: full %d B, delta %d B (%.1f%%)" % (total_full, total_delta, 100.0 * total_delta / total_full))
+    finally:
+        shutil.rmtree(tmp)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+@file      :bench_track.py
+@brief     :Points kept and payload size of TrackBuffer against raw sampling.
+
+Feeds a 1 Hz synthetic trace (see sim_gnss_duty.py) into TrackBuffer and
+uploads it batch by batch. For each tolerance it prints the points and the
+JSON payload bytes sent, and the worst distance of the raw 1 Hz trace from
+the uploaded polyline. The same numbers are given for plain decimation
+to the same point count and for raw 1 Hz sampling.
+
+Usage: python tools/bench_track.py [--scenario delivery] [--interval 1] [--tolerance 2 5 10 20]
+"""
+
+import argparse
+import json
+import math
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import qpy_host  # noqa: E402
+from sim_gnss_duty import synthetic  # noqa: E402
+
+
+def _xy(lat0, lon, lat):
+    return (lon * 111320.0 * math.cos(math.radians(lat0)), lat * 110540.0)
+
+
+def deviation(raw, kept):
+    """Worst distance (m) of raw (t, lat, lon) points from the polyline through kept (t, lat, lon)."""
+    if len(kept) < 2:
+        return 0.0
+    lat0 = raw[0][1]
+    worst, seg = 0.0, 0
+    for t, lat, lon in raw:
+        while seg < len(kept) - 2 and t > kept[seg + 1][0]:
+            seg += 1
+        ax, ay = _xy(lat0, kept[seg][2], kept[seg][1])
+        bx, by = _xy(lat0, kept[seg + 1][2], kept[seg + 1][1])
+        px, py = _xy(lat0, lon, lat)
+        dx, dy = bx - ax, by - ay
+        length2 = dx * dx + dy * dy
+        u = max(0.0, min(1.0, ((px - ax) * dx + (py - ay) * dy) / length2)) if length2 else 0.0
+        worst = max(worst, math.hypot(px - ax - u * dx, py - ay - u * dy))
+    return worst
+
+
+def payload(points):
+    return len(json.dumps({88: points}, separators=(",", ":")))
+
+
+def run(rows, tolerance, interval, TrackBuffer):
+    track = TrackBuffer(capacity=512, interval=interval, tolerance=tolerance, size=64)
+    sent, size, batches = [], 0, 0
+    for t, lat, lon, speed, _ in rows:
+        track.add({"timestamp": int(t), "lat": lat, "lon": lon, "speed": speed})
+        if len(track) >= 256:
+            batch = track.batch()
+            size += payload(batch["points"])
+            batches += 1
+            sent.extend(batch["points"])
+            track.commit(batch)
+    while len(track):
+        batch = track.batch()
+        size += payload(batch["points"])
+        batches += 1
+        sent.extend(batch["points"])
+        track.commit(batch)
+    return [(p[1], p[3] / 1e6, p[2] / 1e6) for p in sent], size, batches
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenario", default="delivery", choices=("commute", "delivery", "parked"))
+    parser.add_argument("--interval", type=int, default=1, help="TrackBuffer recording interval (s)")
+    parser.add_argument("--tolerance", type=float, nargs="+", default=[2, 5, 10, 20])
+    args = parser.parse_args()
+
+    qpy_host.install()
+    from usr.location import TrackBuffer
+    qpy_host.quiet()
+
+    rows = synthetic(args.scenario)
+    raw = [(int(t), lat, lon) for t, lat, lon, _, _ in rows]
+    raw_points = [{1: int(t), 2: int(lon * 1e6), 3: int(lat * 1e6), 4: int(speed * 10)} for t, lat, lon, speed, _ in rows]
+    print("%s: %d raw 1 Hz points, %d B raw payload" % (args.scenario, len(raw), payload(raw_points)))
+    print("%9s %8s %10s %8s %12s %14s" % ("tolerance", "points", "payload B", "batches", "max dev m", "decimated dev"))
+    for tolerance in args.tolerance:
+        kept, size, batches = run(rows, tolerance, args.interval, TrackBuffer)
+        step = max(1, len(raw) // max(1, len(kept)))
+        decimated = raw[::step] + [raw[-1]]
+        print("%8.1fm %8d %10d %8d %12.1f %14.1f" % (tolerance, len(kept), size, batches, deviation(raw, kept),
+                                                     deviation(raw, decimated)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""Host harness that lets the application in code/ run under CPython.
+
+install() puts the QuecPython module stand-ins from stubs/ on sys.path,
+maps the device "/usr/" file system to a host directory and exposes
+code/ as the ``usr`` package, exactly like it is deployed on the module::
+
+    import qpy_host
+    qpy_host.install()
+    from usr.quecthing import QuecThing
+    import quecIot
+    quecIot.sim.reset(ack_latency=0.05, loss=0.01)
+"""
+
+import builtins
+import gc
+import os
+import queue
+import shutil
+import sys
+import tempfile
+import types
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+STUBS = os.path.join(HERE, "stubs")
+CODE = os.path.normpath(os.path.join(HERE, "..", "..", "code"))
+
+_installed = False
+
+
+def _patch_builtins():
+    # QuecPython's Queue exposes size(), gc exposes mem_free()/mem_alloc().
+    queue.Queue.size = queue.Queue.qsize
+    if not hasattr(gc, "mem_free"):
+        gc.mem_free = lambda: 512 * 1024
+        gc.mem_alloc = lambda: 0
+
+    import _qpy_fs
+    _open = builtins.open
+
+    def _device_open(file, *args, **kwargs):
+        return _open(_qpy_fs.path(file), *args, **kwargs)
+
+    builtins.open = _device_open
+
+
+def install(fs_root=None, code_dir=CODE):
+    """Install the stand-ins, returns the host directory backing "/usr/"."""
+    global _installed
+    if STUBS not in sys.path:
+        sys.path.insert(0, STUBS)
+    import _qpy_fs
+
+    if fs_root is None:
+        fs_root = tempfile.mkdtemp(prefix="qpy_usr_")
+    os.makedirs(fs_root, exist_ok=True)
+    _qpy_fs.ROOT = fs_root
+    for name in os.listdir(code_dir):
+        if name.endswith(".json"):
+            shutil.copy(os.path.join(code_dir, name), fs_root)
+
+    if not _installed:
+        _patch_builtins()
+        usr = types.ModuleType("usr")
+        usr.__path__ = [code_dir]
+        sys.modules["usr"] = usr
+        _installed = True
+    return fs_root
+
+
+def quiet(level="warn"):
+    """Raise the level of every usr.* module logger, benchmarks keep stdout for results."""
+    for name, module in list(sys.modules.items()):
+        log = getattr(module, "log", None) if name.startswith("usr.") else None
+        if log is not None and hasattr(log, "set_level"):
+            log.set_debug(False)
+            log.set_level(level)
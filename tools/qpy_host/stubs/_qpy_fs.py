@@ -0,0 +1,11 @@
+"""Maps the device file system ("/usr/...") onto a host directory."""
+
+import os
+
+ROOT = None
+
+
+def path(p):
+    if ROOT and isinstance(p, str) and (p == "/usr" or p.startswith("/usr/")):
+        return os.path.join(ROOT, p[len("/usr"):].lstrip("/"))
+    return p
@@ -0,0 +1,15 @@
+"""Host stand-in for app_fota_download, records what the OTA code stages."""
+
+staged = []
+update_flag = False
+
+
+def update_download_stat(src, dst, size):
+    staged.append((src, dst, size))
+    return 0
+
+
+def set_update_flag():
+    global update_flag
+    update_flag = True
+    return 0
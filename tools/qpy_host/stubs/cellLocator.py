@@ -0,0 +1,38 @@
+"""Host stand-in for cellLocator.
+
+getLocation() answers from `locations`, keyed by the serving cell
+(mcc, mnc, lac/tac, cid) of the net stand-in, falling back to `location`.
+`latency` (s) simulates the server round trip, `error` (e.g. -2) makes the
+next calls fail, `calls` counts round trips.
+"""
+
+import time
+
+import net
+
+location = (120.1741, 30.2721, 550)
+locations = {}
+latency = 0.0
+error = None
+calls = 0
+
+
+def _serving_cell():
+    gsm, umts, lte = net.cell_info
+    for cell in lte:
+        if cell[0] == 0:
+            return (cell[2], cell[3], cell[5], cell[1])
+    for cell in gsm:
+        if cell[0] == 0:
+            return (cell[2], cell[3], cell[4], cell[1])
+    return None
+
+
+def getLocation(serverAddr, port, token, timeout, profileIdx):
+    global calls
+    calls += 1
+    if latency:
+        time.sleep(latency)
+    if error is not None:
+        return error
+    return locations.get(_serving_cell(), location)
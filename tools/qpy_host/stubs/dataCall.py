@@ -0,0 +1,21 @@
+"""Host stand-in for dataCall, set_state() injects bearer loss and recovery."""
+
+state = 1
+_callback = None
+
+
+def getInfo(pdp, ipv):
+    return (pdp, ipv, [state, 0, "10.0.0.2" if state else "0.0.0.0", "8.8.8.8", "8.8.4.4"])
+
+
+def setCallback(callback):
+    global _callback
+    _callback = callback
+    return 0
+
+
+def set_state(value, pdp=1):
+    global state
+    state = value
+    if _callback:
+        _callback((pdp, value))
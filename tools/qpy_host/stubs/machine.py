@@ -0,0 +1,103 @@
+"""Host stand-in for machine (Pin, UART, Timer)."""
+
+import threading
+
+
+class Pin:
+    IN = 0
+    OUT = 1
+    PULL_DISABLE = 0
+    PULL_PU = 1
+    PULL_PD = 2
+
+    def __init__(self, gpio, direction=IN, pull=PULL_DISABLE, level=0):
+        self.gpio = gpio
+        self.__level = level
+
+    def read(self):
+        return self.__level
+
+    def write(self, level):
+        self.__level = level
+        return 0
+
+
+for _i in range(1, 48):
+    setattr(Pin, "GPIO%d" % _i, _i)
+
+
+class UART:
+    """Byte pipe with the device UART API, feed() pushes received bytes from the host side."""
+
+    UART0, UART1, UART2, UART3 = 0, 1, 2, 3
+
+    def __init__(self, port, baudrate=115200, databits=8, parity=0, stopbits=1, flowctl=0):
+        self.port = port
+        self.baudrate = baudrate
+        self.written = bytearray()
+        self.__rx = bytearray()
+        self.__lock = threading.Lock()
+        self.__callback = None
+
+    def set_callback(self, callback):
+        self.__callback = callback
+        return 0
+
+    def control_485(self, pin, level):
+        return 0
+
+    def any(self):
+        return len(self.__rx)
+
+    def read(self, nbytes):
+        with self.__lock:
+            data = bytes(self.__rx[:nbytes])
+            del self.__rx[:nbytes]
+        return data
+
+    def write(self, data):
+        self.written += data
+        return len(data)
+
+    def close(self):
+        return 0
+
+    def feed(self, data):
+        with self.__lock:
+            self.__rx += data
+        if self.__callback:
+            self.__callback((0, self.port, len(data)))
+
+
+class Timer:
+    Timer0, Timer1, Timer2, Timer3 = 0, 1, 2, 3
+    ONE_SHOT = 0
+    PERIODIC = 1
+
+    def __init__(self, num):
+        self.__timer = None
+
+    def start(self, period=1000, mode=ONE_SHOT, callback=None):
+        def _fire():
+            if mode == Timer.PERIODIC:
+                self.start(period, mode, callback)
+            callback(self)
+        self.stop()
+        self.__timer = threading.Timer(period / 1000.0, _fire)
+        self.__timer.daemon = True
+        self.__timer.start()
+        return 0
+
+    def stop(self):
+        if self.__timer is not None:
+            self.__timer.cancel()
+            self.__timer = None
+        return 0
+
+
+class I2C:
+    I2C0, I2C1 = 0, 1
+    STANDARD_MODE, FAST_MODE = 0, 1
+
+    def __init__(self, *args):
+        pass
@@ -0,0 +1,35 @@
+"""Host stand-in for misc."""
+
+
+class PowerRestart(SystemExit):
+    pass
+
+
+class Power:
+    restarts = 0
+
+    @classmethod
+    def powerRestart(cls):
+        cls.restarts += 1
+        raise PowerRestart("Power.powerRestart()")
+
+    @staticmethod
+    def powerDown():
+        raise SystemExit("Power.powerDown()")
+
+    @staticmethod
+    def getVbatt():
+        return 3800
+
+
+class ADC:
+    ADC0, ADC1 = 0, 1
+
+    def open(self):
+        return 0
+
+    def read(self, num):
+        return 1800
+
+    def close(self):
+        return 0
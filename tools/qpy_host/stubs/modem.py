@@ -0,0 +1,9 @@
+"""Host stand-in for modem."""
+
+
+def getDevFwVersion():
+    return "EC600NCNLCR03A01M08_QPY_HOST"
+
+
+def getDevImei():
+    return "860000000000000"
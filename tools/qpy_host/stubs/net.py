@@ -0,0 +1,28 @@
+"""Host stand-in for net, set_serving_cell() moves the device to another LTE cell."""
+
+modem_fun = 1
+csq = 25
+cell_info = ([], [], [(0, 0x5A1B2C3, 460, 0, 123, 0x1A2B, 1300, -85)])
+
+
+def setModemFun(fun, rst=0):
+    global modem_fun
+    modem_fun = fun
+    return 0
+
+
+def getModemFun():
+    return modem_fun
+
+
+def csqQueryPoll():
+    return csq
+
+
+def getCellInfo():
+    return cell_info
+
+
+def set_serving_cell(cid, tac=0x1A2B, mcc=460, mnc=0):
+    global cell_info
+    cell_info = ([], [], [(0, cid, mcc, mnc, 123, tac, 1300, -85)])
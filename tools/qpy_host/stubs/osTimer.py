@@ -0,0 +1,40 @@
+"""Host stand-in for osTimer, the module itself is the timer class on the device."""
+
+import sys
+import threading
+
+
+class osTimer:
+
+    def __init__(self):
+        self.__timer = None
+        self.__lock = threading.Lock()
+
+    def __fire(self, period, repeat, callback):
+        if repeat:
+            self.__arm(period, repeat, callback)
+        callback(None)
+
+    def __arm(self, period, repeat, callback):
+        with self.__lock:
+            self.__timer = threading.Timer(period / 1000.0, self.__fire, (period, repeat, callback))
+            self.__timer.daemon = True
+            self.__timer.start()
+
+    def start(self, period, repeat, callback):
+        self.stop()
+        self.__arm(period, repeat, callback)
+        return 0
+
+    def stop(self):
+        with self.__lock:
+            if self.__timer is not None:
+                self.__timer.cancel()
+                self.__timer = None
+        return 0
+
+    def delete_timer(self):
+        return self.stop()
+
+
+sys.modules[__name__] = osTimer
@@ -0,0 +1,31 @@
+"""Host stand-in for pm, records wakelock usage."""
+
+autosleep_enabled = 0
+locks = {}
+held = set()
+
+
+def autosleep(enable):
+    global autosleep_enabled
+    autosleep_enabled = enable
+    return 0
+
+
+def create_wakelock(name, size):
+    fd = len(locks) + 1
+    locks[fd] = name
+    return fd
+
+
+def wakelock_lock(fd):
+    held.add(fd)
+    return 0
+
+
+def wakelock_unlock(fd):
+    held.discard(fd)
+    return 0
+
+
+def get_wakelock_num():
+    return len(held)
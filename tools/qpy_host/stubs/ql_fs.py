@@ -0,0 +1,34 @@
+"""Host stand-in for ql_fs."""
+
+import json as _json
+import os as _os
+
+from _qpy_fs import path as _path
+
+
+def path_exists(p):
+    return _os.path.exists(_path(p))
+
+
+def mkdirs(p):
+    _os.makedirs(_path(p), exist_ok=True)
+
+
+def touch(p, data):
+    with open(_path(p), "w") as f:
+        _json.dump(data, f)
+    return 0
+
+
+def read_json(p):
+    with open(_path(p)) as f:
+        return _json.load(f)
+
+
+def file_size(p):
+    return _os.path.getsize(_path(p))
+
+
+def rmdirs(p):
+    import shutil
+    shutil.rmtree(_path(p), ignore_errors=True)
@@ -0,0 +1,256 @@
+"""Host stand-in for the quecIot SDK module.
+
+Module functions mirror the subset of the SDK used by usr.quecthing. The
+``sim`` object controls the simulated cloud: ack latency, report loss,
+connection outages and the MCU firmware package served to mcuFWDataRead.
+Events are delivered on a dedicated thread like the real SDK callback.
+"""
+
+import hashlib
+import heapq
+import random
+import threading
+import time
+
+
+class QuecIotSim:
+
+    def __init__(self):
+        self.__cond = threading.Condition()
+        self.__events = []
+        self.__seq = 0
+        self.__thread = None
+        self.reset()
+
+    def reset(self, ack_latency=(0.02, 0.08), connect_latency=0.1, loss=0.0, seed=None):
+        """Reset state; ack_latency is seconds or a (min, max) range, loss is the no-ack probability."""
+        self.ack_latency = ack_latency
+        self.connect_latency = connect_latency
+        self.loss = loss
+        self.rand = random.Random(seed)
+        self.callback = None
+        self.connmode = 0
+        self.workstate = 0
+        self.outage_until = 0.0
+        self.auto_recover = False
+        self.dk_ds = ("999999999", "fdb1406dc6b6c85956871e14c49c515e")
+        self.firmware = b""
+        self.ota_module = ""
+        self.piece_size = 0
+        self.piece_addr = 0
+        self.stats = {"reports": 0, "acks": 0, "lost": 0, "rejected": 0, "loc": 0, "fw_read": 0, "fw_bytes": 0, "connects": 0}
+        self.reported = []
+        self.ota_actions = []
+
+    # Event delivery
+    def __loop(self):
+        while True:
+            with self.__cond:
+                while not self.__events or self.__events[0][0] > time.monotonic():
+                    timeout = self.__events[0][0] - time.monotonic() if self.__events else None
+                    self.__cond.wait(timeout)
+                _, _, func, args = heapq.heappop(self.__events)
+            func(*args)
+
+    def schedule(self, delay, func, *args):
+        with self.__cond:
+            if self.__thread is None:
+                self.__thread = threading.Thread(target=self.__loop, name="quecIot", daemon=True)
+                self.__thread.start()
+            self.__seq += 1
+            heapq.heappush(self.__events, (time.monotonic() + delay, self.__seq, func, args))
+            self.__cond.notify()
+
+    def emit(self, delay, event, errcode, data=None):
+        args = (event, errcode) if data is None else (event, errcode, data)
+        self.schedule(delay, self.__deliver, args)
+
+    def __deliver(self, args):
+        if self.callback:
+            self.callback(args)
+
+    def latency(self):
+        if isinstance(self.ack_latency, (tuple, list)):
+            return self.rand.uniform(*self.ack_latency)
+        return self.ack_latency
+
+    # Connection
+    def in_outage(self):
+        return time.monotonic() < self.outage_until
+
+    def online(self):
+        return self.workstate == 8 and self.connmode == 1
+
+    def __set_online(self):
+        if self.connmode == 1 and not self.in_outage():
+            self.workstate = 8
+
+    def connect(self):
+        self.stats["connects"] += 1
+        if self.in_outage():
+            self.workstate = 0
+            self.emit(self.connect_latency, 2, 10450)
+            return
+        base = self.connect_latency
+        self.emit(base, 1, 10200)
+        self.emit(base * 2, 2, 10200)
+        self.schedule(base * 3, self.__set_online)
+        self.emit(base * 3, 3, 10200)
+
+    def disconnect(self):
+        self.workstate = 0
+        self.emit(0.01, 6, 10200)
+
+    def inject_outage(self, duration):
+        """Drop the connection now; reconnects fail until duration seconds have passed."""
+        self.outage_until = time.monotonic() + duration
+        self.workstate = 0
+        self.emit(0.0, 2, 10450)
+        if self.auto_recover:
+            self.schedule(duration, self.__auto_reconnect)
+
+    def __auto_reconnect(self):
+        if self.connmode == 1 and not self.online():
+            self.connect()
+
+    # Uplink
+    def report(self, kind, data):
+        if not self.online():
+            self.stats["rejected"] += 1
+            return False
+        self.stats["reports"] += 1
+        self.reported.append((kind, data))
+        if self.rand.random() < self.loss:
+            self.stats["lost"] += 1
+            return True
+        self.stats["acks"] += 1
+        if kind == "phymodel":
+            self.emit(self.latency(), 4, 10210)
+        elif kind == "loc":
+            self.emit(self.latency(), 4, 10220)
+        return True
+
+    def downlink(self, errcode, data, delay=0.0):
+        """Deliver a cloud downlink event (5, errcode, data), e.g. 10210 set or 10220 query."""
+        self.emit(delay, 5, errcode, data)
+
+    def ota(self, errcode, data, delay=0.0):
+        self.emit(delay, 7, errcode, data)
+
+    # MCU OTA
+    def load_ota(self, package, piece_size=None, module="QuecPython-Tracker"):
+        """Serve package through mcuFWDataRead, announced in pieces of piece_size bytes."""
+        self.firmware = package
+        self.ota_module = module
+        self.piece_size = piece_size or len(package)
+        self.piece_addr = 0
+
+    def start_ota_download(self, md5=None):
+        """Emit the 10701 (download start) and first 10703 (piece ready) events."""
+        md5 = md5 or hashlib.md5(self.firmware).hexdigest()
+        self.ota(10701, repr((self.ota_module, len(self.firmware), md5)))
+        self.piece_addr = 0
+        self.next_piece()
+
+    def next_piece(self):
+        if self.piece_addr >= len(self.firmware):
+            return False
+        size = min(self.piece_size, len(self.firmware) - self.piece_addr)
+        self.ota(10703, repr((self.ota_module, len(self.firmware), self.piece_addr, size)), delay=self.latency())
+        self.piece_addr += size
+        return True
+
+
+sim = QuecIotSim()
+
+
+def init():
+    return True
+
+
+def setEventCB(callback):
+    sim.callback = callback
+    return True
+
+
+def setProductinfo(pk, ps):
+    return True
+
+
+def setDkDs(dk, ds):
+    sim.dk_ds = (dk, ds)
+    return True
+
+
+def getDkDs():
+    return sim.dk_ds
+
+
+def setServer(mode, server):
+    return True
+
+
+def setLifetime(life_time):
+    return True
+
+
+def setMcuVersion(name, version):
+    return True
+
+
+def setConnmode(mode):
+    previous = sim.connmode
+    sim.connmode = mode
+    if mode == 1 and not sim.online():
+        sim.connect()
+    elif mode == 0 and previous == 1:
+        sim.disconnect()
+    return True
+
+
+def getConnmode():
+    return sim.connmode
+
+
+def getWorkState():
+    return sim.workstate
+
+
+def phymodelReport(qos, data):
+    return sim.report("phymodel", data)
+
+
+def phymodelAck(qos, pkgId, data):
+    return sim.report("ack", data)
+
+
+def locReportOutside(data):
+    sim.stats["loc"] += 1
+    return sim.report("loc", data)
+
+
+def locReportInside(data):
+    sim.stats["loc"] += 1
+    return sim.report("loc", data)
+
+
+def devInfoReport(ids):
+    return sim.online()
+
+
+def otaRequest(mode):
+    return sim.online()
+
+
+def otaAction(action):
+    sim.ota_actions.append(action)
+    if action == 2:
+        sim.next_piece()
+    return True
+
+
+def mcuFWDataRead(start_addr, read_len):
+    sim.stats["fw_read"] += 1
+    data = sim.firmware[start_addr:start_addr + read_len]
+    sim.stats["fw_bytes"] += len(data)
+    return data
@@ -0,0 +1,81 @@
+"""Host stand-in for quecgnss, the built-in GNSS receiver.
+
+``sim`` replays NMEA output: load() takes the receiver epochs as bytes and
+their rate (Hz), advance(seconds) moves the replay clock and appends the
+epochs that became due (the one at time t once the clock reaches t) to
+the receive buffer (`buffer_size` bytes, the oldest bytes are dropped on
+overflow, like the module's ring buffer).
+read() hands out and removes up to `size` buffered bytes. With
+``sim.auto`` set every read() first advances the clock by one second, the
+rate the application polls at.
+"""
+
+_enabled = 0
+
+
+class QuecGnssSim:
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self, buffer_size=4096, auto=False):
+        self.buffer_size = buffer_size
+        self.auto = auto
+        self.epochs = []
+        self.rate = 1
+        self.clock = 0.0
+        self.index = 0
+        self.buffer = bytearray()
+        self.peak = 0
+        self.dropped = 0
+        self.reads = 0
+
+    def load(self, epochs, rate=1):
+        self.epochs = list(epochs)
+        self.rate = rate
+        self.clock = 0.0
+        self.index = 0
+        self.buffer = bytearray()
+        self.advance(0)
+
+    def advance(self, seconds=1):
+        self.clock += seconds
+        due = min(len(self.epochs), int(self.clock * self.rate + 1e-9) + 1)
+        while self.index < due:
+            self.buffer += self.epochs[self.index]
+            self.index += 1
+        overflow = len(self.buffer) - self.buffer_size
+        if overflow > 0:
+            del self.buffer[:overflow]
+            self.dropped += overflow
+        self.peak = max(self.peak, len(self.buffer))
+
+    @property
+    def finished(self):
+        return self.index >= len(self.epochs) and not self.buffer
+
+
+sim = QuecGnssSim()
+
+
+def init():
+    return 0
+
+
+def gnssEnable(enable):
+    global _enabled
+    _enabled = enable
+    return 0
+
+
+def get_state():
+    return 2 if _enabled else 0
+
+
+def read(size):
+    sim.reads += 1
+    if sim.auto:
+        sim.advance(1)
+    data = bytes(sim.buffer[:size])
+    del sim.buffer[:size]
+    return (len(data), data)
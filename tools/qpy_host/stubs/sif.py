@@ -0,0 +1,27 @@
+"""Host stand-in for the SIF single wire driver, inject() delivers a frame."""
+
+_callback = None
+acctimer_running = True
+
+
+def init(gpio, callback):
+    global _callback
+    _callback = callback
+    return 0
+
+
+def acctimer_stop():
+    global acctimer_running
+    acctimer_running = False
+    return 0
+
+
+def acctimer_start():
+    global acctimer_running
+    acctimer_running = True
+    return 0
+
+
+def inject(data):
+    if _callback:
+        _callback(bytes(data))
@@ -0,0 +1,14 @@
+"""Host stand-in for ubinascii."""
+
+import binascii as _binascii
+
+a2b_base64 = _binascii.a2b_base64
+b2a_base64 = _binascii.b2a_base64
+crc32 = _binascii.crc32
+unhexlify = _binascii.unhexlify
+
+
+def hexlify(data, sep=None):
+    if sep:
+        return _binascii.hexlify(data, sep)
+    return _binascii.hexlify(data)
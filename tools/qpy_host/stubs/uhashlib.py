@@ -0,0 +1,15 @@
+"""Host stand-in for uhashlib."""
+
+import hashlib as _hashlib
+
+
+def md5(data=b""):
+    return _hashlib.md5(data)
+
+
+def sha1(data=b""):
+    return _hashlib.sha1(data)
+
+
+def sha256(data=b""):
+    return _hashlib.sha256(data)
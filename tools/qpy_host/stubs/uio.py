@@ -0,0 +1,3 @@
+"""Host stand-in for uio."""
+
+from io import BytesIO, IOBase, StringIO  # noqa: F401
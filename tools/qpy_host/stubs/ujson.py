@@ -0,0 +1,3 @@
+"""Host stand-in for ujson."""
+
+from json import dump, dumps, load, loads  # noqa: F401
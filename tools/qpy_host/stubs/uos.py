@@ -0,0 +1,46 @@
+"""Host stand-in for uos, device paths are mapped by _qpy_fs."""
+
+import os as _os
+
+from _qpy_fs import path as _path
+
+SYSNAME = "EC600N-CNLC"
+
+
+def uname():
+    return ("sysname=%s" % SYSNAME, "nodename=%s" % SYSNAME, "release=1.12.0", "version=v1.12 on qpy_host", "machine=%s with QUECTEL" % SYSNAME, "qpyver=V0001")
+
+
+def remove(p):
+    _os.remove(_path(p))
+
+
+def rename(a, b):
+    _os.rename(_path(a), _path(b))
+
+
+def mkdir(p):
+    _os.mkdir(_path(p))
+
+
+def rmdir(p):
+    _os.rmdir(_path(p))
+
+
+def listdir(p="/usr"):
+    return _os.listdir(_path(p))
+
+
+def stat(p):
+    return tuple(_os.stat(_path(p)))
+
+
+def ilistdir(p="/usr"):
+    for name in _os.listdir(_path(p)):
+        full = _os.path.join(_path(p), name)
+        yield (name, 0x4000 if _os.path.isdir(full) else 0x8000, 0, _os.path.getsize(full))
+
+
+def statvfs(p="/usr"):
+    st = _os.statvfs(_path(p))
+    return (st.f_bsize, st.f_frsize, st.f_blocks, st.f_bfree, st.f_bavail, 0, 0, 0, 0, st.f_namemax)
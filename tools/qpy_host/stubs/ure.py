@@ -0,0 +1,3 @@
+"""Host stand-in for ure."""
+
+from re import compile, match, search, sub  # noqa: F401
@@ -0,0 +1,11 @@
+"""Host stand-in for usys."""
+
+import sys as _sys
+import traceback as _traceback
+
+implementation = _sys.implementation
+platform = "qpy_host"
+
+
+def print_exception(e, file=None):
+    _traceback.print_exception(type(e), e, e.__traceback__, file=file)
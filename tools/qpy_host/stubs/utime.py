@@ -0,0 +1,46 @@
+"""Host stand-in for the MicroPython utime module."""
+
+import time as _time
+
+_T0 = _time.monotonic()
+
+
+def time():
+    return int(_time.time())
+
+
+def sleep(seconds):
+    _time.sleep(seconds)
+
+
+def sleep_ms(ms):
+    _time.sleep(ms / 1000.0)
+
+
+def sleep_us(us):
+    _time.sleep(us / 1000000.0)
+
+
+def ticks_ms():
+    return int((_time.monotonic() - _T0) * 1000)
+
+
+def ticks_us():
+    return int((_time.monotonic() - _T0) * 1000000)
+
+
+def ticks_diff(new, old):
+    return new - old
+
+
+def ticks_add(ticks, delta):
+    return ticks + delta
+
+
+def localtime(secs=None):
+    t = _time.localtime(secs)
+    return (t.tm_year, t.tm_mon, t.tm_mday, t.tm_hour, t.tm_min, t.tm_sec, t.tm_wday, t.tm_yday)
+
+
+def mktime(t):
+    return int(_time.mktime((t[0], t[1], t[2], t[3], t[4], t[5], 0, 0, -1)))
@@ -0,0 +1,38 @@
+"""Host stand-in for uzlib."""
+
+import zlib as _zlib
+
+
+def decompress(data, wbits=15):
+    return _zlib.decompress(data, wbits)
+
+
+class DecompIO:
+
+    def __init__(self, stream, wbits=0, dictbuf=None):
+        self.__stream = stream
+        self.__inflater = _zlib.decompressobj(wbits or 15)
+        self.__pending = b""
+
+    def read(self, size=-1):
+        while size < 0 or len(self.__pending) < size:
+            if self.__inflater.eof:
+                break
+            # Pull the source through readinto() like the device's stream protocol.
+            buf = bytearray(512)
+            n = self.__stream.readinto(buf)
+            chunk = bytes(buf[:n])
+            if not chunk:
+                self.__pending += self.__inflater.flush()
+                break
+            self.__pending += self.__inflater.decompress(chunk)
+        if size < 0:
+            size = len(self.__pending)
+        data, self.__pending = self.__pending[:size], self.__pending[size:]
+        return data
+
+    def readinto(self, buf, size=None):
+        size = len(buf) if size is None else size
+        data = self.read(size)
+        buf[:len(data)] = data
+        return len(data)
@@ -0,0 +1,26 @@
+"""Host stand-in for wifiScan, `aps` is the scan result as (BSSID, RSSI) pairs."""
+
+import time
+
+aps = [("F0:B4:29:86:95:C7", -79), ("44:00:4D:D5:26:E0", -92)]
+latency = 0.0
+scans = 0
+_enabled = 0
+
+
+def control(enable):
+    global _enabled
+    _enabled = enable
+    return 0
+
+
+def getState():
+    return _enabled
+
+
+def start():
+    global scans
+    scans += 1
+    if latency:
+        time.sleep(latency)
+    return (len(aps), list(aps))
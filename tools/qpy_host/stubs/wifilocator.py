@@ -0,0 +1,32 @@
+"""Host stand-in for wifilocator.
+
+getwifilocator() answers from `locations`, keyed by the strongest BSSID of
+the wifiScan stand-in, falling back to `location`. `latency`, `error` and
+`calls` work as in the cellLocator stand-in.
+"""
+
+import time
+
+import wifiScan
+
+location = (120.1739, 30.2718, 40)
+locations = {}
+latency = 0.0
+error = None
+calls = 0
+
+
+class wifilocator:
+
+    def __init__(self, token):
+        self.token = token
+
+    def getwifilocator(self):
+        global calls
+        calls += 1
+        if latency:
+            time.sleep(latency)
+        if error is not None:
+            return error
+        aps = sorted(wifiScan.aps, key=lambda i: i[1], reverse=True)
+        return locations.get(aps[0][0] if aps else None, location)
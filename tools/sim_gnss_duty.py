@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+@file      :sim_gnss_duty.py
+@brief     :GNSS on-time and TTFF of GNSSDutyCycle on recorded or synthetic traces.
+
+Replays a trace second by second through location.GNSSDutyCycle and a
+simple receiver model (hot start from standby, warm start from backup,
+cold start from power on) and prints, next to an always-on receiver:
+
+  * time on / standby / backup and number of wakeups
+  * TTFF per wakeup (mean / max)
+  * reports that had a usable fix (no older than --max-age, or than the
+    duty cycle's still_refresh while parked, as GPS.get_fix() does) and the
+    distance between the reported and the true position
+
+Trace CSV columns: t (s), lat, lon, speed (km/h), current (A, optional).
+
+Usage: python tools/sim_gnss_duty.py [--trace FILE.csv | --scenario commute|delivery|parked]
+                                     [--report 60] [--max-age 120] [--no-current]
+"""
+
+import argparse
+import csv
+import math
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import qpy_host  # noqa: E402
+
+TTFF = {"hot": 2, "warm": 25, "cold": 35}
+
+
+def _move(lat, lon, metres, heading):
+    lat += metres * math.cos(heading) / 110540.0
+    lon += metres * math.sin(heading) / (111320.0 * math.cos(math.radians(lat)))
+    return lat, lon
+
+
+def synthetic(scenario, seed=1):
+    """List of (t, lat, lon, speed, current) at 1 Hz."""
+    rnd = random.Random(seed)
+    plans = {
+        "commute": [("park", 3600), ("ride", 1200), ("park", 8 * 3600), ("ride", 1200), ("park", 3600)],
+        "delivery": [("park", 600)] + [("ride", 300), ("park", 180)] * 30 + [("park", 1800)],
+        "parked": [("park", 12 * 3600)],
+    }
+    lat, lon, t, rows = 31.2304, 121.4737, 0, []
+    heading = rnd.uniform(0, 2 * math.pi)
+    for kind, duration in plans[scenario]:
+        for _ in range(duration):
+            if kind == "ride":
+                speed = max(0.0, rnd.gauss(20, 4))
+                heading += rnd.gauss(0, 0.05)
+                lat, lon = _move(lat, lon, speed / 3.6, heading)
+                rows.append((t, lat, lon, speed, rnd.uniform(3, 8)))
+            else:
+                rows.append((t, lat, lon, 0.0, rnd.uniform(0, 0.2)))
+            t += 1
+    return rows
+
+
+def load(path):
+    rows = []
+    with open(path) as f:
+        for row in csv.DictReader(f):
+            rows.append((float(row["t"]), float(row["lat"]), float(row["lon"]), float(row["speed"]),
+                         float(row["current"]) if row.get("current") not in (None, "") else None))
+    return rows
+
+
+def simulate(rows, duty, report=60, max_age=120, use_current=True, seed=1):
+    rnd = random.Random(seed)
+    state, since, start_kind, fix, ticks = "on", rows[0][0], "cold", None, 0
+    ttffs, reports, errors = [], 0, []
+    on_time, next_report = 0, rows[0][0] + report
+    if duty is not None:
+        duty.set_next_report(next_report)
+    for t, lat, lon, speed, current in rows:
+        if duty is not None:
+            if use_current:
+                duty.set_current(current)
+            wanted = ("on", "standby", "backup")[duty.update(t, fix)]
+            if wanted != state:
+                if wanted == "on":
+                    start_kind = "hot" if state == "standby" else "warm"
+                    since = t
+                state = wanted
+        if state == "on":
+            on_time += 1
+            if start_kind is None or t - since >= TTFF[start_kind]:
+                if start_kind is not None:
+                    ttffs.append(t - since)
+                    start_kind = None
+                # Receiver noise: a few metres of jitter, speed noise when parked.
+                nlat, nlon = _move(lat, lon, abs(rnd.gauss(0, 3)), rnd.uniform(0, 2 * math.pi))
+                ticks += 1
+                fix = {"ticks": ticks, "time": t, "lat": nlat, "lon": nlon, "speed": abs(speed + rnd.gauss(0, 0.5))}
+        if t >= next_report:
+            reports += 1
+            age = max_age if duty is None or duty.moving else max(max_age, duty.still_refresh)
+            if fix is not None and t - fix["time"] <= age:
+                dlat, dlon = (fix["lat"] - lat) * 110540.0, (fix["lon"] - lon) * 111320.0 * math.cos(math.radians(lat))
+                errors.append(math.hypot(dlat, dlon))
+            next_report = t + report
+            if duty is not None:
+                duty.set_next_report(next_report)
+    total = len(rows)
+    return {
+        "on": on_time, "total": total, "ttff": ttffs, "reports": reports, "with_fix": len(errors),
+        "err_mean": sum(errors) / len(errors) if errors else 0.0, "err_max": max(errors) if errors else 0.0,
+        "stats": duty.stats if duty is not None else {"wakeups": 0},
+    }
+
+
+def show(name, res):
+    ttff = res["ttff"]
+    print("%-10s on %5.1f%% (%6d s of %d), wakeups %4d, TTFF mean %5.1fs max %3ds, reports with fix %d/%d, "
+          "position error mean %6.1fm max %7.1fm" % (
+              name, 100.0 * res["on"] / res["total"], res["on"], res["total"], res["stats"]["wakeups"],
+              sum(ttff) / len(ttff) if ttff else 0, max(ttff) if ttff else 0, res["with_fix"], res["reports"],
+              res["err_mean"], res["err_max"]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--trace", help="CSV trace, see above")
+    parser.add_argument("--scenario", default="commute", choices=("commute", "delivery", "parked"))
+    parser.add_argument("--report", type=int, default=60, help="report period in seconds")
+    parser.add_argument("--max-age", type=int, default=120, help="oldest fix a report may use")
+    parser.add_argument("--no-current", action="store_true", help="ignore the battery current hint")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    qpy_host.install()
+    from usr.location import GNSSDutyCycle
+    qpy_host.quiet()
+
+    rows = load(args.trace) if args.trace else synthetic(args.scenario, args.seed)
+    print("trace: %s, %d s" % (args.trace or args.scenario, len(rows)))
+    show("always-on", simulate(rows, None, args.report, args.max_age, seed=args.seed))
+    duty = GNSSDutyCycle()
+    res = simulate(rows, duty, args.report, args.max_age, not args.no_current, args.seed)
+    show("duty", res)
+    print("duty states: on %ds standby %ds backup %ds" % (res["stats"]["on"], res["stats"]["standby"], res["stats"]["backup"]))
+
+
+if __name__ == "__main__":
+    main()
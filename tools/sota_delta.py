@@ -0,0 +1,181 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+@file      :sota_delta.py
+@brief     :Build full and delta SOTA packages for the usr/ application.
+
+A package is a gzip'd ustar archive extracted by QuecOTA into
+/usr/.updater/usr/. A delta package holds, next to the files that are new
+or not worth patching, a ``.delta.json`` manifest and one ``.delta/<name>``
+patch per changed file. The device rebuilds each patched file from its
+current /usr/<name> and checks every MD5 in the manifest before staging.
+
+Patch format (little endian)::
+
+    b"QDP1" u32 target_size
+    b"C" u32 src_offset u32 length     copy from the installed file
+    b"A" u32 length <bytes>            literal data
+
+Usage:
+    python tools/sota_delta.py full NEW_DIR OUT.tar.gz
+    python tools/sota_delta.py delta OLD_DIR NEW_DIR OUT.tar.gz --base 2.1.0 [--target 2.1.1]
+"""
+
+import argparse
+import difflib
+import gzip
+import hashlib
+import io
+import json
+import os
+import struct
+import tarfile
+import time
+
+MAGIC = b"QDP1"
+MANIFEST = ".delta.json"
+PATCH_DIR = ".delta"
+
+
+def _md5(data):
+    return hashlib.md5(data).hexdigest()
+
+
+def _tree(root):
+    files = {}
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = sorted(d for d in dirnames if d != "__pycache__" and not d.startswith("."))
+        for name in sorted(filenames):
+            if name.endswith((".pyc", ".pyo")):
+                continue
+            path = os.path.join(dirpath, name)
+            with open(path, "rb") as f:
+                files[os.path.relpath(path, root).replace(os.sep, "/")] = f.read()
+    return files
+
+
+def make_patch(old, new):
+    """Line level copy/add patch turning old into new."""
+    a = old.splitlines(True)
+    b = new.splitlines(True)
+    offsets = [0]
+    for line in a:
+        offsets.append(offsets[-1] + len(line))
+    ops = []
+    pending = b""
+    for tag, i1, i2, j1, j2 in difflib.SequenceMatcher(None, a, b, autojunk=False).get_opcodes():
+        if tag == "equal":
+            if pending:
+                ops.append(b"A" + struct.pack("<I", len(pending)) + pending)
+                pending = b""
+            ops.append(b"C" + struct.pack("<II", offsets[i1], offsets[i2] - offsets[i1]))
+        elif j2 > j1:
+            pending += b"".join(b[j1:j2])
+    if pending:
+        ops.append(b"A" + struct.pack("<I", len(pending)) + pending)
+    return MAGIC + struct.pack("<I", len(new)) + b"".join(ops)
+
+
+def apply_patch(old, patch):
+    """Host side reference of the device applier, used to self-check generated patches."""
+    assert patch[:4] == MAGIC
+    size = struct.unpack_from("<I", patch, 4)[0]
+    out, pos = bytearray(), 8
+    while pos < len(patch):
+        op = patch[pos:pos + 1]
+        if op == b"C":
+            offset, length = struct.unpack_from("<II", patch, pos + 1)
+            out += old[offset:offset + length]
+            pos += 9
+        else:
+            length = struct.unpack_from("<I", patch, pos + 1)[0]
+            out += patch[pos + 5:pos + 5 + length]
+            pos += 5 + length
+    assert len(out) == size
+    return bytes(out)
+
+
+def _add(tar, name, data):
+    info = tarfile.TarInfo(name)
+    info.size = len(data)
+    info.mtime = int(time.time())
+    tar.addfile(info, io.BytesIO(data))
+
+
+def _add_dirs(tar, names, added):
+    for name in names:
+        parts = name.split("/")[:-1]
+        for i in range(1, len(parts) + 1):
+            path = "/".join(parts[:i])
+            if path not in added:
+                info = tarfile.TarInfo(path)
+                info.type = tarfile.DIRTYPE
+                tar.addfile(info)
+                added.add(path)
+
+
+def _package(entries):
+    buf = io.BytesIO()
+    with tarfile.open(fileobj=buf, mode="w", format=tarfile.USTAR_FORMAT) as tar:
+        added = set()
+        for name, data in entries:
+            _add_dirs(tar, [name], added)
+            _add(tar, name, data)
+    # QuecOTA skips a fixed 10 byte gzip header, so never store a file name.
+    return gzip.compress(buf.getvalue(), mtime=0)
+
+
+def make_full(new_dir):
+    return _package(sorted(_tree(new_dir).items()))
+
+
+def make_delta(old_dir, new_dir, base, target=""):
+    """Returns (package, manifest)."""
+    old, new = _tree(old_dir), _tree(new_dir)
+    entries, files = [], []
+    for name, data in sorted(new.items()):
+        if old.get(name) == data:
+            continue
+        item = {"name": name, "size": len(data), "md5": _md5(data)}
+        patch = make_patch(old[name], data) if name in old else None
+        if patch is not None and len(gzip.compress(patch)) < len(gzip.compress(data)):
+            assert apply_patch(old[name], patch) == data
+            item.update({"op": "patch", "src_md5": _md5(old[name])})
+            entries.append((PATCH_DIR + "/" + name, patch))
+        else:
+            item["op"] = "add"
+            entries.append((name, data))
+        files.append(item)
+    manifest = {"version": 1, "base": base, "target": target, "files": files}
+    entries.insert(0, (MANIFEST, json.dumps(manifest, separators=(",", ":")).encode()))
+    return _package(entries), manifest
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    full = sub.add_parser("full")
+    full.add_argument("new_dir")
+    full.add_argument("out")
+    delta = sub.add_parser("delta")
+    delta.add_argument("old_dir")
+    delta.add_argument("new_dir")
+    delta.add_argument("out")
+    delta.add_argument("--base", required=True, help="PROJECT_VERSION the delta applies to")
+    delta.add_argument("--target", default="")
+    args = parser.parse_args()
+
+    if args.cmd == "full":
+        package = make_full(args.new_dir)
+    else:
+        package, manifest = make_delta(args.old_dir, args.new_dir, args.base, args.target)
+        for item in manifest["files"]:
+            print("%-6s %s" % (item["op"], item["name"]))
+    with open(args.out, "wb") as f:
+        f.write(package)
+    print("%s: %d bytes, md5 %s" % (args.out, len(package), _md5(package)))
+
+
+if __name__ == "__main__":
+    main()
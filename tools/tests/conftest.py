@@ -0,0 +1,25 @@
+"""Host tests for code/, run under CPython on the qpy_host harness.
+
+Usage: python -m pytest tools/tests
+"""
+
+import os
+import sys
+
+import pytest
+
+TOOLS = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if TOOLS not in sys.path:
+    sys.path.insert(0, TOOLS)
+
+import qpy_host  # noqa: E402
+
+qpy_host.install()
+
+
+@pytest.fixture
+def usr_root(tmp_path):
+    """A fresh host directory backing "/usr/" for one test."""
+    root = qpy_host.install(fs_root=str(tmp_path / "usr"))
+    qpy_host.quiet("critical")
+    return root
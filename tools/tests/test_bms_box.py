@@ -0,0 +1,165 @@
+import threading
+import time
+from argparse import Namespace
+
+import pytest
+from bench_event_loop import build
+from bench_report import sif_public_frame
+
+
+@pytest.fixture
+def bms_box(usr_root):
+    # BMS data freshness is kept in whole seconds, leave the timeouts some room;
+    # the wake timeout is longer than the idle timeout like on the device.
+    bms_box = build(Namespace(report=5, idle=2, sleep=1))
+    bms_box._BmsBox__wake_timeout = 4
+    threading.Thread(target=bms_box.running, daemon=True).start()
+    return bms_box
+
+
+def wait_state(bms_box, state, timeout):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if bms_box.power_stats["state"] == state:
+            return True
+        time.sleep(0.05)
+    return False
+
+
+def frames(seconds, hz=5):
+    import sif
+    end = time.time() + seconds
+    while time.time() < end:
+        sif.inject(sif_public_frame())
+        time.sleep(1.0 / hz)
+
+
+def test_wake_ends_while_frames_flow_and_the_cloud_is_offline(bms_box):
+    import pm
+    import quecIot
+    from usr.modules import PowerManage
+    assert wait_state(bms_box, PowerManage._state.sleep, 10)
+    quecIot.sim.inject_outage(60)
+    woke = bms_box.power_stats["wakeups"]
+
+    # Frames keep the BMS fresh for longer than the wake timeout, no report can get out.
+    frames(6)
+    stats = bms_box.power_stats
+    assert stats["wakeups"] == woke + 1
+    assert stats["state"] == PowerManage._state.active
+    assert stats["wake_aborted"] >= 1
+    time.sleep(0.2)
+    assert not pm.held
+
+    # The pack goes quiet: idle then sleep again.
+    assert wait_state(bms_box, PowerManage._state.sleep, 10)
+    assert not pm.held
+
+
+def test_wake_with_a_quiet_bms_and_the_cloud_offline_sleeps_again(bms_box):
+    import pm
+    import quecIot
+    import sif
+    from usr.modules import PowerManage
+    assert wait_state(bms_box, PowerManage._state.sleep, 10)
+    quecIot.sim.inject_outage(60)
+    sif.inject(sif_public_frame())
+    assert wait_state(bms_box, PowerManage._state.wake, 2)
+    assert wait_state(bms_box, PowerManage._state.sleep, 6)
+    assert not pm.held
+
+
+def test_ota_events_are_not_dropped_by_a_full_loop(usr_root):
+    from usr.bms_box import BmsBox
+    bms_box = BmsBox()
+    loop = bms_box._BmsBox__loop
+    handled = []
+    bms_box._BmsBox__ota = lambda errcode, data: handled.append((errcode, data))
+    loop.add_handler(BmsBox._event.ota, bms_box._BmsBox__on_ota)
+
+    # Frames fill the queue, nothing consumes it yet.
+    posted = [loop.post(BmsBox._event.geofence, i) for i in range(20)]
+    assert posted.count(False) > 0
+    pieces = [(7, 10703, "['QuecPython', 4096, %d, 1024]" % (i * 1024)) for i in range(3)]
+    for args in pieces:
+        bms_box.execute(args)
+    assert loop.stats["dropped"] == posted.count(False)
+
+    while loop._EventLoop__queue.size():
+        loop.run_once()
+    assert handled == [args[1:] for args in pieces]
+    assert bms_box.downlink_stats["ota"] == 3
+
+
+def alarm_box():
+    from bench_alarm import build
+    return build(Namespace(ack_ms=20))
+
+
+def object_id(code):
+    """Object model id of a property or event code."""
+    import json
+    import os
+    from qpy_host import CODE
+    with open(os.path.join(CODE, "xingheng_object_model.json")) as f:
+        model = json.load(f)
+    return [i["id"] for i in model["properties"] + model["events"] if i["code"] == code][0]
+
+
+def wait_phymodel(start, timeout=5):
+    import quecIot
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        reports = [data for kind, data in quecIot.sim.reported[start:] if kind == "phymodel"]
+        if reports:
+            return reports
+        time.sleep(0.02)
+    return []
+
+
+def test_alarm_is_reported_when_the_loop_was_full(usr_root):
+    import quecIot
+    from usr.bms_box import BmsBox
+    bms_box = alarm_box()
+    loop = bms_box._BmsBox__loop
+    alarm = bms_box._BmsBox__alarm
+    assert [loop.post(BmsBox._event.geofence, i) for i in range(20)].count(False) > 0
+    start = len(quecIot.sim.reported)
+    alarm.update(["ovp"])
+    alarm.update(["ovp"])
+    assert alarm.active() == ["ovp"]
+
+    threading.Thread(target=bms_box.running, daemon=True).start()
+    reports = wait_phymodel(start)
+    assert [r for r in reports if object_id("ovp") in r]
+
+
+def test_alarm_raised_and_cleared_before_the_loop_runs_reports_both(usr_root):
+    import quecIot
+    bms_box = alarm_box()
+    alarm = bms_box._BmsBox__alarm
+    start = len(quecIot.sim.reported)
+    for faults in (["ovp"], ["ovp"], [], [], []):
+        alarm.update(faults)
+    assert alarm.active() == []
+
+    threading.Thread(target=bms_box.running, daemon=True).start()
+    reports = wait_phymodel(start)
+    assert [r for r in reports if object_id("ovp") in r and object_id("fault") in r]
+    assert bms_box.alarm_stats["raised"] == 1 and bms_box.alarm_stats["cleared"] == 1
+
+
+def test_query_answers_the_last_gps_position(usr_root):
+    import quecIot
+    from bench_query import set_fix
+    bms_box = alarm_box()
+    threading.Thread(target=bms_box.running, daemon=True).start()
+    time.sleep(1)
+    set_fix(bms_box)
+    start = len(quecIot.sim.reported)
+    quecIot.sim.downlink(10220, [object_id("gpsLocation"), object_id("gpsFixTime")])
+    reports = [r for r in wait_phymodel(start) if object_id("gpsLocation") in r]
+    assert reports
+    location = reports[0][object_id("gpsLocation")]
+    assert location[1] == 121473700 and location[2] == 31230400
+    assert location[3] == reports[0][object_id("gpsFixTime")]
@@ -0,0 +1,37 @@
+IN = {"lon": 121.4737, "lat": 31.2304}
+OUT = {"lon": 121.5737, "lat": 31.3304}
+
+
+def crossings(fence, count, start=1):
+    for i in range(count):
+        fix = dict(IN if (start + i) % 2 else OUT)
+        fix["timestamp"] = start + i
+        fence.check(fix)
+
+
+def new_geofence(max_events):
+    from usr.geofence import Geofence
+    fence = Geofence(file="/usr/geofence_test.txt", confirm=1, max_events=max_events)
+    fence.load_text("C,7,121.4737,31.2304,200")
+    return fence
+
+
+def test_ack_keeps_events_queued_after_events(usr_root):
+    fence = new_geofence(max_events=8)
+    crossings(fence, 3)
+    seen = fence.events()
+    assert [list(e)[0] for s, e in seen] == ["fenceIn", "fenceOut", "fenceIn"]
+    crossings(fence, 2, start=4)
+    fence.ack(seen[-1][0])
+    assert [e[list(e)[0]]["gpsFixTime"] for s, e in fence.events()] == [4, 5]
+
+
+def test_ack_after_overflow_drops_only_the_events_seen(usr_root):
+    fence = new_geofence(max_events=3)
+    crossings(fence, 3)
+    seen = fence.events()
+    # Overflow between events() and ack(): the first two seen are dropped.
+    crossings(fence, 2, start=4)
+    fence.ack(seen[-1][0])
+    assert [e[list(e)[0]]["gpsFixTime"] for s, e in fence.events()] == [4, 5]
+    assert fence.stats["dropped"] == 2
@@ -0,0 +1,314 @@
+import pytest
+
+
+def sentence(body):
+    checksum = 0
+    for c in body:
+        checksum ^= ord(c)
+    return "$%s*%02X" % (body, checksum)
+
+
+def rmc(hhmmss, lat):
+    return sentence("GNRMC,%s.000,A,%s,N,12128.4220,E,10.0,90.0,181026,,,A" % (hhmmss, lat))
+
+
+def gga(hhmmss):
+    return sentence("GNGGA,%s.000,3113.8240,N,12128.4220,E,1,12,0.80,12.3,M,8.5,M,," % hhmmss)
+
+
+STREAM = [rmc("120000", "3113.0001"), gga("120000"), rmc("120001", "3113.0002"), gga("120001"),
+          rmc("120002", "3113.0003"), gga("120002")]
+
+
+def test_set_gps_data_keeps_the_newest_sentence_of_each_type():
+    from usr.location import NMEAParse
+    parse = NMEAParse()
+    parse.set_gps_data("\r\n".join(STREAM) + "\r\n")
+    assert parse.GxRMC == STREAM[4]
+    assert parse.GxGGA == STREAM[5]
+    assert parse.GxRMCData[1] == "120002.000"
+
+
+def test_feed_keeps_the_newest_sentence_across_chunks():
+    from usr.location import NMEAParse
+    parse = NMEAParse(history=2)
+    data = "\r\n".join(STREAM) + "\r\n"
+    for i in range(0, len(data), 37):
+        parse.feed(data[i:i + 37])
+    assert parse.GxRMC == STREAM[4]
+    assert parse.history("RMC") == [STREAM[0], STREAM[2]]
+
+
+def test_bad_checksum_does_not_replace_the_newest_sentence():
+    from usr.location import NMEAParse
+    parse = NMEAParse()
+    broken = rmc("120003", "3113.0004")[:-2] + "00"
+    parse.set_gps_data("\r\n".join(STREAM + [broken]) + "\r\n")
+    assert parse.GxRMC == STREAM[4]
+
+
+def test_gps_fix_from_the_uart_is_the_newest_epoch(usr_root):
+    from usr.location import GPS
+    gps = GPS(1, 115200, 8, 0, 1, 0, 2, 0b000111, None, None, None)
+    gps.open()
+    try:
+        gps._GPS__external_obj.feed(("\r\n".join(STREAM) + "\r\n").encode())
+        gps._GPS__update_fix()
+        fix = gps.get_fix()
+    finally:
+        gps.close()
+    assert fix["nmea"][0] == STREAM[4]
+    assert round(fix["lat"], 6) == round(31 + 13.0003 / 60, 6)
+
+
+class SlowLocator:
+    def __init__(self, accuracy):
+        import threading
+        self.release = threading.Event()
+        self.reads = 0
+        self.accuracy = accuracy
+
+    def read(self):
+        self.reads += 1
+        self.release.wait(5)
+        return {"lon": 121.47, "lat": 31.23, "accuracy": self.accuracy, "timestamp": 0, "source": "cell"}
+
+
+def test_net_location_runs_requests_on_one_worker(usr_root, monkeypatch):
+    import _thread
+    import time
+    from usr.location import NetLocation
+    started = []
+    start_new_thread = _thread.start_new_thread
+    monkeypatch.setattr(_thread, "start_new_thread", lambda func, args: started.append(func) or start_new_thread(func, args))
+
+    cell = SlowLocator(500)
+    loc = NetLocation(cell=cell)
+    assert loc.request()
+    # A burst while the lookup runs is refused, not queued on new threads.
+    assert [loc.request() for i in range(20)] == [False] * 20
+    cell.release.set()
+    deadline = time.time() + 5
+    while loc.get() is None and time.time() < deadline:
+        time.sleep(0.01)
+    assert loc.get()["accuracy"] == 500
+    deadline = time.time() + 5
+    while not loc.request() and time.time() < deadline:
+        time.sleep(0.01)
+    time.sleep(0.1)
+    assert cell.reads == 2
+    assert len(started) == 1
+
+
+@pytest.mark.parametrize("name", ["CellLocation", "WifiLocation"])
+def test_cache_hit_is_stamped_with_the_time_it_was_served(usr_root, monkeypatch, name):
+    import utime
+    from usr import location
+    now = [1000]
+    monkeypatch.setattr(utime, "time", lambda: now[0])
+    locator = getattr(location, name)()
+    first = locator.read()
+    assert first["timestamp"] == 1000 and not first["cached"]
+    now[0] = 1600
+    hit = locator.read()
+    assert hit["timestamp"] == 1600 and hit["cached"]
+    assert (hit["lon"], hit["lat"]) == (first["lon"], first["lat"])
+    assert locator.stats["hits"] == 1 and locator.stats["lookups"] == 1
+    # The entry still expires cache_ttl after the lookup, not after the last hit.
+    now[0] = 1000 + 86401
+    assert not locator.read()["cached"]
+
+
+def test_gps_start_while_the_acquisition_thread_exits_keeps_acquiring(usr_root, monkeypatch):
+    import threading
+    import time
+    from usr.location import GPS
+    pollers = set()
+
+    def poll(self):
+        if self is gps:
+            pollers.add(threading.get_ident())
+        time.sleep(0.01)
+        return ""
+
+    class RacyGPS(GPS):
+        """Runs start() from another thread right when the exiting thread gives up its id."""
+
+        def __setattr__(self, name, value):
+            if name == "_GPS__acquire_thread_id" and value is None and getattr(self, "race", False):
+                self.race = False
+                racer = threading.Thread(target=self.start)
+                racer.start()
+                racer.join(0.2)
+            object.__setattr__(self, name, value)
+
+    monkeypatch.setattr(GPS, "_GPS__poll", poll)
+    gps = RacyGPS(1, 115200, 8, 0, 1, 0, 2, 0b000111, None, None, None)
+    gps.start()
+    time.sleep(0.05)
+    gps.race = True
+    gps.stop()
+    time.sleep(0.3)
+    pollers.clear()
+    time.sleep(0.1)
+    gps.stop()
+    assert len(pollers) == 1
+
+
+def test_gcj02_grid_interpolates_track_input_only():
+    import math
+    import random
+    from usr.location import GCJ02Grid, WGS84ToGCJ02, WGS84ToGCJ02Batch
+    rand = random.Random(1)
+    # Scattered points each land in a cell of their own and get the exact offset.
+    lons = [rand.uniform(75, 130) for i in range(200)]
+    lats = [rand.uniform(20, 50) for i in range(200)]
+    assert WGS84ToGCJ02Batch(lons, lats, GCJ02Grid()) == WGS84ToGCJ02Batch(lons, lats)
+    # A 1 Hz track crosses few cells, the interpolation stays within 0.1 m.
+    lons = [121.4737 + i * 0.00005 for i in range(2000)]
+    lats = [31.2304 + math.sin(i / 300.0) * 0.01 for i in range(2000)]
+    grid_lons, grid_lats = WGS84ToGCJ02Batch(lons, lats, GCJ02Grid())
+    for i in range(len(lons)):
+        lon, lat = WGS84ToGCJ02(lons[i], lats[i])
+        assert abs(grid_lons[i] - lon) * 111320 * math.cos(math.radians(lat)) < 0.1
+        assert abs(grid_lats[i] - lat) * 110574 < 0.1
+
+
+def duty_fix(ticks, speed=0.0, lat=31.2304, lon=121.4737):
+    return {"ticks": ticks, "lat": lat, "lon": lon, "speed": speed}
+
+
+def test_gnss_duty_cycle_follows_motion_reports_and_current():
+    from usr.location import GNSSDutyCycle
+    on, standby, backup = GNSSDutyCycle.state.on, GNSSDutyCycle.state.standby, GNSSDutyCycle.state.backup
+    duty = GNSSDutyCycle(still_time=120, backup_after=600, report_lead=10, backup_lead=30, fix_timeout=60,
+                         still_refresh=900)
+    assert duty.update(0, duty_fix(0, speed=20)) == on
+    # Parked: standby after still_time, backup after backup_after.
+    assert duty.update(110, duty_fix(110)) == on
+    assert duty.update(130) == standby and not duty.moving
+    assert duty.update(700) == backup
+
+    # A report while parked with a fix younger than still_refresh keeps it in backup.
+    duty.set_next_report(800)
+    assert duty.update(770) == backup
+    # One whose fix went stale wakes it backup_lead early, until a fresh fix arrives.
+    duty.set_next_report(1100)
+    assert duty.update(1060) == backup
+    assert duty.update(1070) == on
+    assert duty.update(1080, duty_fix(1080)) == backup
+    # A move of more than move_distance counts as motion even at low speed.
+    assert duty.update(1090, duty_fix(1090, lat=31.2310)) == on and duty.moving
+
+    # A pack that is being discharged means the vehicle is in use.
+    assert duty.update(1300) == standby
+    duty.set_current(-5.0)
+    assert duty.update(1310) == on
+    assert duty.stats["wakeups"] == 3
+    assert duty.stats["on"] + duty.stats["standby"] + duty.stats["backup"] == 1310
+
+
+def test_gcj02_to_wgs84_inverts_the_forward_transform():
+    import math
+    import random
+    from usr.location import GCJ02Grid, GCJ02ToWGS84, GCJ02ToWGS84Batch, WGS84ToGCJ02, WGS84ToGCJ02Batch
+    rand = random.Random(2)
+    lons = [rand.uniform(75, 130) for i in range(500)]
+    lats = [rand.uniform(20, 50) for i in range(500)]
+    gcj_lons, gcj_lats = WGS84ToGCJ02Batch(lons, lats)
+    assert (gcj_lons[0], gcj_lats[0]) == WGS84ToGCJ02(lons[0], lats[0])
+    wgs_lons, wgs_lats = GCJ02ToWGS84Batch(gcj_lons, gcj_lats)
+    for i in range(len(lons)):
+        # 1e-7 degree is about 1 cm.
+        assert abs(wgs_lons[i] - lons[i]) < 1e-7 and abs(wgs_lats[i] - lats[i]) < 1e-7
+        assert math.hypot(gcj_lons[i] - lons[i], gcj_lats[i] - lats[i]) > 1e-4
+    # Through the grid the round trip is as good as its interpolation, under 0.1 m.
+    grid = GCJ02Grid()
+    lon, lat = 121.4737, 31.2304
+    gcj_lon, gcj_lat = WGS84ToGCJ02(lon, lat)
+    for i in range(3):
+        wgs_lon, wgs_lat = GCJ02ToWGS84(gcj_lon, gcj_lat, grid=grid)
+        assert abs(wgs_lon - lon) < 1e-6 and abs(wgs_lat - lat) < 1e-6
+
+
+def segment_distance(p, a, b):
+    """Metres from point p to segment ab, points as (lon, lat) in microdegrees."""
+    import math
+    kx = 0.11132 * math.cos(math.radians(a[1] / 1000000))
+    ky = 0.11054
+    px, py = (p[0] - a[0]) * kx, (p[1] - a[1]) * ky
+    dx, dy = (b[0] - a[0]) * kx, (b[1] - a[1]) * ky
+    length2 = dx * dx + dy * dy
+    t = max(0.0, min(1.0, (px * dx + py * dy) / length2)) if length2 else 0.0
+    return math.hypot(px - t * dx, py - t * dy)
+
+
+def test_track_buffer_keeps_every_point_within_the_tolerance():
+    import math
+    import random
+    from usr.location import TrackBuffer
+    rand = random.Random(3)
+    track = TrackBuffer(capacity=1024, interval=1, tolerance=10, size=1024)
+    raw = []
+    lon, lat, heading = 121.4737, 31.2304, 0.0
+    for t in range(1000):
+        heading += rand.uniform(-0.2, 0.2)
+        lon += math.cos(heading) * 0.00006
+        lat += math.sin(heading) * 0.00005 + rand.uniform(-0.00002, 0.00002)
+        assert track.add({"timestamp": t, "lon": lon, "lat": lat, "speed": 20.0})
+        raw.append((t, int(lon * 1000000), int(lat * 1000000)))
+    assert not track.add({"timestamp": 999, "lon": lon, "lat": lat})
+
+    batch = track.batch()
+    points = batch["points"]
+    assert batch["end"] == 1000 and 2 < len(points) < len(raw) // 4
+    assert points[0][1] == 0 and points[-1][1] == 999
+    # Douglas-Peucker bound: every raw point lies within tolerance of the kept segment around it.
+    kept = [(p[1], p[2], p[3]) for p in points]
+    j = 0
+    for t, lon, lat in raw:
+        while kept[j + 1][0] < t:
+            j += 1
+        a, b = kept[j], kept[j + 1]
+        assert segment_distance((lon, lat), a[1:], b[1:]) <= 10.01
+
+    track.commit(batch)
+    assert len(track) == 0 and track.stats["uploaded"] == len(points)
+    assert track.stats["discarded"] == 1000 - len(points)
+
+
+def test_track_buffer_batches_up_to_size_and_overwrites_the_oldest():
+    from usr.location import TrackBuffer
+    track = TrackBuffer(capacity=8, interval=1, tolerance=0, size=3)
+    for t in range(10):
+        # A zigzag, so a zero tolerance keeps every point.
+        track.add({"timestamp": t, "lon": 121.0 + t * 0.001, "lat": 31.0 + (t % 2) * 0.001})
+    assert len(track) == 8 and track.stats["overwritten"] == 2
+    batch = track.batch()
+    assert [p[1] for p in batch["points"]] == [2, 3, 4]
+    # Points overwritten between batch() and commit() are not dropped twice.
+    track.add({"timestamp": 10, "lon": 121.01, "lat": 31.0})
+    track.commit(batch)
+    assert [p[1] for p in track.batch()["points"]] == [5, 6, 7]
+
+
+def test_nmea_assembler_joins_sentences_split_anywhere():
+    from usr.location import NMEAAssembler
+    data = ("\r\n".join(STREAM[:3]) + "\r\n").encode()
+    for cut in range(1, len(data)):
+        assembler = NMEAAssembler()
+        assert assembler.feed(data[:cut]) + assembler.feed(data[cut:]) == STREAM[:3]
+    assembler = NMEAAssembler()
+    assert sum([assembler.feed(data[i:i + 1]) for i in range(len(data))], []) == STREAM[:3]
+    assert assembler.stats["sentences"] == 3 and assembler.stats["bytes"] == len(data)
+
+
+def test_nmea_assembler_drops_bad_checksums_and_broken_sentences():
+    from usr.location import NMEAAssembler
+    bad = STREAM[0][:-2] + "00"
+    cut = STREAM[2][:20]
+    data = "\r\n".join([bad, STREAM[1], cut + STREAM[3], "$" + "X" * 200, STREAM[4]]) + "\r\n"
+    assembler = NMEAAssembler()
+    assert assembler.feed(data.encode()) == [STREAM[1], STREAM[3], STREAM[4]]
+    stats = assembler.stats
+    assert stats["checksum"] == 1 and stats["dropped"] == 2 and stats["sentences"] == 3
@@ -0,0 +1,238 @@
+import threading
+import time
+
+
+def wait_for(condition, timeout):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if condition():
+            return True
+        time.sleep(0.02)
+    return False
+
+
+def test_net_manage_reports_a_bearer_loss_and_the_modem_recovery(usr_root, monkeypatch):
+    import dataCall
+    from usr.modules import NetManage
+    monkeypatch.setattr(dataCall, "state", 1)
+    manage = NetManage(check_period=3600, grace=3)
+    changes = []
+    manage.add_callback(changes.append)
+    manage.start()
+    assert wait_for(manage.is_ready, 2)
+    assert manage.stats["attach_latency"] >= 0
+
+    dataCall.set_state(0)
+    assert wait_for(lambda: changes == [True, False], 2)
+    # The modem brings the bearer back by itself within the grace period.
+    threading.Timer(0.5, dataCall.set_state, (1,)).start()
+    assert wait_for(lambda: changes == [True, False, True], 5)
+    assert manage.stats["outages"] == 1 and manage.stats["last_outage"] >= 500
+
+
+def test_net_manage_reattaches_when_the_bearer_stays_down(usr_root, monkeypatch):
+    import dataCall
+    import net
+    from usr.modules import NetManage
+    monkeypatch.setattr(dataCall, "state", 1)
+    modem_fun = []
+
+    def set_modem_fun(fun, rst=0):
+        modem_fun.append(fun)
+        if fun == 1:
+            threading.Timer(0.2, dataCall.set_state, (1,)).start()
+        return 0
+
+    monkeypatch.setattr(net, "setModemFun", set_modem_fun)
+    manage = NetManage(check_period=3600, grace=1, attach_timeout=3)
+    manage.start()
+    assert wait_for(manage.is_ready, 2)
+
+    dataCall.set_state(0)
+    assert wait_for(lambda: not manage.is_ready(), 2)
+    assert wait_for(manage.is_ready, 6)
+    assert modem_fun == [4, 1]
+    assert manage.stats["last_attach_latency"] >= 0 and manage.stats["outages"] == 1
+
+
+class Wakelock:
+    def __init__(self):
+        self.held = 0
+        self.max_held = 0
+
+    def lock(self):
+        self.held += 1
+        self.max_held = max(self.max_held, self.held)
+
+    def unlock(self):
+        self.held -= 1
+
+
+def test_event_loop_merges_waiting_data_less_events_and_keeps_order(usr_root):
+    from usr.modules import EventLoop
+    loop = EventLoop(size=4)
+    handled = []
+    for event in (1, 2):
+        loop.add_handler(event, lambda data, event=event: handled.append((event, data)))
+    wakelock = Wakelock()
+    loop.set_wakelock(wakelock)
+
+    assert loop.post(1) and loop.post(1) and loop.post(2, "a") and loop.post(2, "b") and loop.post(2, "c")
+    # Full: a data event is refused, a data-less one still merges into the waiting one.
+    assert not loop.post(2, "d") and loop.post(1)
+    for i in range(4):
+        loop.run_once()
+    assert handled == [(1, None), (2, "a"), (2, "b"), (2, "c")]
+    # Event 1 got handled, a new post queues again.
+    assert loop.post(1)
+    loop.run_once()
+    assert handled[-1] == (1, None)
+    stats = loop.stats
+    assert stats["merged"] == 2 and stats["dropped"] == 1 and stats["events"] == {1: 2, 2: 3}
+    assert wakelock.held == 0 and wakelock.max_held == 1
+
+
+def test_event_loop_reserved_event_always_finds_its_slot(usr_root):
+    from usr.modules import EventLoop
+    loop = EventLoop(size=4)
+    handled = []
+    for event in (1, 8, 11):
+        loop.add_handler(event, lambda data, event=event: handled.append((event, data)))
+    loop.reserve(8)
+    loop.reserve(11)
+    loop.reserve(8)
+
+    # Two slots are kept, other events only fill the rest.
+    assert loop.post(1, "a") and loop.post(1, "b") and not loop.post(1, "c")
+    assert loop.post(8) and loop.post(11) and loop.post(8)
+    assert not loop.post(1)
+    for i in range(4):
+        loop.run_once()
+    assert handled == [(1, "a"), (1, "b"), (8, None), (11, None)]
+    assert loop.stats["merged"] == 1 and loop.stats["dropped"] == 2
+
+
+def test_event_loop_timer_posts_its_event(usr_root):
+    from usr.modules import EventLoop
+    loop = EventLoop()
+    handled = []
+    loop.add_handler(3, handled.append)
+    loop.start_timer(3, 50, periodic=True)
+    runner = threading.Thread(target=loop.run, daemon=True)
+    runner.start()
+    assert wait_for(lambda: len(handled) >= 3, 2)
+    loop.stop_timer(3)
+    time.sleep(0.1)
+    count = len(handled)
+    time.sleep(0.2)
+    assert len(handled) == count
+
+
+def test_scheduler_runs_due_tasks_in_one_wakeup_by_priority(usr_root):
+    from usr.modules import EventLoop, Scheduler
+    loop = EventLoop()
+    scheduler = Scheduler(loop, 7)
+    runs = []
+    scheduler.add("report", lambda: runs.append("report"), period=1, priority=3)
+    scheduler.add("device", lambda: runs.append("device"), period=0, delay=1, priority=1)
+    scheduler.add("ota", lambda: runs.append("ota"), period=3600, priority=5)
+    assert 900 <= scheduler.next_deadline() <= 1000
+    assert scheduler.next_deadline("ota") > 3500 * 1000
+
+    # Both tasks due at 1 s run in the same wakeup, lower priority first.
+    loop.run_once()
+    assert runs == ["device", "report"] and loop.stats["wakeups"] == 1
+    # The one-shot is done, the periodic one is due one period after its previous deadline.
+    loop.run_once()
+    assert runs == ["device", "report", "report"]
+    assert scheduler.stats["report"]["runs"] == 2 and scheduler.stats["device"]["runs"] == 1
+
+    # Reconfigured at runtime: a new period counts from now, 0 pauses the task.
+    assert scheduler.set_period("report", 0)
+    assert scheduler.next_deadline() > 3500 * 1000
+    assert scheduler.trigger("ota")
+    loop.run_once()
+    assert runs[-1] == "ota" and scheduler.next_deadline("ota") > 3500 * 1000
+    assert not scheduler.set_period("missing", 5)
+
+
+def test_scheduler_suspended_runs_what_came_due_on_resume(usr_root):
+    from usr.modules import EventLoop, Scheduler
+    loop = EventLoop()
+    scheduler = Scheduler(loop, 7)
+    runs = []
+    scheduler.add("report", lambda: runs.append(time.time()), period=3600, delay=0)
+    scheduler.suspend()
+    threading.Thread(target=loop.run, daemon=True).start()
+    time.sleep(0.3)
+    assert runs == []
+    start = time.time()
+    scheduler.resume()
+    assert wait_for(lambda: runs, 1)
+    assert runs[0] - start < 0.2
+
+
+def test_power_manage_runs_enter_handlers_once_and_holds_the_wakelock_while_waking(usr_root):
+    import pm
+    from usr.modules import PowerManage
+    state = PowerManage._state
+    power = PowerManage(name="test_pm_lock")
+    power.init()
+    fd = [k for k, v in pm.locks.items() if v == "test_pm_lock"][-1]
+    entered = []
+    for s in (state.active, state.idle, state.sleep, state.wake):
+        power.add_handler(s, lambda previous, s=s: entered.append((previous, s)))
+
+    assert power.set_state(state.idle) and not power.set_state(state.idle)
+    assert power.set_state(state.sleep)
+    assert fd not in pm.held
+    assert power.set_state(state.wake)
+    # The wakelock is held for the whole wake state, around work as well.
+    assert fd in pm.held
+    power.lock()
+    power.unlock()
+    assert fd in pm.held
+    time.sleep(0.05)
+    latency = power.woke()
+    assert latency >= 50 and power.state == state.active and fd not in pm.held
+    assert power.woke() is None
+    assert entered == [(state.active, state.idle), (state.idle, state.sleep), (state.sleep, state.wake),
+                       (state.wake, state.active)]
+
+    # A wake state left without a report counts as aborted.
+    power.set_state(state.sleep)
+    power.set_state(state.wake)
+    power.set_state(state.sleep)
+    stats = power.stats
+    assert stats["wakeups"] == 2 and stats["wake_aborted"] == 1 and stats["transitions"] == 7
+    assert stats["wake_latency"] == latency and stats["locked"] >= 50
+    assert fd not in pm.held
+
+
+def test_alarm_engine_debounces_raise_and_clear_per_fault(usr_root):
+    from usr.modules import AlarmEngine
+    alarm = AlarmEngine(debounce=2, clear=3, overrides={7: [1, 1]})
+    changes = []
+    alarm.set_callback(lambda raised, cleared, ticks: changes.append((sorted(raised), cleared, ticks)))
+
+    assert alarm.update([5]) == ([], [])
+    raised, cleared = alarm.update([5, 7])
+    assert sorted(raised) == [5, 7] and cleared == []
+    # The override clears fault 7 after one frame, fault 5 needs three.
+    assert alarm.update([5]) == ([], [7])
+    # A one frame gap in fault 5 is absorbed as a flap.
+    assert alarm.update([]) == ([], [])
+    assert alarm.update([5]) == ([], [])
+    assert alarm.update([]) == ([], []) and alarm.update([]) == ([], [])
+    assert alarm.update([]) == ([], [5])
+    assert alarm.active() == []
+    # A fault shorter than its debounce is never raised.
+    for faults in ([9], [], [9], []):
+        assert alarm.update(faults) == ([], [])
+
+    stats = alarm.stats
+    assert stats["frames"] == 12 and stats["raised"] == 2 and stats["cleared"] == 2 and stats["suppressed"] == 3
+    assert [change[:2] for change in changes] == [([5, 7], []), ([], [7]), ([], [5])]
+    time.sleep(0.05)
+    latency = alarm.reported(changes[0][2])
+    assert latency >= 50 and alarm.stats["latency"] == latency == alarm.stats["latency_max"]
@@ -0,0 +1,225 @@
+import hashlib
+import os
+import time
+
+import sota_delta
+
+
+def write_tree(root, files):
+    for name, data in files.items():
+        path = os.path.join(root, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(data)
+
+
+def apply(package, cutoff=None, md5=None, **kwargs):
+    """Run one OTA of package, pieces from cutoff on are never handed over."""
+    import app_fota_download
+    import quecIot
+    from usr.quecthing import QuecOTA
+
+    app_fota_download.staged[:] = []
+    quecIot.sim.reset()
+    quecIot.sim.load_ota(package, piece_size=4096)
+    ota = QuecOTA(**kwargs)
+    results = []
+    ota.set_callback(results.append)
+    ota.set_ota_info(len(package), md5 or hashlib.md5(package).hexdigest())
+
+    def callback(args):
+        if args[0] == 7 and args[1] == 10703:
+            data = eval(args[2])
+            if cutoff is None or data[2] < cutoff:
+                ota.start_ota(data[2], data[3])
+
+    quecIot.sim.callback = callback
+    quecIot.sim.next_piece()
+    deadline = time.time() + 30
+    while not results and time.time() < deadline:
+        time.sleep(0.01)
+    return results[0] if results else None
+
+
+def test_delta_with_nested_patches_removes_the_whole_delta_dir(usr_root, tmp_path):
+    from usr.quecthing import QuecOTA
+    body = b"".join([b"line %d\n" % i for i in range(200)])
+    old = {"bms_box.py": body, "lib/proto/frame.py": body}
+    new = {"bms_box.py": body + b"added\n", "lib/proto/frame.py": body.replace(b"line 7\n", b"line seven\n")}
+    old_dir, new_dir = str(tmp_path / "old"), str(tmp_path / "new")
+    write_tree(old_dir, old)
+    write_tree(new_dir, new)
+    write_tree(usr_root, old)
+    package, manifest = sota_delta.make_delta(old_dir, new_dir, base="")
+    assert sorted([(i["name"], i["op"]) for i in manifest["files"]]) == [("bms_box.py", "patch"),
+                                                                        ("lib/proto/frame.py", "patch")]
+
+    assert apply(package) == QuecOTA.result.success
+    updater = os.path.join(usr_root, ".updater", "usr")
+    assert not os.path.exists(os.path.join(updater, ".delta"))
+    with open(os.path.join(updater, "lib", "proto", "frame.py"), "rb") as f:
+        assert f.read() == new["lib/proto/frame.py"]
+
+
+def test_failed_delta_removes_the_whole_delta_dir(usr_root, tmp_path):
+    from usr.quecthing import QuecOTA
+    body = b"".join([b"line %d\n" % i for i in range(200)])
+    old_dir, new_dir = str(tmp_path / "old"), str(tmp_path / "new")
+    write_tree(old_dir, {"lib/proto/frame.py": body})
+    write_tree(new_dir, {"lib/proto/frame.py": body + b"added\n"})
+    # The installed file is not the delta base.
+    write_tree(usr_root, {"lib/proto/frame.py": body + b"local\n"})
+    package, _ = sota_delta.make_delta(old_dir, new_dir, base="")
+
+    assert apply(package) == QuecOTA.result.delta_failed
+    assert not os.path.exists(os.path.join(usr_root, ".updater", "usr", ".delta"))
+
+
+def test_ack_timeout_is_delivered_when_the_ack_queue_is_full(usr_root):
+    from usr.quecthing import QuecThing
+    cloud = QuecThing("pk", "ps", "dk", "ds", ack_timeout=1)
+    for _ in range(8):
+        cloud._QuecThing__set_report_res(0, True)
+    cloud._QuecThing__ack_timer_callback(None)
+    queue = cloud._QuecThing__ack_queue
+    acks = [queue.get() for _ in range(queue.size())]
+    assert acks[-1] == (None, False)
+
+
+def test_interrupted_download_resumes_from_the_checkpoint(usr_root, tmp_path):
+    import quecIot
+    from usr.quecthing import QuecOTA
+    files = {"bms_box.py": os.urandom(160 * 1024)}
+    new_dir = str(tmp_path / "new")
+    write_tree(new_dir, files)
+    package = sota_delta.make_full(new_dir)
+
+    assert apply(package, cutoff=96 * 1024, piece_timeout=1, resume=True) == QuecOTA.result.failed
+    assert os.path.exists(os.path.join(usr_root, "sotaFile.ckpt"))
+
+    assert apply(package, piece_timeout=1, resume=True) == QuecOTA.result.success
+    assert quecIot.sim.stats["fw_bytes"] <= len(package) - 64 * 1024
+    assert not os.path.exists(os.path.join(usr_root, "sotaFile.ckpt"))
+    assert not os.path.exists(os.path.join(usr_root, "sotaFile.tar.gz"))
+    with open(os.path.join(usr_root, ".updater", "usr", "bms_box.py"), "rb") as f:
+        assert f.read() == files["bms_box.py"]
+
+
+def test_download_without_resume_leaves_no_spool(usr_root, tmp_path):
+    from usr.quecthing import QuecOTA
+    new_dir = str(tmp_path / "new")
+    write_tree(new_dir, {"bms_box.py": os.urandom(64 * 1024)})
+    package = sota_delta.make_full(new_dir)
+
+    assert apply(package, cutoff=32 * 1024, piece_timeout=1) == QuecOTA.result.failed
+    assert not os.path.exists(os.path.join(usr_root, "sotaFile.tar.gz"))
+    assert not os.path.exists(os.path.join(usr_root, "sotaFile.ckpt"))
+
+
+def test_reconnect_backoff_doubles_with_equal_jitter_up_to_the_cap(usr_root):
+    from usr.quecthing import QuecThing
+    cloud = QuecThing("pk", "ps", "dk", "ds", reconnect_min=2, reconnect_max=300)
+    backoff = cloud._QuecThing__backoff
+    for attempt in range(20):
+        delay = min(300, 2 << attempt) * 1000
+        samples = [backoff(attempt) for i in range(50)]
+        assert delay // 2 <= min(samples) and max(samples) <= delay
+
+
+def test_cloud_reconnects_in_the_background_after_an_outage(usr_root):
+    import quecIot
+    from usr.quecthing import QuecThing
+    quecIot.sim.reset(ack_latency=0.01, connect_latency=0.02)
+    cloud = QuecThing("pk", "ps", "dk", "ds", reconnect_min=1, reconnect_max=1, connect_timeout=1)
+    states = []
+    cloud.on_state_change(states.append)
+    cloud.connect()
+    deadline = time.time() + 2
+    while not cloud.is_online() and time.time() < deadline:
+        time.sleep(0.02)
+    assert cloud.is_online() and cloud.objmodel_report({2: 50})
+
+    del states[:]
+    quecIot.sim.inject_outage(1.5)
+    deadline = time.time() + 8
+    while not (states and cloud.is_online()) and time.time() < deadline:
+        time.sleep(0.05)
+    assert cloud.is_online()
+    online = QuecThing._conn_state.online
+    disconnected = QuecThing._conn_state.disconnected
+    assert states[0] == disconnected and states[-1] == online
+    # The attempts inside the outage failed, the one after it went through.
+    assert quecIot.sim.stats["connects"] >= 3
+    assert cloud.objmodel_report({2: 51})
+    cloud.disconnect()
+
+
+def test_full_package_is_extracted_while_it_downloads(usr_root, tmp_path):
+    import app_fota_download
+    import quecIot
+    from usr.quecthing import QuecOTA
+    files = {"bms_box.py": os.urandom(20 * 1024), "lib/proto/frame.py": b"frame = 1\n" * 3000}
+    new_dir = str(tmp_path / "new")
+    write_tree(new_dir, files)
+    package = sota_delta.make_full(new_dir)
+
+    assert apply(package) == QuecOTA.result.success
+    # Read once, piece by piece, and never spooled whole to flash.
+    assert quecIot.sim.stats["fw_bytes"] == len(package)
+    assert not os.path.exists(os.path.join(usr_root, "sotaFile.tar.gz"))
+    assert sorted([dst for src, dst, size in app_fota_download.staged]) == ["/usr/bms_box.py", "/usr/lib/proto/frame.py"]
+    for name, data in files.items():
+        with open(os.path.join(usr_root, ".updater", "usr", name), "rb") as f:
+            assert f.read() == data
+
+
+def test_package_md5_mismatch_stages_nothing(usr_root, tmp_path):
+    import app_fota_download
+    from usr.quecthing import QuecOTA
+    new_dir = str(tmp_path / "new")
+    write_tree(new_dir, {"bms_box.py": b"print(1)\n" * 1000})
+    package = sota_delta.make_full(new_dir)
+
+    assert apply(package, md5="0" * 32) == QuecOTA.result.failed
+    assert app_fota_download.staged == []
+    assert not os.path.exists(os.path.join(usr_root, ".updater", "usr", "bms_box.py"))
+
+
+def stream_package(package, **kwargs):
+    """Read package through an _OTAStream in one piece, returns (data, stats)."""
+    import quecIot
+    from usr.quecthing import _OTAStream
+    quecIot.sim.reset()
+    quecIot.sim.load_ota(package)
+    pieces = [(0, len(package))]
+    stats = {"read": 0, "hash": 0, "downloaded": 0, "chunk_min": 4096, "chunk_max": 4096}
+    stream = _OTAStream(len(package), lambda: pieces.pop(0) if pieces else None, stats, **kwargs)
+    buf = bytearray(1000)
+    data = b""
+    while True:
+        n = stream.readinto(buf)
+        if not n:
+            break
+        data += bytes(buf[:n])
+    assert stream.md5 == hashlib.md5(package).hexdigest()
+    return data, stats
+
+
+def test_ota_stream_read_size_follows_the_link_and_free_memory(usr_root, monkeypatch):
+    import gc
+    import quecIot
+    package = os.urandom(256 * 1024)
+    # Fast reads double the read size up to max_readsize.
+    data, stats = stream_package(package, fast_us=10 ** 9)
+    assert data == package and stats["downloaded"] == len(package)
+    assert stats["chunk_max"] == 16384
+    assert quecIot.sim.stats["fw_read"] < len(package) // 8192
+
+    # Slow reads halve it down to min_readsize.
+    data, stats = stream_package(package, fast_us=0, slow_us=0)
+    assert data == package and stats["chunk_min"] == 1024 and stats["chunk_max"] == 4096
+
+    # So does low free memory, however fast the link.
+    monkeypatch.setattr(gc, "mem_free", lambda: 4 * 1024)
+    data, stats = stream_package(package, fast_us=10 ** 9)
+    assert data == package and stats["chunk_min"] == 1024 and stats["chunk_max"] == 4096
@@ -0,0 +1,130 @@
+import json
+import os
+
+# Keys added to the defaults after the first release, missing from settings files saved by it.
+ADDED = {
+    "user_cfg": ("cellVoltTimes", "deviceInfoTimes", "otaSearchTimes", "sota_delta", "sota_delta_failed", "alarm_cfg"),
+    "loc_cfg": ("fix_max_age", "duty_cfg", "track_cfg", "geofence_cfg", "cell_cfg", "wifi_cfg"),
+}
+
+
+def old_settings_file(usr_root):
+    from usr.settings import Settings
+    path = os.path.join(usr_root, "old_settings.json")
+    current = Settings(settings_file="/usr/defaults.json").get()
+    old = dict([(mode, dict(section)) for mode, section in current.items()])
+    for mode, keys in ADDED.items():
+        for key in keys:
+            old[mode].pop(key)
+    old["user_cfg"]["reportTimes"] = 30
+    old["loc_cfg"]["gps_cfg"] = dict(old["loc_cfg"]["gps_cfg"])
+    old["loc_cfg"]["gps_cfg"].pop("nmea")
+    with open(path, "w") as f:
+        json.dump(old, f)
+    return "/usr/old_settings.json", path
+
+
+def test_old_settings_file_gets_the_new_default_keys(usr_root):
+    from usr.settings import Settings, UserConfig
+    device_path, host_path = old_settings_file(usr_root)
+
+    settings = Settings(settings_file=device_path)
+    _settings = settings.get()
+    for mode, keys in ADDED.items():
+        for key in keys:
+            assert key in _settings[mode]
+    assert "nmea" in _settings["loc_cfg"]["gps_cfg"]
+    assert _settings["user_cfg"]["cellVoltTimes"] == UserConfig.cellVoltTimes
+    # Saved values win over the defaults.
+    assert _settings["user_cfg"]["reportTimes"] == 30
+
+    snapshot = settings.snapshot()
+    assert snapshot.user_cfg.otaSearchTimes == UserConfig.otaSearchTimes
+    assert snapshot.loc_cfg.fix_max_age == _settings["loc_cfg"]["fix_max_age"]
+    assert snapshot.user_cfg.alarm_cfg.debounce == UserConfig.alarm_cfg["debounce"]
+
+    # The upgrade is saved, so the next boot reads the full file.
+    with open(host_path) as f:
+        saved = json.load(f)
+    assert "deviceInfoTimes" in saved["user_cfg"] and "wifi_cfg" in saved["loc_cfg"]
+
+
+def test_new_keys_of_an_old_settings_file_can_be_set(usr_root):
+    from usr.settings import Settings
+    device_path, _ = old_settings_file(usr_root)
+    settings = Settings(settings_file=device_path)
+    changed = []
+    settings.subscribe(lambda snapshot, keys: changed.append(keys))
+    for key in ("cellVoltTimes", "deviceInfoTimes", "otaSearchTimes"):
+        assert settings.set("user_cfg", key, 120)
+    assert settings.snapshot().user_cfg.deviceInfoTimes == 120
+    assert changed == [[("user_cfg", "cellVoltTimes")], [("user_cfg", "deviceInfoTimes")],
+                       [("user_cfg", "otaSearchTimes")]]
+
+
+def test_current_settings_file_is_not_rewritten(usr_root):
+    from usr.settings import Settings
+    Settings(settings_file="/usr/current.json")
+    host_path = os.path.join(usr_root, "current.json")
+    mtime = os.stat(host_path).st_mtime_ns
+    os.utime(host_path, ns=(mtime - 10 ** 9, mtime - 10 ** 9))
+    Settings(settings_file="/usr/current.json")
+    assert os.stat(host_path).st_mtime_ns == mtime - 10 ** 9
+
+
+def test_cloud_set_of_new_period_keys_on_an_old_settings_file(usr_root):
+    from usr.bms_box import BmsBox
+    from usr.settings import Settings
+    device_path, host_path = old_settings_file(usr_root)
+    settings = Settings(settings_file=device_path)
+    bms_box = BmsBox()
+    bms_box.add_module(settings)
+    bms_box._BmsBox__set_config({"cellVoltTimes": 300, "deviceInfoTimes": 600, "otaSearchTimes": 900})
+    with open(host_path) as f:
+        saved = json.load(f)["user_cfg"]
+    assert (saved["cellVoltTimes"], saved["deviceInfoTimes"], saved["otaSearchTimes"]) == (300, 600, 900)
+
+
+def test_set_publishes_a_new_copy_and_keeps_old_snapshots(usr_root):
+    from usr.settings import Settings
+    settings = Settings(settings_file="/usr/cow.json")
+    before = settings.snapshot()
+    _before = settings.get()
+    report_times = before.user_cfg.reportTimes
+
+    assert settings.set("user_cfg", "reportTimes", report_times + 10)
+    after = settings.snapshot()
+    assert after.version == before.version + 1 == settings.version
+    assert after.user_cfg.reportTimes == report_times + 10
+    # What was handed out before the change still reads the old values.
+    assert before.user_cfg.reportTimes == _before["user_cfg"]["reportTimes"] == report_times
+    assert before.version == after.version - 1
+    # Only the changed section is copied.
+    assert settings.get()["loc_cfg"] is _before["loc_cfg"]
+    assert settings.get()["user_cfg"] is not _before["user_cfg"]
+
+    # Same value or a refused one publishes nothing.
+    assert settings.set("user_cfg", "reportTimes", report_times + 10)
+    assert not settings.set("user_cfg", "reportTimes", -1)
+    assert settings.snapshot() is after
+
+
+def test_subscribers_see_every_change_and_a_failing_one_does_not_stop_the_others(usr_root):
+    from usr.settings import Settings
+    settings = Settings(settings_file="/usr/subscribers.json")
+    seen = []
+
+    def failing(snapshot, changed):
+        raise ValueError("subscriber")
+
+    assert not settings.subscribe(None)
+    assert settings.subscribe(failing)
+    assert settings.subscribe(lambda snapshot, changed: seen.append((snapshot.version, changed)))
+    version = settings.version
+
+    assert settings.set("loc_cfg", "fix_max_age", 42)
+    assert settings.set("loc_cfg", "fix_max_age", 42)
+    assert not settings.set("loc_cfg", "missing", 1)
+    assert settings.reset()
+    assert seen == [(version + 1, [("loc_cfg", "fix_max_age")]), (version + 2, [])]
+    assert settings.snapshot().loc_cfg.fix_max_age != 42